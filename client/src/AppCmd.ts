@@ -11,7 +11,6 @@ import {
     startRound,
     startNextQuestion,
     answerQuestion,
-    endQuestion,
     updateProfile
 } from './Service';
 
@@ -155,10 +154,8 @@ export function handleAppCmd(stateEvents$: Subject<AppStateEvent>, [cmd, state]:
 
         case 'LockQuestion':
             if (guard(state.activeLobby) && guard(state.activeLobby.activeRound) && guard(state.activeLobby.activeRound.currentQuestion)) {
-                if (state.activeLobby.isHost) {
-                    endQuestion(state.activeLobby.id, state.activeLobby.activeRound.currentQuestion.i);
-                }
-
+                // The server ends the question itself once answers lock, and
+                // sends the correct answer in QUESTION_ENDED
                 state.activeLobby.activeRound.currentQuestion.hasEnded = true;
                 stateEvents$.next({
                     code: 'CURRENT_QUESTION_UPDATED',
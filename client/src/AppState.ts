@@ -17,6 +17,7 @@ export type AppStateEvent =
     { code: 'ACTIVE_ROUND_UPDATED', data: PlainRound } |
     { code: 'CURRENT_QUESTION_UPDATED', data: PlainCurrentQuestionMetadata } |
     { code: 'ANSWER_RECEIVED', data: { answer: string, userID: string } } |
+    { code: 'QUESTION_ENDED', data: { i: number, correctAnswer: string } } |
     { code: 'LEADERBOARD_UPDATED', data: Leaderboard } |
     { code: 'CLEAR_PREVIOUS_ANSWERS' } |
     { code: 'ACTIVE_ROUND_ENDED' } |
@@ -58,6 +59,17 @@ export const handleAppStateEvent: AppStateHandler = ([stateEvent, state]) => {
                 state.activeLobby.activeRound.leaderboard[stateEvent.data.userID].previousAnswer = stateEvent.data.answer;
             }
             return state;
+        case 'QUESTION_ENDED':
+            if (state.activeLobby && state.activeLobby.activeRound) {
+                const activeRound = state.activeLobby.activeRound;
+                activeRound.questions[stateEvent.data.i].correctAnswer = stateEvent.data.correctAnswer;
+
+                if (activeRound.currentQuestion && activeRound.currentQuestion.i === stateEvent.data.i) {
+                    activeRound.currentQuestion.hasEnded = true;
+                    activeRound.currentQuestion.correctAnswer = stateEvent.data.correctAnswer;
+                }
+            }
+            return state;
         case 'LEADERBOARD_UPDATED':
             if (state.activeLobby && state.activeLobby.activeRound) {
                 const activeRound = state.activeLobby.activeRound;
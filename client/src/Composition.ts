@@ -1,6 +1,6 @@
 /* eslint react-hooks/rules-of-hooks: 0 */
 import { BehaviorSubject, fromEvent } from 'rxjs';
-import { map, withLatestFrom } from 'rxjs/operators';
+import { map, take, withLatestFrom } from 'rxjs/operators';
 
 import YouTube from 'react-youtube';
 
@@ -28,6 +28,9 @@ import ProfileScreen, { processProfileImage } from './Screen/ProfileScreen';
 import Lobby from './Model/Lobby';
 import lifecycle from 'page-lifecycle';
 
+const MAX_RECONNECT_DELAY_MS = 30000;
+const SLOW_CONSUMER_RECONNECT_DELAY_MS = 1000;
+
 export function composeApp(handshakeData: HandshakeData): React.FunctionComponent {
     const areCommandsDisabled$ = new BehaviorSubject(false);
 
@@ -80,9 +83,43 @@ export function composeApp(handshakeData: HandshakeData): React.FunctionComponen
         }
     });
 
-    function setupActiveLobbyWebSocket(activeLobby: Lobby) {
-        const socket = setupLobbyWebSocket(stateEvents$, activeLobby.id);
+    let reconnectTimeout: number | undefined;
+
+    function setupActiveLobbyWebSocket(activeLobby: Lobby, retryAfterMs?: number) {
+        window.clearTimeout(reconnectTimeout);
+
+        const socket = setupLobbyWebSocket(stateEvents$, activeLobby.id, {
+            onServerDraining: (reconnectAfterMs) => reconnectToLobby(activeLobby, reconnectAfterMs),
+            onResyncRequired: () => sendCmd({ cmd: 'SyncStateWithServer' }),
+            // Reconnecting syncs state once the new socket opens
+            onSlowConsumer: () => reconnectToLobby(activeLobby, SLOW_CONSUMER_RECONNECT_DELAY_MS)
+        });
         closeSocket = socket.close.bind(socket);
+
+        if (retryAfterMs !== undefined) {
+            let opened = false;
+            socket.addEventListener('open', () => {
+                opened = true;
+                sendCmd({ cmd: 'SyncStateWithServer' });
+            });
+            socket.addEventListener('close', () => {
+                if (!opened) {
+                    reconnectToLobby(activeLobby, Math.min(retryAfterMs * 2, MAX_RECONNECT_DELAY_MS));
+                }
+            });
+        }
+    }
+
+    // Only reconnects if the user is still in the same lobby
+    function reconnectToLobby(lobby: Lobby, delayMs: number) {
+        window.clearTimeout(reconnectTimeout);
+        reconnectTimeout = window.setTimeout(() => {
+            activeLobby$.pipe(take(1)).subscribe(activeLobby => {
+                if (activeLobby && activeLobby.id === lobby.id) {
+                    setupActiveLobbyWebSocket(activeLobby, delayMs);
+                }
+            });
+        }, delayMs);
     }
 
     const isCommandPending$ = state$.pipe(map(x => x.pendingCommand !== null));
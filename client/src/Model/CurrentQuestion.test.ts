@@ -104,6 +104,28 @@ test('hasEndedOnServer$ takes latest unique value from latestMetaData$', () => {
     expect(subscribeSpy).toHaveBeenCalledTimes(3);
 });
 
+test('correctAnswer$ takes the answer revealed in latestMetaData$', () => {
+    const latestMetaData$ = new BehaviorSubject(createPlainCurrentQuestionMetadata());
+    const currentQuestion = new CurrentQuestion(
+        jest.fn(),
+        [createQuestion({ correctAnswer: null })],
+        createPlainCurrentQuestionMetadata(),
+        latestMetaData$
+    );
+
+    const subscribeSpy = jest.fn();
+    currentQuestion.correctAnswerIndex$.subscribe(subscribeSpy);
+
+    expect(subscribeSpy).toHaveBeenLastCalledWith(-1);
+
+    latestMetaData$.next(createPlainCurrentQuestionMetadata({
+        hasEnded: true,
+        correctAnswer: '2'
+    }));
+
+    expect(subscribeSpy).toHaveBeenLastCalledWith(1);
+});
+
 test('endQuestion() sends EndFinalQuestion command when it is the final question', () => {
     const cmdBusSpy = jest.fn();
 
@@ -20,13 +20,15 @@ export type Question = {
     answerText1: string,
     answerText2: string,
     answerText3: string,
-    correctAnswer: string
+    // The server withholds this until the question ends
+    correctAnswer: string | null
 };
 
 export type PlainCurrentQuestionMetadata = {
     i: number,
     startTime: MillisecondsEpoch,
-    hasEnded: boolean
+    hasEnded: boolean,
+    correctAnswer?: string | null
 }
 
 export type PlainCurrentQuestion = PlainCurrentQuestionMetadata & Question;
@@ -51,8 +53,8 @@ class CurrentQuestion {
     videoAnswerRevealedPostion: Seconds;
     videoEndPosition: Seconds;
     answerOptions: string[];
-    correctAnswer: string;
-    correctAnswerIndex: number;
+    correctAnswer$: Observable<string | null>;
+    correctAnswerIndex$: Observable<number>;
     isFinalQuestion: boolean;
 
     constructor(
@@ -75,8 +77,13 @@ class CurrentQuestion {
             questionData.answerText2,
             questionData.answerText3
         ];
-        this.correctAnswer = questionData.correctAnswer;
-        this.correctAnswerIndex = ['1', '2', '3'].indexOf(questionData.correctAnswer);
+        this.correctAnswer$ = latestMetaData$.pipe(
+            map(x => x.correctAnswer ?? questionData.correctAnswer),
+            distinctUntilChanged()
+        );
+        this.correctAnswerIndex$ = this.correctAnswer$.pipe(
+            map(x => x === null ? -1 : ['1', '2', '3'].indexOf(x))
+        );
         this.hasEndedOnServer$ = latestMetaData$.pipe(
             map(x => x.hasEnded),
             distinctUntilChanged()
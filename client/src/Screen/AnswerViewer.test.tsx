@@ -76,6 +76,7 @@ test('it indicates selected answer', () => {
 test('it calls answerQuestion with clicked answerIndex', () => {
     const mockQuestion = mock<CurrentQuestion>();
     mockQuestion.hasEndedOnServer$ = of(false);
+    mockQuestion.correctAnswerIndex$ = of(-1);
     mockQuestion.answerOptions = ['Answer 1', 'Answer 2'];
 
     useQuestionTimings.mockReturnValue(createTimings(2));
@@ -91,6 +92,7 @@ test('it calls answerQuestion with clicked answerIndex', () => {
 test('it disables answering at answerLockTime', () => {
     const mockQuestion = mock<CurrentQuestion>();
     mockQuestion.hasEndedOnServer$ = of(false);
+    mockQuestion.correctAnswerIndex$ = of(-1);
     mockQuestion.answerOptions = ['Answer 1'];
 
     useQuestionTimings.mockReturnValue(createTimings(3));
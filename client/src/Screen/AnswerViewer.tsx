@@ -1,6 +1,7 @@
 import { useState } from 'react';
 import { CommandButtonProps } from '../Component/CommandButton';
 import { QuestionTimingsHook } from '../Hook/QuestionTimingsHook';
+import { useObservable } from '../Lib/RxReact';
 import CurrentQuestion from '../Model/CurrentQuestion';
 
 export type AnswerViewerProps = {
@@ -15,6 +16,7 @@ function AnswerViewer(
     const [selectedAnswerIndex, setSelectedAnswerIndex] = useState<number | null>(null);
 
     const timings = useQuestionTimings(question);
+    const correctAnswerIndex = useObservable(question.correctAnswerIndex$);
 
     function handleAnswerButton(event: React.MouseEvent<HTMLButtonElement>) {
         const answerData = event.currentTarget.getAttribute('data-answer');
@@ -35,7 +37,7 @@ function AnswerViewer(
         }
 
         if (timings.revealAnswer) {
-            classes.push(answerIndex === question.correctAnswerIndex ? 'correct-answer' : 'incorrect-answer');
+            classes.push(answerIndex === correctAnswerIndex ? 'correct-answer' : 'incorrect-answer');
         }
 
         return classes.join(' ');
@@ -49,7 +51,7 @@ function AnswerViewer(
         }
 
         if (timings.revealAnswer) {
-            classes.push(selectedAnswerIndex === question.correctAnswerIndex ? 'correct' : 'incorrect');
+            classes.push(selectedAnswerIndex === correctAnswerIndex ? 'correct' : 'incorrect');
         }
 
         return classes.join(' ');
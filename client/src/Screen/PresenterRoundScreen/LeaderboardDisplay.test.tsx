@@ -66,7 +66,7 @@ test('classes are added to previous answers when revealAnswer timing passes', ()
 
     const currentQuestion = mock<CurrentQuestion>();
     currentQuestion.hasEndedOnServer$ = new BehaviorSubject(true);
-    currentQuestion.correctAnswer = 'Correct Answer';
+    currentQuestion.correctAnswer$ = new BehaviorSubject<string | null>('Correct Answer');
 
     useQuestionTimings = mockHook<QuestionTimingsHook<CurrentQuestion>>(createTimings(3));
 
@@ -99,6 +99,7 @@ test('leaderboard position and score updates are ignored until revealAnswer timi
 
     const currentQuestion = mock<CurrentQuestion>();
     currentQuestion.hasEndedOnServer$ = new BehaviorSubject(true);
+    currentQuestion.correctAnswer$ = new BehaviorSubject<string | null>(null);
 
     useQuestionTimings = mockHook<QuestionTimingsHook<CurrentQuestion>>(createTimings(3));
 
@@ -142,6 +143,7 @@ test('previousAnswer updates are available when answering is locked', () => {
 
     const currentQuestion = mock<CurrentQuestion>();
     currentQuestion.hasEndedOnServer$ = new BehaviorSubject(true);
+    currentQuestion.correctAnswer$ = new BehaviorSubject<string | null>(null);
 
     useQuestionTimings = mockHook<QuestionTimingsHook<CurrentQuestion>>(createTimings(3));
 
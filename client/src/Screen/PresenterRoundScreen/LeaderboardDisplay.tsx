@@ -16,19 +16,20 @@ function LeaderboardDisplay(
     { currentQuestion, leaderboard, users }: LeaderboardDisplayProps
 ) {
     const hasEndedOnServer = useObservable(currentQuestion?.hasEndedOnServer$);
+    const correctAnswer = useObservable(currentQuestion.correctAnswer$);
     const timings = useQuestionTimings(currentQuestion);
     const [leaderboardForDisplay, setLeaderboardForDisplay] = useState(leaderboard);
 
     function getAnswerClasses(item: LeaderboardItem) {
         if (timings.revealAnswer) {
-            return item.previousAnswer === currentQuestion.correctAnswer ? 'correct' : 'incorrect';
+            return item.previousAnswer === correctAnswer ? 'correct' : 'incorrect';
         } else {
             return '';
         }
     }
 
     function getProfileImageSrc(profile: Profile): string {
-        return '/api/profile_images/' + profile.imageFilename;
+        return '/api/profile_images/thumbnails/' + profile.imageFilename;
     }
 
     useEffect(() => {
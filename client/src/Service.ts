@@ -15,8 +15,19 @@ export type ServerMessage =
     { code: 'ROUND_STARTED', data: any } |
     { code: 'QUESTION_STARTED', data: any } |
     { code: 'ANSWER_RECEIVED', data: any } |
+    { code: 'QUESTION_ENDED', data: any } |
     { code: 'LEADERBOARD_UPDATED', data: any } |
-    { code: 'ROUND_ENDED', data: any };
+    { code: 'ROUND_ENDED', data: any } |
+    { code: 'SERVER_DRAINING', data: { reconnect_after: number } } |
+    { code: 'RESYNC_REQUIRED', data: {} } |
+    { code: 'SLOW_CONSUMER', data: {} };
+
+// Messages about the socket itself, rather than lobby state
+export type LobbySocketHandlers = {
+    onServerDraining: (reconnectAfterMs: number) => void,
+    onResyncRequired: () => void,
+    onSlowConsumer: () => void
+};
 
 export type HandshakeData = {
     userID: string,
@@ -100,77 +111,117 @@ export function answerQuestion(lobbyID: string, questionIndex: number, answer: s
     });
 }
 
-export function endQuestion(lobbyID: string, questionIndex: number) {
-    post(`/api/lobby/${lobbyID}/end_question`, {
-        question_index: questionIndex,
-    });
-}
-
 export function updateProfile(displayName: string, imgDataUrl: string): Promise<Profile> {
-    return post('/api/update_profile', {
+    return fetch(imgDataUrl)
+        .then(image => image.blob())
+        .then(imageBlob => fetch('/api/profile_image', {
+            method: 'POST',
+            headers: {
+                'Content-Type': imageBlob.type
+            },
+            body: imageBlob
+        }))
+        .then(response => response.json())
+        .then(imageData => post('/api/update_profile', {
             display_name: displayName,
-            image_data_url: imgDataUrl
-        })
+            image_filename: imageData['image_filename']
+        }))
         .then(response => response.json())
         .then(createProfileFromData);
 }
 
-export function setupLobbyWebSocket(stateEvents$: Subject<AppStateEvent>, id: string) {
-    return subscribeToServer(`/api/lobby/${id}/ws`, (event) => {
-        const message = JSON.parse(event.data) as ServerMessage;
-
-        switch (message.code) {
-            case 'USER_JOINED':
-            case 'USER_EXITED':
-                stateEvents$.next({
-                    code: 'ACTIVE_LOBBY_UPDATED',
-                    data: createLobbyFromLobbyData(message.data.lobby)
-                });
-                break;
-            case 'LOBBY_CLOSED':
-                stateEvents$.next({
-                    code: 'ACTIVE_LOBBY_UPDATED',
-                    data: null
-                });
-                break;
-            case 'ROUND_STARTED':
-                stateEvents$.next({
-                    code: 'ACTIVE_ROUND_UPDATED',
-                    data: createRoundFromRoundData(message.data)
-                });
-                break;
-            case 'QUESTION_STARTED':
-                stateEvents$.next({
-                    code: 'CURRENT_QUESTION_UPDATED',
-                    data: createPlainCurrentQuestionMetadata(message.data)
-                });
-                break;
-            case 'ANSWER_RECEIVED':
-                stateEvents$.next({
-                    code: 'ANSWER_RECEIVED',
-                    data: {
-                        answer: message.data['answer'],
-                        userID: message.data['user_id']
-                    }
-                });
-                break;
-            case 'LEADERBOARD_UPDATED':
-                stateEvents$.next({
-                    code: 'LEADERBOARD_UPDATED',
-                    data: createLeaderboardFromData(message.data)
-                });
-                break;
-            case 'ROUND_ENDED':
-                // TODO: Some kind of pending previous round state?
-                break;
-            default:
-                // "Not assignable to never" error indicates non-exhaustive switch
-                const checkExhaustive: never = message;
-                console.error('Unhandled ServerMessage', checkExhaustive);
-        }
+export function setupLobbyWebSocket(
+    stateEvents$: Subject<AppStateEvent>,
+    id: string,
+    handlers: LobbySocketHandlers
+) {
+    // With frame_batch, events queued together arrive as one array
+    return subscribeToServer(`/api/lobby/${id}/ws?features=frame_batch`, (event) => {
+        const data = JSON.parse(event.data);
+        const messages = (Array.isArray(data) ? data : [data]) as ServerMessage[];
+        messages.forEach(message => handleServerMessage(stateEvents$, handlers, message));
     });
 }
 
+function handleServerMessage(
+    stateEvents$: Subject<AppStateEvent>,
+    handlers: LobbySocketHandlers,
+    message: ServerMessage
+) {
+    switch (message.code) {
+        case 'USER_JOINED':
+        case 'USER_EXITED':
+            stateEvents$.next({
+                code: 'ACTIVE_LOBBY_UPDATED',
+                data: createLobbyFromLobbyData(message.data.lobby)
+            });
+            break;
+        case 'LOBBY_CLOSED':
+            stateEvents$.next({
+                code: 'ACTIVE_LOBBY_UPDATED',
+                data: null
+            });
+            break;
+        case 'ROUND_STARTED':
+            stateEvents$.next({
+                code: 'ACTIVE_ROUND_UPDATED',
+                data: createRoundFromRoundData(message.data)
+            });
+            break;
+        case 'QUESTION_STARTED':
+            stateEvents$.next({
+                code: 'CURRENT_QUESTION_UPDATED',
+                data: createPlainCurrentQuestionMetadata(message.data)
+            });
+            break;
+        case 'ANSWER_RECEIVED':
+            stateEvents$.next({
+                code: 'ANSWER_RECEIVED',
+                data: {
+                    answer: message.data['answer'],
+                    userID: message.data['user_id']
+                }
+            });
+            break;
+        case 'QUESTION_ENDED':
+            stateEvents$.next({
+                code: 'QUESTION_ENDED',
+                data: {
+                    i: message.data['i'],
+                    correctAnswer: message.data['correct_answer']
+                }
+            });
+            break;
+        case 'LEADERBOARD_UPDATED':
+            stateEvents$.next({
+                code: 'LEADERBOARD_UPDATED',
+                data: createLeaderboardFromData(message.data)
+            });
+            break;
+        case 'ROUND_ENDED':
+            // TODO: Some kind of pending previous round state?
+            break;
+        case 'SERVER_DRAINING':
+            // The server closes the socket next, and asks for a delay so
+            // clients don't all reconnect at once
+            handlers.onServerDraining(message.data.reconnect_after * 1000);
+            break;
+        case 'RESYNC_REQUIRED':
+            // Events queued for this socket were dropped, so the state they
+            // carried has to be fetched again
+            handlers.onResyncRequired();
+            break;
+        case 'SLOW_CONSUMER':
+            // The server gave up on this socket and closes it next
+            handlers.onSlowConsumer();
+            break;
+        default:
+            // "Not assignable to never" error indicates non-exhaustive switch
+            const checkExhaustive: never = message;
+            console.error('Unhandled ServerMessage', checkExhaustive);
+    }
+}
+
 function createLobbyFromLobbyData(lobbyData: any): PlainLobby {
     return {
         id: lobbyData['id'] as string,
@@ -215,7 +266,7 @@ function createQuestionFromQuestionData(questionData: any): Question {
         answerText1: questionData['answer_text_1'] as string,
         answerText2: questionData['answer_text_2'] as string,
         answerText3: questionData['answer_text_3'] as string,
-        correctAnswer: questionData['correct_answer'] as string,
+        correctAnswer: (questionData['correct_answer'] ?? null) as string | null,
     };
 }
 
@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import aiohttp
+
+from request_helpers import handshake_session
+
+# Plays whole quiz games against a running server: every lobby has a host
+# and players who handshake, join, subscribe, then play a round. Each level
+# of the sweep runs more lobbies at once. Broadcast lag needs the server
+# started with FRAME_TIMESTAMPS=1 on the same host, to share a clock.
+#
+#   python load_test.py --base-url http://127.0.0.1:5000 --lobbies 1,2,4,8,16 --players 10 --output run.json
+
+# A level is past the knee once its p99 latency is this many times the
+# p99 of the first level
+KNEE_FACTOR = 2
+
+DEFAULT_BASE_URL = 'http://flask_backend:5000'
+
+# The URLs a game uses on the server at base_url. Lobby URLs are formatted
+# with the lobby id.
+class Routes():
+    def __init__(self, base_url):
+        base_url = base_url.rstrip('/')
+        lobby_url = '{}/lobby/{{}}'.format(base_url)
+
+        self.handshake = '{}/handshake'.format(base_url)
+        self.create_lobby = '{}/create_lobby'.format(base_url)
+        self.join_lobby = '{}/join_lobby'.format(base_url)
+        # http becomes ws and https becomes wss
+        self.lobby_ws = '{}/ws'.format(lobby_url).replace('http', 'ws', 1)
+        self.lobby_exit = '{}/exit'.format(lobby_url)
+        self.lobby_start_round = '{}/start_round'.format(lobby_url)
+        self.lobby_start_question = '{}/start_question'.format(lobby_url)
+        self.lobby_end_question = '{}/end_question'.format(lobby_url)
+        self.lobby_answer_question = '{}/answer_question'.format(lobby_url)
+
+class LoadRun():
+    def __init__(self, routes):
+        self.routes = routes
+        self.latencies = {}
+        self.lags = {}
+        self.errors = {}
+        self.request_count = 0
+
+    async def request(self, session, route, url, json=None):
+        started = time.perf_counter()
+
+        async with session.post(url, json = json) as response:
+            data = await response.json()
+
+        self.latencies.setdefault(route, []).append(time.perf_counter() - started)
+        self.request_count += 1
+
+        if response.status >= 400:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+        return data
+
+    async def handshake(self, session):
+        started = time.perf_counter()
+        data = await handshake_session(session, self.routes.handshake)
+        self.latencies.setdefault('handshake', []).append(time.perf_counter() - started)
+        self.request_count += 1
+        return data
+
+    async def receive(self, ws):
+        async for message in ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                break
+
+            received_at = time.time()
+            frames = json.loads(message.data)
+
+            # With frame_batch, frames queued together arrive as one array
+            for frame in frames if isinstance(frames, list) else [frames]:
+                if 'sent_at' in frame:
+                    self.lags.setdefault(frame['code'], []).append(received_at - frame['sent_at'])
+
+
+async def play_lobby(run, connector, player_count, question_count, features):
+    # Servers addressed by IP only get their cookies back from an unsafe jar
+    sessions = [
+        aiohttp.ClientSession(connector = connector, connector_owner = False, cookie_jar = aiohttp.CookieJar(unsafe = True))
+        for _ in range(player_count)
+    ]
+    sockets = []
+    receivers = []
+    routes = run.routes
+
+    try:
+        (host, *players) = sessions
+
+        await run.handshake(host)
+        lobby = await run.request(host, 'create_lobby', routes.create_lobby)
+
+        await asyncio.gather(*[run.handshake(player) for player in players])
+        await asyncio.gather(*[
+            run.request(player, 'join_lobby', routes.join_lobby, {'join_code': lobby['join_code']})
+            for player in players
+        ])
+
+        ws_url = '{}?features={}'.format(routes.lobby_ws.format(lobby['id']), features)
+
+        for session in sessions:
+            ws = await session.ws_connect(ws_url)
+            sockets.append(ws)
+            receivers.append(asyncio.create_task(run.receive(ws)))
+
+        await run.request(host, 'start_round', routes.lobby_start_round.format(lobby['id']), {'count': question_count})
+
+        for i in range(question_count):
+            await run.request(host, 'start_question', routes.lobby_start_question.format(lobby['id']), {'question_index': i})
+            await asyncio.gather(*[
+                run.request(player, 'answer_question', routes.lobby_answer_question.format(lobby['id']), {
+                    'question_index': i,
+                    'answer': str(1 + (n + i) % 3)
+                })
+                for (n, player) in enumerate(players)
+            ])
+            await run.request(host, 'end_question', routes.lobby_end_question.format(lobby['id']), {'question_index': i})
+
+        # Lets the final broadcasts arrive before the lobby closes
+        await asyncio.sleep(0.5)
+        await run.request(host, 'exit', routes.lobby_exit.format(lobby['id']))
+    finally:
+        for ws in sockets:
+            await ws.close()
+
+        for receiver in receivers:
+            receiver.cancel()
+
+        for session in sessions:
+            await session.close()
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+def summarize(values):
+    values = sorted(values)
+
+    if not values:
+        return None
+
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000
+    }
+
+async def run_level(routes, lobby_count, player_count, question_count, features):
+    run = LoadRun(routes)
+    connector = aiohttp.TCPConnector(limit = 0)
+    started = time.perf_counter()
+
+    try:
+        await asyncio.gather(*[
+            play_lobby(run, connector, player_count, question_count, features)
+            for _ in range(lobby_count)
+        ])
+    finally:
+        await connector.close()
+
+    duration = time.perf_counter() - started
+    all_latencies = [latency for latencies in run.latencies.values() for latency in latencies]
+    all_lags = [lag for lags in run.lags.values() for lag in lags]
+
+    return {
+        'lobbies': lobby_count,
+        'players_per_lobby': player_count,
+        'duration_s': duration,
+        'requests': run.request_count,
+        'requests_per_s': run.request_count / duration,
+        'errors': run.errors,
+        'latency': summarize(all_latencies),
+        'routes': dict((route, summarize(latencies)) for route, latencies in sorted(run.latencies.items())),
+        'broadcast_lag': summarize(all_lags),
+        'broadcast_lag_by_code': dict((code, summarize(lags)) for code, lags in sorted(run.lags.items()))
+    }
+
+# The last level before latency degrades, or throughput stops rising
+def find_knee(levels):
+    baseline = levels[0]['latency']['p99_ms']
+
+    for (previous, level) in zip(levels, levels[1:]):
+        if level['latency']['p99_ms'] > baseline * KNEE_FACTOR:
+            return {'lobbies': previous['lobbies'], 'reason': 'p99 latency above {}x the first level'.format(KNEE_FACTOR)}
+
+        if level['requests_per_s'] < previous['requests_per_s']:
+            return {'lobbies': previous['lobbies'], 'reason': 'requests per second stopped rising'}
+
+    return None
+
+async def main():
+    parser = argparse.ArgumentParser(description = 'Play concurrent quiz games against a running server')
+    parser.add_argument('--base-url', default = DEFAULT_BASE_URL, help = 'server to play against (default {})'.format(DEFAULT_BASE_URL))
+    parser.add_argument('--lobbies', default = '1,2,4,8', help = 'comma separated lobby counts to sweep')
+    parser.add_argument('--players', type = int, default = 10, help = 'players per lobby, including the host')
+    parser.add_argument('--questions', type = int, default = 3)
+    parser.add_argument('--features', default = '', help = 'websocket features the players negotiate')
+    parser.add_argument('--output', help = 'file for the JSON report, instead of stdout')
+    args = parser.parse_args()
+
+    routes = Routes(args.base_url)
+    levels = []
+
+    for lobby_count in [int(count) for count in args.lobbies.split(',')]:
+        level = await run_level(routes, lobby_count, args.players, args.questions, args.features)
+        levels.append(level)
+        print('{:4} lobbies: {:8.1f} requests/s, p99 {:7.2f} ms'.format(
+            lobby_count, level['requests_per_s'], level['latency']['p99_ms']), file = sys.stderr)
+
+    report = json.dumps({
+        'base_url': args.base_url,
+        'players_per_lobby': args.players,
+        'questions': args.questions,
+        'features': args.features,
+        'levels': levels,
+        'knee': find_knee(levels)
+    }, indent = 2)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report)
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -7,11 +7,13 @@ import unittest
 import aiohttp
 
 from assertion_helpers import at_least_one_message
-from request_helpers import new_handshook_session, handshake_session
+from request_helpers import cookie_value_by_name, new_handshook_session, handshake_session
 
 BASE_URL = "http://flask_backend:5000"
 HANDSHAKE_URL = "{}/handshake".format(BASE_URL)
+LOGOUT_URL = "{}/logout".format(BASE_URL)
 UPDATE_PROFILE_URL = "{}/update_profile".format(BASE_URL)
+PROFILE_IMAGE_URL = "{}/profile_image".format(BASE_URL)
 PROFILE_IMAGES_CDN_URL = '{}/profile_images/{{}}'.format(BASE_URL)
 CREATE_LOBBY_URL = "{}/create_lobby".format(BASE_URL)
 JOIN_LOBBY_URL = "{}/join_lobby".format(BASE_URL)
@@ -23,6 +25,13 @@ LOBBY_START_ROUND_URL = "{}/start_round".format(LOBBY_URL)
 LOBBY_START_QUESTION_URL = "{}/start_question".format(LOBBY_URL)
 LOBBY_END_QUESTION_URL = "{}/end_question".format(LOBBY_URL)
 LOBBY_ANSWER_QUESTION_URL = "{}/answer_question".format(LOBBY_URL)
+LOBBY_LEADERBOARD_URL = "{}/leaderboard".format(LOBBY_URL)
+METRICS_URL = "{}/metrics".format(BASE_URL)
+
+# The seeded question bank holds one question for this video, which
+# clients are not told the answer to until it ends
+KNOWN_ROUND_DATA = {'video_id': 'y_-PZRWaeuU'}
+KNOWN_CORRECT_ANSWER = '3'
 
 
 class IntegrationTests(unittest.IsolatedAsyncioTestCase):
@@ -55,6 +64,31 @@ class IntegrationTests(unittest.IsolatedAsyncioTestCase):
             async with new_session.post(HANDSHAKE_URL, json={}, cookies=cookies) as response:
                 self.assertEqual(response.status, 200)
 
+    async def test_tampered_user_token_is_rejected(self):
+        async with aiohttp.ClientSession() as new_session:
+            response = await new_session.post(HANDSHAKE_URL, json={})
+            (key_id, user_id, issued_at, signature) = response.cookies['secret_token'].value.split('.')
+            cookies = {
+                'secret_token': '.'.join([key_id, user_id, str(int(issued_at) + 1), signature])
+            }
+
+            async with new_session.get(BASE_URL, cookies=cookies) as response:
+                self.assertEqual(response.status, 403)
+
+    async def test_logout_revokes_user_token(self):
+        async with aiohttp.ClientSession() as new_session:
+            handshake_data = await handshake_session(new_session)
+            secret_token = cookie_value_by_name('secret_token', new_session.cookie_jar)
+
+            async with new_session.post(LOGOUT_URL) as response:
+                self.assertEqual(response.status, 200)
+
+            async with new_session.get(BASE_URL, cookies={'secret_token': secret_token}) as response:
+                self.assertEqual(response.status, 403)
+
+            new_handshake_data = await handshake_session(new_session)
+            self.assertNotEqual(new_handshake_data['user_id'], handshake_data['user_id'])
+
     async def test_authorization_fails_without_handshake(self):
         async with aiohttp.ClientSession() as new_session:
             async with new_session.get(BASE_URL) as response:
@@ -89,6 +123,49 @@ class IntegrationTests(unittest.IsolatedAsyncioTestCase):
 
         self.assertEqual(handshake_response_data['profile'], update_profile_response_data)
 
+    async def test_upload_profile_image_is_content_addressed(self):
+        image = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+        headers = {'Content-Type': 'image/png'}
+
+        async with self.session.post(PROFILE_IMAGE_URL, data=image, headers=headers) as response:
+            self.assertEqual(response.status, 200)
+            image_filename = (await response.json())['image_filename']
+
+        async with self.session.post(PROFILE_IMAGE_URL, data=image, headers=headers) as response:
+            self.assertEqual((await response.json())['image_filename'], image_filename)
+
+        async with self.session.post(PROFILE_IMAGE_URL, data=image, headers={'Content-Type': 'text/plain'}) as response:
+            self.assertEqual(response.status, 415)
+
+        async with self.session.post(PROFILE_IMAGE_URL, data=b'0' * (3 * 1024 * 1024), headers=headers) as response:
+            self.assertEqual(response.status, 413)
+
+        profile_data = {
+            'display_name': 'Uploader',
+            'image_filename': image_filename
+        }
+
+        async with self.session.post(UPDATE_PROFILE_URL, json=profile_data) as response:
+            self.assertEqual(response.status, 200)
+            self.assertEqual((await response.json())['image_filename'], image_filename)
+
+        async with self.session.get(PROFILE_IMAGES_CDN_URL.format(image_filename)) as response:
+            self.assertEqual(await response.read(), image)
+            self.assertIn('immutable', response.headers['Cache-Control'])
+            etag = response.headers['ETag']
+
+        async with self.session.get(PROFILE_IMAGES_CDN_URL.format(image_filename), headers={'If-None-Match': etag}) as response:
+            self.assertEqual(response.status, 304)
+
+        async with self.session.get(PROFILE_IMAGES_CDN_URL.format('thumbnails/{}'.format(image_filename))) as response:
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.content_type, 'image/png')
+
+        profile_data['image_filename'] = '../etc/passwd'
+
+        async with self.session.post(UPDATE_PROFILE_URL, json=profile_data) as response:
+            self.assertEqual(response.status, 422)
+
     async def test_create_lobby(self):
         response = await self.session.post(CREATE_LOBBY_URL)
 
@@ -122,6 +199,26 @@ class IntegrationTests(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(response_data['id'], lobby_id)
         self.assertEqual(response_data['host_id'], lobby_host_id)
 
+    async def test_get_lobby_is_not_modified_until_lobby_changes(self):
+        lobby_data = await self.set_up_lobby()
+        lobby_id = lobby_data['id']
+
+        response = await self.session.get(LOBBY_URL.format(lobby_id))
+        etag = response.headers['ETag']
+
+        response = await self.session.get(LOBBY_URL.format(lobby_id), headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+
+        response = await self.session.get(GET_LOBBY_URL.format(lobby_data['join_code']), headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+
+        async with self.session.post(LOBBY_START_ROUND_URL.format(lobby_id)):
+            pass
+
+        response = await self.session.get(LOBBY_URL.format(lobby_id), headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
     async def test_join_lobby_fails_when_already_joined(self):
         lobby_data = await self.set_up_lobby()
         data = {
@@ -256,6 +353,23 @@ class IntegrationTests(unittest.IsolatedAsyncioTestCase):
             self.assertEqual(response_data['round']['questions'], message_data['questions'])
             self.assertEqual(response_data['round']['leaderboard'][self.session_user_id]['score'], 0)
 
+    async def test_start_round_samples_requested_questions(self):
+        lobby_data = await self.set_up_lobby()
+        lobby_id = lobby_data['id']
+
+        async with self.session.post(LOBBY_START_ROUND_URL.format(lobby_id), json={'count': 0}) as response:
+            self.assertEqual(response.status, 422)
+
+        async with self.session.post(LOBBY_START_ROUND_URL.format(lobby_id), json={'tag': 'no_such_tag'}) as response:
+            self.assertEqual(response.status, 422)
+
+        async with self.session.post(LOBBY_START_ROUND_URL.format(lobby_id), json={'count': 1}) as response:
+            self.assertEqual(response.status, 200)
+
+        response = await self.session.get(LOBBY_URL.format(lobby_id))
+        response_data = await response.json()
+        self.assertEqual(len(response_data['round']['questions']), 1)
+
 
     async def test_start_question(self):
         lobby_data = await self.set_up_lobby()
@@ -333,6 +447,29 @@ class IntegrationTests(unittest.IsolatedAsyncioTestCase):
             self.assertEqual(response.status, 422)
 
 
+    async def test_auto_advance_round_starts_questions_on_the_server(self):
+        lobby_data = await self.set_up_lobby()
+        lobby_id = lobby_data['id']
+
+        async with self.session.ws_connect(LOBBY_WS_URL.format(lobby_id)) as ws:
+
+            async with self.session.post(LOBBY_START_ROUND_URL.format(lobby_id), json={'auto_advance': True}) as response:
+                self.assertEqual(response.status, 200)
+
+            def assert_question_started_message(code, data):
+                self.assertEqual(code, 'QUESTION_STARTED')
+                self.assertEqual(data['i'], 0)
+
+            await at_least_one_message(ws, assert_question_started_message)
+
+        # The server has already started question 0
+        async with self.session.post(LOBBY_START_QUESTION_URL.format(lobby_id), json={'question_index': 0}) as response:
+            self.assertEqual(response.status, 422)
+
+        async with self.session.post(LOBBY_START_ROUND_URL.format(lobby_id), json={'auto_advance': 'yes'}) as response:
+            self.assertEqual(response.status, 422)
+
+
     async def test_answer_question_updates_lobby(self):
         lobby_data = await self.set_up_lobby()
         lobby_id = lobby_data['id']
@@ -377,7 +514,39 @@ class IntegrationTests(unittest.IsolatedAsyncioTestCase):
             response_data = await response.json()
 
             self.assertEqual(response.status, 200)
-            self.assertEqual(response_data['round']['answers'][self.session_user_id]['0'], '3')
+            self.assertNotIn('answers', response_data['round'])
+            self.assertNotIn('correct_answer', response_data['round']['questions'][0])
+
+
+    async def test_answer_question_batches_answers_when_negotiated(self):
+        lobby_data = await self.set_up_lobby()
+        lobby_id = lobby_data['id']
+        batch_ws_url = '{}?features=answer_batch'.format(LOBBY_WS_URL.format(lobby_id))
+
+        async with self.session.ws_connect(batch_ws_url) as ws:
+
+            async with self.session.post(LOBBY_START_ROUND_URL.format(lobby_id)):
+                pass
+
+            async with self.session.post(LOBBY_START_QUESTION_URL.format(lobby_id), json={'question_index': 0}):
+                pass
+
+            answer_data = {
+                'question_index': 0,
+                'answer': 3
+            }
+            async with self.session.post(LOBBY_ANSWER_QUESTION_URL.format(lobby_id), json=answer_data) as response:
+                self.assertEqual(response.status, 200)
+
+            def assert_answer_batch(code, data):
+                self.assertEqual(code, 'ANSWER_BATCH')
+                self.assertEqual(data['answers'], [{
+                    'user_id': self.session_user_id,
+                    'question_index': 0,
+                    'answer': '3'
+                }])
+
+            await at_least_one_message(ws, assert_answer_batch)
 
 
     async def test_answer_question_fails_for_inactive_question(self):
@@ -403,6 +572,28 @@ class IntegrationTests(unittest.IsolatedAsyncioTestCase):
             self.assertEqual(response.status, 422)
 
 
+    async def test_answer_question_fails_for_answer_that_is_not_an_option(self):
+        lobby_data = await self.set_up_lobby()
+        lobby_id = lobby_data['id']
+
+        async with self.session.post(LOBBY_START_ROUND_URL.format(lobby_id)) as response:
+            pass
+
+        data = {
+            'question_index': 0
+        }
+
+        async with self.session.post(LOBBY_START_QUESTION_URL.format(lobby_id), json=data) as response:
+            self.assertEqual(response.status, 200)
+
+        answer_data = {
+            'question_index': 0,
+            'answer': 'foo'
+        }
+        async with self.session.post(LOBBY_ANSWER_QUESTION_URL.format(lobby_id), json=answer_data) as response:
+            self.assertEqual(response.status, 422)
+
+
     async def test_answer_question_fails_after_host_ends_question(self):
         lobby_data = await self.set_up_lobby()
         lobby_id = lobby_data['id']
@@ -500,7 +691,7 @@ class IntegrationTests(unittest.IsolatedAsyncioTestCase):
                 async with other_session.post(JOIN_LOBBY_URL, json=join_data):
                     pass
 
-                async with self.session.post(LOBBY_START_ROUND_URL.format(lobby_id)):
+                async with self.session.post(LOBBY_START_ROUND_URL.format(lobby_id), json=KNOWN_ROUND_DATA):
                     pass
 
                 def assert_leaderboard_correct_at_start(code, data):
@@ -510,7 +701,7 @@ class IntegrationTests(unittest.IsolatedAsyncioTestCase):
                     self.assertEqual(data['leaderboard'][other_user_id]['score'], 0)
                     self.assertEqual(data['leaderboard'][other_user_id]['position'], 1)
 
-                (_, message_data) = await at_least_one_message(ws, assert_leaderboard_correct_at_start)
+                await at_least_one_message(ws, assert_leaderboard_correct_at_start)
 
                 question_index_data = {
                     'question_index': 0
@@ -521,12 +712,12 @@ class IntegrationTests(unittest.IsolatedAsyncioTestCase):
 
                 correct_answer_data = {
                     'question_index': 0,
-                    'answer': message_data['questions'][0]['correct_answer']
+                    'answer': KNOWN_CORRECT_ANSWER
                 }
 
                 wrong_answer_data = {
                     'question_index': 0,
-                    'answer': 'foo'
+                    'answer': '1'
                 }
 
                 answer_url = LOBBY_ANSWER_QUESTION_URL.format(lobby_id)
@@ -549,6 +740,99 @@ class IntegrationTests(unittest.IsolatedAsyncioTestCase):
 
                 await at_least_one_message(ws, assert_leaderboard_updated_correctly)
 
+    async def test_end_question_sends_leaderboard_delta_when_negotiated(self):
+        lobby_data = await self.set_up_lobby()
+        lobby_id = lobby_data['id']
+        delta_ws_url = '{}?features=leaderboard_delta'.format(LOBBY_WS_URL.format(lobby_id))
+
+        async with self.session.ws_connect(delta_ws_url) as ws:
+
+            async with self.session.post(LOBBY_START_ROUND_URL.format(lobby_id), json=KNOWN_ROUND_DATA):
+                pass
+
+            def assert_round_started_message(code, data):
+                self.assertEqual(code, 'ROUND_STARTED')
+                self.assertNotIn('correct_answer', data['questions'][0])
+                self.assertNotIn('answers', data)
+
+            await at_least_one_message(ws, assert_round_started_message)
+
+            question_index_data = {
+                'question_index': 0
+            }
+
+            async with self.session.post(LOBBY_START_QUESTION_URL.format(lobby_id), json=question_index_data):
+                pass
+
+            correct_answer_data = {
+                'question_index': 0,
+                'answer': KNOWN_CORRECT_ANSWER
+            }
+
+            async with self.session.post(LOBBY_ANSWER_QUESTION_URL.format(lobby_id), json=correct_answer_data):
+                pass
+
+            async with self.session.post(LOBBY_END_QUESTION_URL.format(lobby_id), json=question_index_data):
+                pass
+
+            def assert_leaderboard_delta(code, data):
+                self.assertEqual(code, 'LEADERBOARD_UPDATED')
+                self.assertEqual(data['entries'][self.session_user_id]['score'], 1)
+
+            _, delta = await at_least_one_message(ws, assert_leaderboard_delta)
+
+            async with self.session.get(LOBBY_LEADERBOARD_URL.format(lobby_id)) as response:
+                snapshot = await response.json()
+
+            self.assertEqual(snapshot['seq'], delta['seq'])
+            self.assertEqual(snapshot['leaderboard'][self.session_user_id]['score'], 1)
+
+    async def test_round_manifest_withholds_answers_until_question_ends(self):
+        lobby_data = await self.set_up_lobby()
+        lobby_id = lobby_data['id']
+        manifest_ws_url = '{}?features=round_manifest'.format(LOBBY_WS_URL.format(lobby_id))
+
+        async with self.session.ws_connect(manifest_ws_url) as ws:
+
+            async with self.session.post(LOBBY_START_ROUND_URL.format(lobby_id)):
+                pass
+
+            def assert_round_started_message(code, data):
+                self.assertEqual(code, 'ROUND_STARTED')
+                self.assertNotIn('questions', data)
+                self.assertNotIn('leaderboard', data)
+
+            _, manifest = await at_least_one_message(ws, assert_round_started_message)
+
+            async with self.session.get(manifest['questions_url']) as response:
+                self.assertEqual(response.status, 200)
+                self.assertIn('immutable', response.headers['Cache-Control'])
+                etag = response.headers['ETag']
+                questions = await response.json()
+
+            self.assertEqual(len(questions), manifest['question_count'])
+            self.assertNotIn('correct_answer', questions[0])
+
+            async with self.session.get(manifest['questions_url'], headers={'If-None-Match': etag}) as response:
+                self.assertEqual(response.status, 304)
+
+            question_index_data = {
+                'question_index': 0
+            }
+
+            async with self.session.post(LOBBY_START_QUESTION_URL.format(lobby_id), json=question_index_data):
+                pass
+
+            async with self.session.post(LOBBY_END_QUESTION_URL.format(lobby_id), json=question_index_data):
+                pass
+
+            def assert_question_ended_message(code, data):
+                self.assertEqual(code, 'QUESTION_ENDED')
+                self.assertEqual(data['i'], 0)
+                self.assertIn(data['correct_answer'], ['1', '2', '3'])
+
+            await at_least_one_message(ws, assert_question_ended_message)
+
     async def test_end_question_ends_round_after_final_question(self):
         lobby_data = await self.set_up_lobby()
         lobby_id = lobby_data['id']
@@ -584,7 +868,42 @@ class IntegrationTests(unittest.IsolatedAsyncioTestCase):
 
             self.assertIsNone(response_data['round'])
             self.assertEqual(response_data['previous_round']['leaderboard'][self.session_user_id]['score'], 0)
+            self.assertNotIn('answers', response_data['previous_round'])
+            self.assertIn('correct_answer', response_data['previous_round']['questions'][0])
+
+
+    async def test_frames_queued_together_are_sent_as_one_array_when_negotiated(self):
+        lobby_data = await self.set_up_lobby()
+        lobby_id = lobby_data['id']
+        batch_ws_url = '{}?features=frame_batch'.format(LOBBY_WS_URL.format(lobby_id))
 
+        async with self.session.ws_connect(batch_ws_url) as ws:
+
+            async with self.session.post(LOBBY_START_ROUND_URL.format(lobby_id), json={'count': 1}):
+                pass
+
+            def assert_round_started_message(code, data):
+                self.assertEqual(code, 'ROUND_STARTED')
+
+            await at_least_one_message(ws, assert_round_started_message)
+
+            question_index_data = {
+                'question_index': 0
+            }
+
+            async with self.session.post(LOBBY_START_QUESTION_URL.format(lobby_id), json=question_index_data):
+                pass
+
+            async with self.session.post(LOBBY_END_QUESTION_URL.format(lobby_id), json=question_index_data):
+                pass
+
+            while True:
+                frames = json.loads((await asyncio.wait_for(ws.receive(), timeout=3)).data)
+
+                if isinstance(frames, list):
+                    break
+
+            self.assertEqual([frame['code'] for frame in frames], ['QUESTION_ENDED', 'LEADERBOARD_UPDATED', 'ROUND_ENDED'])
 
     async def test_websocket_connection_after_reconnect(self):
         lobby_data = await self.set_up_lobby()
@@ -638,5 +957,21 @@ class IntegrationTests(unittest.IsolatedAsyncioTestCase):
             except (asyncio.exceptions.TimeoutError):
                 self.fail("Websocket was not closed as expected")
 
+    async def test_metrics_report_routes_and_broadcasts_without_a_session(self):
+        lobby_data = await self.set_up_lobby()
+
+        async with new_handshook_session() as (other_session, _):
+            async with other_session.post(JOIN_LOBBY_URL, json={'join_code': lobby_data['join_code']}):
+                pass
+
+        async with aiohttp.ClientSession() as new_session:
+            async with new_session.get(METRICS_URL) as response:
+                self.assertEqual(response.status, 200)
+                text = await response.text()
+
+        self.assertIn('http_request_duration_seconds_count{route="/join_lobby",method="POST"}', text)
+        self.assertIn('broadcast_duration_seconds_count{code="USER_JOINED"}', text)
+        self.assertIn('# TYPE open_lobbies gauge', text)
+
 if __name__ == "__main__":
     unittest.main()
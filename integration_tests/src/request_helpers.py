@@ -13,9 +13,9 @@ class HandshookSessionContextManager():
         await self.session.__aexit__(exc_type, exc, tb)
 
 
-async def handshake_session(session):
+async def handshake_session(session, url="http://flask_backend:5000/handshake"):
     headers = {"Connection": "close"}
-    async with session.post("http://flask_backend:5000/handshake", json={}, headers=headers) as response:
+    async with session.post(url, json={}, headers=headers) as response:
         return await response.json()
 
 
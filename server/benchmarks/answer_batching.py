@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+import fanout
+
+PLAYER_COUNTS = [100, 500]
+ANSWER_SPREAD = 1.0
+BATCH_WINDOW = 0.1
+
+STOP = fanout.encode_frame('RELEASE_ALL', {})
+
+async def consume(subscriber, counts):
+    while True:
+        frame = await subscriber.get()
+        if frame is STOP:
+            return
+        counts['messages'] += 1
+        counts['bytes'] += len(frame.text)
+
+async def run(player_count, batching):
+    loop = asyncio.get_event_loop()
+    subscribers = [fanout.Subscriber(max_size=player_count + 1) for _ in range(player_count)]
+    counts = {'messages': 0, 'bytes': 0}
+    consumers = [asyncio.create_task(consume(s, counts)) for s in subscribers]
+
+    def flush(_, answers):
+        loop.create_task(fanout.publish(subscribers, fanout.encode_frame('ANSWER_BATCH', {
+            'answers': answers
+        })))
+
+    batcher = fanout.EventBatcher(BATCH_WINDOW, flush)
+
+    def answer(i):
+        answer_data = {
+            'user_id': 'player_{}'.format(i),
+            'question_index': 0,
+            'answer': str(i % 3 + 1)
+        }
+        if batching:
+            batcher.add(1, answer_data)
+        else:
+            loop.create_task(fanout.publish(subscribers, fanout.encode_frame('ANSWER_RECEIVED', answer_data)))
+
+    started = time.process_time()
+
+    for i in range(player_count):
+        loop.call_later(ANSWER_SPREAD * i / player_count, answer, i)
+
+    await asyncio.sleep(ANSWER_SPREAD + BATCH_WINDOW * 2)
+    await fanout.publish(subscribers, STOP)
+    await asyncio.gather(*consumers)
+
+    return counts, time.process_time() - started
+
+async def main():
+    print('{:>8} {:>9} {:>12} {:>12} {:>14}'.format('players', 'batching', 'messages', 'messages/s', 'loop cpu ms'))
+
+    for player_count in PLAYER_COUNTS:
+        for batching in [False, True]:
+            counts, cpu = await run(player_count, batching)
+            print('{:>8} {:>9} {:>12} {:>12.0f} {:>14.1f}'.format(
+                player_count,
+                'on' if batching else 'off',
+                counts['messages'],
+                counts['messages'] / ANSWER_SPREAD,
+                cpu * 1000
+            ))
+
+if __name__ == "__main__":
+    asyncio.run(main())
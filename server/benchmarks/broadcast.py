@@ -0,0 +1,80 @@
+import asyncio
+import time
+import uuid
+
+import fanout
+import model
+import serialization
+
+SOCKET_COUNTS = [10, 100, 1000]
+EVENTS_PER_RUN = 5
+
+def leaderboard_for(user_count):
+    user_ids = [str(uuid.uuid4()) for _ in range(user_count)]
+    leaderboard = model.create_leaderboard_store(user_ids)
+    for i, user_id in enumerate(user_ids):
+        leaderboard.set_score(user_id, i % 7)
+    model.update_leaderboard_positions(leaderboard)
+    return leaderboard
+
+STOP = fanout.encode_frame('RELEASE_ALL', {})
+
+async def consume(queue, encode):
+    sent_bytes = 0
+    while True:
+        item = await queue.get()
+        if item is STOP:
+            return sent_bytes
+        sent_bytes += len(encode(item))
+
+async def run(socket_count, leaderboard, encode_once):
+    if encode_once:
+        queues = [fanout.Subscriber() for _ in range(socket_count)]
+    else:
+        queues = [asyncio.Queue() for _ in range(socket_count)]
+
+    if encode_once:
+        consumers = [asyncio.create_task(consume(q, lambda frame: frame.text)) for q in queues]
+    else:
+        consumers = [asyncio.create_task(consume(q, serialization.dumps)) for q in queues]
+
+    started = time.process_time()
+
+    for _ in range(EVENTS_PER_RUN):
+        if encode_once:
+            await fanout.publish(queues, fanout.encode_frame('LEADERBOARD_UPDATED', leaderboard))
+        else:
+            message = {
+                'code': 'LEADERBOARD_UPDATED',
+                'data': leaderboard
+            }
+            for queue in queues:
+                await queue.put(message)
+
+    for queue in queues:
+        if encode_once:
+            queue.put(STOP)
+        else:
+            await queue.put(STOP)
+
+    await asyncio.gather(*consumers)
+
+    return time.process_time() - started
+
+async def main():
+    print('{:>8} {:>14} {:>14} {:>8}'.format('sockets', 'per socket ms', 'encode once ms', 'saved'))
+
+    for socket_count in SOCKET_COUNTS:
+        leaderboard = leaderboard_for(socket_count)
+        per_socket = await run(socket_count, leaderboard, False)
+        encode_once = await run(socket_count, leaderboard, True)
+
+        print('{:>8} {:>14.1f} {:>14.1f} {:>7.0%}'.format(
+            socket_count,
+            per_socket * 1000,
+            encode_once * 1000,
+            1 - encode_once / per_socket
+        ))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+import time
+
+import model
+import scoring
+from questions import questions
+
+PLAYER_COUNT = 10000
+REPEATS = 20
+
+# Finding who answered correctly, per user against dict answers as before
+def legacy_match_question(lobby, answers, question_index):
+    user_ids = []
+    for user_id in lobby['users']:
+        user_answer = answers[user_id].get(question_index)
+        correct_answer = questions[question_index]['correct_answer']
+
+        if user_answer == correct_answer:
+            user_ids.append(user_id)
+    return user_ids
+
+def match_question(lobby, question_index):
+    round = lobby['round']
+    correct_answer = round['questions'][question_index]['correct_answer']
+    user_ids = round['answers'].matching_user_ids(question_index, correct_answer)
+    return [user_id for user_id in user_ids if user_id in lobby['users']]
+
+def set_up_lobby():
+    lobby = model.create_lobby('player_0')
+    for i in range(1, PLAYER_COUNT):
+        model.add_user_to_lobby('player_{}'.format(i), lobby)
+    return lobby
+
+def set_up_question(lobby):
+    model.start_round(lobby, questions)
+    model.start_question(lobby, 0, time.time())
+    for i, user_id in enumerate(lobby['users']):
+        model.answer_question(lobby, user_id, 0, str(i % 3 + 1))
+
+def time_legacy(lobby):
+    answers = dict((user_id, {0: str(i % 3 + 1)}) for i, user_id in enumerate(lobby['users']))
+
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        legacy_match_question(lobby, answers, 0)
+    return (time.perf_counter() - started) / REPEATS
+
+def time_model(lobby, end_question):
+    elapsed = 0
+
+    for _ in range(REPEATS):
+        set_up_question(lobby)
+        started = time.perf_counter()
+        end_question(lobby, 0)
+        elapsed += time.perf_counter() - started
+
+    return elapsed / REPEATS
+
+def main():
+    lobby = set_up_lobby()
+    numpy = scoring.numpy
+    engines = [('numpy', numpy), ('python', None)] if numpy is not None else [('python', None)]
+
+    print('{} players, one question'.format(PLAYER_COUNT))
+    print('matching, per user dict loop: {:6.2f} ms'.format(time_legacy(lobby) * 1000))
+
+    for name, scoring.numpy in engines:
+        print('matching, {:6} columns:     {:6.2f} ms'.format(name, time_model(lobby, match_question) * 1000))
+
+    for name, scoring.numpy in engines:
+        print('end_question with {:6} scoring, ranks and delta: {:6.2f} ms'.format(
+            name, time_model(lobby, model.end_question) * 1000))
+
+    scoring.numpy = numpy
+
+if __name__ == "__main__":
+    main()
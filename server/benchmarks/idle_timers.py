@@ -0,0 +1,57 @@
+import asyncio
+import time
+import tracemalloc
+
+import lifecycle
+import settings
+
+LOBBY_COUNT = 100000
+TOUCHES_PER_LOBBY = 10
+
+def on_idle(lobby_id):
+    pass
+
+# Times include tracemalloc overhead, so only compare them with each other
+def measure(watch, touch):
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    for lobby_id in range(LOBBY_COUNT):
+        watch(lobby_id)
+
+    watched = time.perf_counter()
+
+    for _ in range(TOUCHES_PER_LOBBY):
+        for lobby_id in range(LOBBY_COUNT):
+            touch(lobby_id)
+
+    touched = time.perf_counter()
+    (memory, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return (watched - started, (touched - watched) / TOUCHES_PER_LOBBY, memory)
+
+async def main():
+    loop = asyncio.get_event_loop()
+    handles = {}
+
+    # A call_later handle per lobby, replaced on every activity
+    def watch_handle(lobby_id):
+        handles[lobby_id] = loop.call_later(settings.LOBBY_IDLE_TIMEOUT, on_idle, lobby_id)
+
+    def touch_handle(lobby_id):
+        handles[lobby_id].cancel()
+        watch_handle(lobby_id)
+
+    results = [
+        ('call_later per lobby', measure(watch_handle, touch_handle)),
+        ('timer wheel', measure(lambda lobby_id: lifecycle.watch(lobby_id, settings.LOBBY_IDLE_TIMEOUT, on_idle), lifecycle.touch))
+    ]
+
+    print('{} lobbies'.format(LOBBY_COUNT))
+    for name, (watch_time, touch_time, memory) in results:
+        print('{:20} watch all {:6.1f} ms, touch all {:6.1f} ms, {:5.1f} MB'.format(
+            name, watch_time * 1000, touch_time * 1000, memory / 1e6))
+
+if __name__ == "__main__":
+    asyncio.run(main())
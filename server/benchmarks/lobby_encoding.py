@@ -0,0 +1,35 @@
+import time
+
+import model
+from questions import questions
+import serialization
+
+USER_COUNT = 1000
+REPEATS = 200
+
+def set_up_lobby():
+    lobby = model.create_lobby('user_0')
+    for i in range(1, USER_COUNT):
+        model.add_user_to_lobby('user_{:032d}'.format(i), lobby)
+    model.start_round(lobby, questions)
+    return lobby
+
+def time_encode(encode, lobby):
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        encode(lobby)
+    return (time.perf_counter() - started) / REPEATS
+
+def main():
+    lobby = set_up_lobby()
+    print('{} users, {} bytes'.format(USER_COUNT, len(serialization.encode(lobby))))
+
+    for name in serialization.encoders:
+        serialization.use_encoder(name)
+        print('{:8} encode:  {:7.3f} ms'.format(name, time_encode(serialization.encode, lobby) * 1000))
+
+    model.encode_lobby(lobby)
+    print('cached lobby:    {:7.3f} ms'.format(time_encode(model.encode_lobby, lobby) * 1000))
+
+if __name__ == "__main__":
+    main()
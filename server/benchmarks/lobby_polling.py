@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+from app import app
+import handshake
+import lobby
+import model
+import serialization
+
+USER_COUNTS = [10, 1000]
+POLLS = 200
+
+# The encoded lobby cache is cleared before each poll, so a full response
+# costs what it does when the lobby changed since the last poll, and the
+# 304 saving is not hidden by the cache
+async def time_polls(client, url, headers):
+    started = time.perf_counter()
+    for _ in range(POLLS):
+        serialization.encoded_cache.clear()
+        response = await client.get(url, headers = headers)
+        await response.get_data()
+    return (time.perf_counter() - started) / POLLS, response.status_code
+
+async def run(user_count):
+    client = app.test_client()
+    await client.post('/handshake')
+    response = await client.post('/create_lobby')
+    lobby_id = (await response.get_json())['id']
+
+    for i in range(1, user_count):
+        model.add_user_to_lobby('user_{:032d}'.format(i), model.read_lobby(lobby_id = lobby_id))
+
+    url = '/lobby/{}'.format(lobby_id)
+    response = await client.get(url)
+    etag = response.headers['ETag']
+
+    (full, _) = await time_polls(client, url, {})
+    (conditional, status) = await time_polls(client, url, {'If-None-Match': etag})
+
+    print('{:5} users: full {:6.3f} ms, if-none-match {:6.3f} ms ({})'.format(
+        user_count, full * 1000, conditional * 1000, status))
+
+async def main():
+    for user_count in USER_COUNTS:
+        await run(user_count)
+
+if __name__ == "__main__":
+    asyncio.run(main())
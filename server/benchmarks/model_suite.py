@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import model
+
+# Times the model functions on the request path at 10 to 100k users or
+# lobbies, and compares each against a stored baseline. A result slower
+# than the baseline by more than the threshold fails the run, so a change
+# that makes one of them scale worse is caught before it is deployed.
+# Results are stored as multiples of a fixed calibration workload timed in
+# the same run, so a baseline saved on one machine compares on another.
+#
+#   python model_suite.py --save        record the baseline
+#   python model_suite.py               compare, exits 1 on a regression
+
+SIZES = [10, 100, 1000, 10000, 100000]
+REPEATS = 5
+LOOKUPS = 1000
+CALIBRATION_SIZE = 100000
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_baseline.json')
+
+def reset_model():
+    model.lobby_index = 0
+
+    for state in [model.lobbies, model.profiles, model.user_lobby_ids, model.round_manifests]:
+        state.clear()
+
+def user_ids(size):
+    return ['user_{}'.format(i) for i in range(size)]
+
+def lobby_with_round(size):
+    reset_model()
+    lobby = model.create_lobby('user_0')
+
+    for user_id in user_ids(size)[1:]:
+        model.add_user_to_lobby(user_id, lobby)
+
+    # Two questions, so ending the first leaves the round open
+    model.start_round(lobby, [{'correct_answer': '1'}, {'correct_answer': '2'}])
+    return lobby
+
+# Each case sets up its state, untimed, and returns the function to time
+def get_user_lobby(size):
+    reset_model()
+
+    for i in range(size):
+        lobby = model.create_lobby('host_{}'.format(i))
+        model.add_user_to_lobby('guest_{}'.format(i), lobby)
+
+    user_id = 'guest_{}'.format(size - 1)
+
+    def run():
+        for _ in range(LOOKUPS):
+            model.get_user_lobby(user_id)
+
+    return run
+
+def update_leaderboard_positions(size):
+    leaderboard = model.create_leaderboard_store(user_ids(size))
+    model.update_leaderboard_positions(leaderboard)
+
+    # As after a question a third of the players answered correctly
+    leaderboard.add_points_to(user_ids(size)[::3])
+    return lambda: model.update_leaderboard_positions(leaderboard)
+
+def create_leaderboard_store(size):
+    ids = user_ids(size)
+    return lambda: model.create_leaderboard_store(ids)
+
+# Players joining a round in progress
+def add_user_to_lobby(size):
+    lobby = lobby_with_round(1)
+    ids = ['joining_{}'.format(i) for i in range(size)]
+
+    def run():
+        for user_id in ids:
+            model.add_user_to_lobby(user_id, lobby)
+
+    return run
+
+def end_question(size):
+    lobby = lobby_with_round(size)
+    model.start_question(lobby, 0, time.time())
+
+    for i, user_id in enumerate(lobby['users']):
+        model.answer_question(lobby, user_id, 0, str(i % 3 + 1))
+
+    return lambda: model.end_question(lobby, 0)
+
+CASES = [get_user_lobby, update_leaderboard_positions, create_leaderboard_store, add_user_to_lobby, end_question]
+
+# Plain dict, list and sort work of the kind the model does, independent of
+# the model, to measure how fast this machine runs Python
+def calibration(size):
+    keys = ['key_{}'.format(i) for i in range(size)]
+
+    def run():
+        scores = dict((key, len(key)) for key in keys)
+        sorted(scores.items(), key = lambda item: (-item[1], item[0]))
+
+    return run
+
+def time_case(case, size):
+    best = None
+
+    for _ in range(REPEATS):
+        run = case(size)
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+# Returns each result in seconds, and the calibration time they are
+# divided by to compare with a baseline. The calibration is timed before
+# and after the cases, keeping the faster, as the machine may be busy.
+def run_suite(sizes):
+    results = {}
+    unit = time_case(calibration, CALIBRATION_SIZE)
+
+    for case in CASES:
+        for size in sizes:
+            key = '{}/{}'.format(case.__name__, size)
+            results[key] = time_case(case, size)
+            print('{:40} {:10.3f} ms'.format(key, results[key] * 1000), file = sys.stderr)
+
+    unit = min(unit, time_case(calibration, CALIBRATION_SIZE))
+    print('{:40} {:10.3f} ms'.format('calibration/{}'.format(CALIBRATION_SIZE), unit * 1000), file = sys.stderr)
+
+    return (results, unit)
+
+# Returns the results slower than baseline by more than threshold, as
+# (key, baseline, result) tuples, all in calibration units. Results under
+# min_units are too short to time reliably and never fail.
+def find_regressions(baseline, results, threshold, min_units):
+    regressions = []
+
+    for key, result in results.items():
+        if key not in baseline or result < min_units:
+            continue
+
+        if result > baseline[key] * (1 + threshold):
+            regressions.append((key, baseline[key], result))
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark model functions against a stored baseline')
+    parser.add_argument('--save', action = 'store_true', help = 'store these results as the baseline')
+    parser.add_argument('--baseline', default = BASELINE_PATH)
+    parser.add_argument('--threshold', type = float, default = 0.5, help = 'fraction slower than baseline that fails')
+    parser.add_argument('--min-ms', type = float, default = 0.5, help = 'results faster than this never fail')
+    parser.add_argument('--max-size', type = int, default = SIZES[-1])
+    args = parser.parse_args()
+
+    (seconds, unit) = run_suite([size for size in SIZES if size <= args.max_size])
+    results = dict((key, result / unit) for key, result in seconds.items())
+    environment = {
+        'python': platform.python_version(),
+        'platform': platform.platform()
+    }
+
+    if args.save:
+        with open(args.baseline, 'w') as file:
+            json.dump({'environment': environment, 'results': results}, file, indent = 2, sort_keys = True)
+        print('saved baseline to {}'.format(args.baseline))
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+
+    # Python versions differ in which operations they made faster, so the
+    # calibration only evens out the machine
+    if baseline['environment']['python'] != environment['python']:
+        print('baseline was saved on Python {}, results may not compare'.format(baseline['environment']['python']), file = sys.stderr)
+
+    regressions = find_regressions(baseline['results'], results, args.threshold, args.min_ms / 1000 / unit)
+
+    for (key, before, after) in regressions:
+        print('REGRESSION {}: {:.3f} -> {:.3f} calibration runs ({:+.0%})'.format(key, before, after, after / before - 1))
+
+    if regressions:
+        sys.exit(1)
+
+    print('no regressions beyond {:.0%} of the baseline'.format(args.threshold))
+
+if __name__ == "__main__":
+    main()
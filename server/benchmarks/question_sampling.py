@@ -0,0 +1,63 @@
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import question_bank
+
+QUESTION_COUNT = 200000
+SAMPLES = 100
+
+def generate_questions():
+    for i in range(QUESTION_COUNT):
+        yield {
+            'video_id': 'video_{}'.format(i // 20),
+            'start_time': 300.0,
+            'question_display_time': 304.5,
+            'answer_lock_time': 320.0,
+            'answer_reveal_time': 340.0,
+            'end_time': 350.0,
+            'answer_text_1': 'Answer one for {}'.format(i),
+            'answer_text_2': 'Answer two for {}'.format(i),
+            'answer_text_3': 'Answer three for {}'.format(i),
+            'correct_answer': str(i % 3 + 1),
+            'difficulty': i % 5,
+            'tags': ['tag_{}'.format(i % 50)]
+        }
+
+def build_bank(path):
+    question_bank.connect(path)
+    question_bank.add_questions(generate_questions())
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def time_samples(**filters):
+    started = time.perf_counter()
+    for _ in range(SAMPLES):
+        question_bank.sample_questions(10, **filters)
+    return (time.perf_counter() - started) / SAMPLES
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), 'questions.db')
+
+    # Built in another process so this one only pays for opening the bank
+    builder = multiprocessing.Process(target = build_bank, args = (path,))
+    builder.start()
+    builder.join()
+
+    rss_before = max_rss_mb()
+    started = time.perf_counter()
+    question_bank.connect(path)
+    print('{} questions, {:.1f} MB on disk'.format(question_bank.count_questions(), os.path.getsize(path) / 1e6))
+    print('open:                    {:6.2f} ms'.format((time.perf_counter() - started) * 1000))
+
+    print('sample 10:               {:6.2f} ms'.format(time_samples() * 1000))
+    print('sample 10 by tag:        {:6.2f} ms'.format(time_samples(tag = 'tag_7') * 1000))
+    print('sample 10 by difficulty: {:6.2f} ms'.format(time_samples(difficulty = 3) * 1000))
+    print('sample 10 by video:      {:6.2f} ms'.format(time_samples(video_id = 'video_42') * 1000))
+    print('max RSS growth:          {:6.2f} MB'.format(max_rss_mb() - rss_before))
+
+if __name__ == "__main__":
+    main()
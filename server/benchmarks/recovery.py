@@ -0,0 +1,58 @@
+import asyncio
+import tempfile
+import time
+
+import journal
+import model
+from questions import questions
+
+LOBBY_COUNT = 2000
+USERS_PER_LOBBY = 20
+TAIL_LOBBIES = 500
+
+def play_question(lobby, question_index):
+    model.start_question(model.edit_lobby(lobby['id']), question_index, time.time())
+
+    for user_id in lobby['users']:
+        model.answer_question(model.edit_lobby(lobby['id']), user_id, question_index, '2')
+
+    model.end_question(model.edit_lobby(lobby['id']), question_index)
+
+async def main():
+    journal_dir = tempfile.mkdtemp()
+    journal.restore(journal_dir)
+
+    for i in range(LOBBY_COUNT):
+        lobby = model.create_lobby('host_{}'.format(i))
+        for j in range(USERS_PER_LOBBY - 1):
+            model.add_user_to_lobby('user_{}_{}'.format(i, j), model.edit_lobby(lobby['id']))
+        model.start_round(model.edit_lobby(lobby['id']), questions)
+        play_question(lobby, 0)
+
+    # The state is pickled on the event loop, so time until the snapshot
+    # first hands over to the executor
+    snapshot = asyncio.ensure_future(journal.snapshot())
+    started = time.perf_counter()
+    await asyncio.sleep(0)
+    paused = time.perf_counter() - started
+    await snapshot
+
+    for lobby_id in list(model.lobbies)[:TAIL_LOBBIES]:
+        play_question(model.lobbies[lobby_id], 1)
+
+    tail_records = len(journal.pending)
+    await journal.flush()
+
+    model.load_state({'lobby_index': 0, 'lobbies': {}, 'profiles': {}, 'user_lobby_ids': {}, 'round_manifests': {}})
+
+    started = time.perf_counter()
+    journal.restore(journal_dir)
+    elapsed = time.perf_counter() - started
+
+    print('{} lobbies of {} users, {} journal records after the snapshot'.format(
+        len(model.lobbies), USERS_PER_LOBBY, tail_records))
+    print('snapshot paused the event loop for {:.0f} ms'.format(paused * 1000))
+    print('restored in {:.0f} ms'.format(elapsed * 1000))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+import tracemalloc
+
+import model
+
+USER_COUNTS = [1000, 10000, 50000]
+QUESTION_COUNT = 10
+
+def dict_round(user_ids):
+    answers = dict((user_id, {}) for user_id in user_ids)
+    leaderboard = dict((user_id, {'score': 0, 'position': 1}) for user_id in user_ids)
+
+    for user_id in user_ids:
+        for i in range(QUESTION_COUNT):
+            answers[user_id][i] = str(i % 3 + 1)
+
+    return answers, leaderboard
+
+def compact_round(user_ids):
+    answers = model.create_answers_store(user_ids)
+    leaderboard = dict((user_id, model.new_leaderboard_item()) for user_id in user_ids)
+
+    for user_id in user_ids:
+        for i in range(QUESTION_COUNT):
+            answers.record(user_id, i, str(i % 3 + 1))
+
+    return answers, leaderboard
+
+def measure(build, user_ids):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    stores = build(user_ids)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del stores
+    return used
+
+def main():
+    print('{:>7} {:>15} {:>15} {:>13} {:>13}'.format(
+        'users', 'dict bytes', 'compact bytes', 'dict/answer', 'compact/answer'))
+
+    for user_count in USER_COUNTS:
+        # User ids are shared with the lobby, so they are not counted
+        user_ids = ['user_{}'.format(i) for i in range(user_count)]
+        answer_count = user_count * QUESTION_COUNT
+        dict_bytes = measure(dict_round, user_ids)
+        compact_bytes = measure(compact_round, user_ids)
+
+        print('{:>7} {:>15} {:>15} {:>13.0f} {:>13.0f}'.format(
+            user_count,
+            dict_bytes,
+            compact_bytes,
+            dict_bytes / answer_count,
+            compact_bytes / answer_count
+        ))
+
+if __name__ == "__main__":
+    main()
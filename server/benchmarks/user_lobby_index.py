@@ -0,0 +1,34 @@
+import timeit
+
+import model
+
+LOBBY_COUNT = 100000
+LOOKUPS = 1000
+
+def scan_user_lobby(user_id):
+    for lobby_id in model.lobbies:
+        lobby = model.lobbies[lobby_id]
+        if user_id in lobby['users']:
+            return lobby
+
+def main():
+    for i in range(LOBBY_COUNT):
+        lobby = model.create_lobby('host_{}'.format(i))
+        model.add_user_to_lobby('guest_{}'.format(i), lobby)
+
+    errors = model.find_user_lobby_index_errors()
+    assert not errors, errors
+
+    # Worst case for the scan: the user is in the newest lobby
+    user_id = 'guest_{}'.format(LOBBY_COUNT - 1)
+    assert scan_user_lobby(user_id) is model.get_user_lobby(user_id)
+
+    scan = timeit.timeit(lambda: scan_user_lobby(user_id), number=LOOKUPS) / LOOKUPS
+    indexed = timeit.timeit(lambda: model.get_user_lobby(user_id), number=LOOKUPS) / LOOKUPS
+
+    print('{} open lobbies'.format(LOBBY_COUNT))
+    print('linear scan: {:.2f} us per lookup'.format(scan * 1000000))
+    print('index:       {:.2f} us per lookup'.format(indexed * 1000000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import asyncio
+import asyncio.selector_events
+
+import aiohttp
+from hypercorn.asyncio import serve
+
+from main import app
+import serve as production
+import settings
+
+# Plays the same game with and without frame_batch and permessage-deflate,
+# and counts the socket writes the server makes for it and the bytes they
+# carry. Each write to an idle socket is one send syscall. The server runs
+# in this process, so only writes from its own port are counted, which
+# include every HTTP response, the same in each run.
+
+PORT = 5099
+BASE_URL = 'http://127.0.0.1:{}/'.format(PORT)
+PLAYERS = 20
+# As many as the seeded question bank has
+QUESTIONS = 3
+
+# (name, websocket features, client offers deflate, WEBSOCKET_COMPRESSION_MIN_BYTES)
+CONFIGS = [
+    ('one frame per event', '', False, 1024),
+    ('frame_batch', 'frame_batch', False, 1024),
+    ('frame_batch, deflate all', 'frame_batch', True, 0),
+    ('frame_batch, deflate >= 1024', 'frame_batch', True, 1024)
+]
+
+counts = {'writes': 0, 'bytes': 0, 'messages': 0}
+original_write = asyncio.selector_events._SelectorSocketTransport.write
+
+def counting_write(transport, data):
+    if transport.get_extra_info('sockname')[1] == PORT:
+        counts['writes'] += 1
+        counts['bytes'] += len(data)
+
+    original_write(transport, data)
+
+asyncio.selector_events._SelectorSocketTransport.write = counting_write
+
+async def receive(ws):
+    async for message in ws:
+        if message.type != aiohttp.WSMsgType.TEXT:
+            break
+
+        counts['messages'] += 1
+
+async def post(session, path, json=None):
+    async with session.post(BASE_URL + path, json = json) as response:
+        return await response.json()
+
+async def play_game(features, deflate):
+    # The server is addressed by IP, which aiohttp only keeps cookies for when unsafe
+    sessions = [aiohttp.ClientSession(cookie_jar = aiohttp.CookieJar(unsafe = True)) for _ in range(PLAYERS + 1)]
+    (host, *players) = sessions
+
+    try:
+        for session in sessions:
+            await post(session, 'handshake')
+
+        lobby = await post(host, 'create_lobby')
+
+        for player in players:
+            await post(player, 'join_lobby', {'join_code': lobby['join_code']})
+
+        ws_url = '{}lobby/{}/ws?features={}'.format(BASE_URL, lobby['id'], features)
+        sockets = [await session.ws_connect(ws_url, compress = 15 if deflate else 0) for session in sessions]
+        receivers = [asyncio.create_task(receive(ws)) for ws in sockets]
+        lobby_url = 'lobby/{}/'.format(lobby['id'])
+
+        await post(host, lobby_url + 'start_round', {'count': QUESTIONS})
+
+        for i in range(QUESTIONS):
+            await post(host, lobby_url + 'start_question', {'question_index': i})
+            await asyncio.gather(*[
+                post(player, lobby_url + 'answer_question', {'question_index': i, 'answer': str(1 + (n + i) % 3)})
+                for (n, player) in enumerate(players)
+            ])
+            await post(host, lobby_url + 'end_question', {'question_index': i})
+
+        await asyncio.sleep(0.2)
+
+        # The host leaving closes the lobby and every socket
+        for player in players:
+            await post(player, lobby_url + 'exit')
+
+        await post(host, lobby_url + 'exit')
+        await asyncio.wait_for(asyncio.gather(*receivers), 10)
+    finally:
+        for session in sessions:
+            await session.close()
+
+async def main():
+    shutdown = asyncio.Event()
+    server = asyncio.create_task(serve(app, production.hypercorn_config('127.0.0.1:{}'.format(PORT)), shutdown_trigger = shutdown.wait))
+    await asyncio.sleep(0.5)
+
+    print('{:30} {:>10} {:>10} {:>12}'.format('per game', 'writes', 'bytes', 'ws messages'))
+
+    for (name, features, deflate, min_bytes) in CONFIGS:
+        settings.WEBSOCKET_COMPRESSION_MIN_BYTES = min_bytes
+
+        for key in counts:
+            counts[key] = 0
+
+        await play_game(features, deflate)
+        print('{:30} {:>10} {:>10} {:>12}'.format(name, counts['writes'], counts['bytes'], counts['messages']))
+
+    shutdown.set()
+    await server
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,12 +1,107 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
 import uuid
 
-secret_token_user_id_map = {}
+import journal
+import settings
+
+# Session tokens are "key_id.user_id.issued_at.signature", signed with HMAC
+# so any process holding the keys can authenticate a request without
+# looking anything up. The first key signs new tokens and the others are
+# still accepted, so keys can be rotated without ending every session.
+# Revoking a user rejects their tokens issued up to that moment.
+
+SESSION_KEY_FILENAME = 'session.key'
+
+revoked_user_ids = {}
+
+def load_keys():
+    if settings.SESSION_KEYS:
+        return dict(key.split(':', 1) for key in settings.SESSION_KEYS.split(','))
+
+    # Keep sessions valid across restarts that restore the journal
+    if settings.JOURNAL_DIR:
+        os.makedirs(settings.JOURNAL_DIR, exist_ok = True)
+        key_path = os.path.join(settings.JOURNAL_DIR, SESSION_KEY_FILENAME)
+
+        if not os.path.exists(key_path):
+            with open(key_path, 'w') as file:
+                file.write(secrets.token_hex(32))
+
+        with open(key_path) as file:
+            return {'local': file.read().strip()}
+
+    return {'local': secrets.token_hex(32)}
+
+keys = load_keys()
+signing_key_id = next(iter(keys))
+
+def sign(key_id, payload):
+    digest = hmac.new(keys[key_id].encode(), payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+def create_token(user_id, issued_at=None):
+    if issued_at is None:
+        issued_at = int(time.time())
+
+    payload = '{}.{}.{}'.format(signing_key_id, user_id, issued_at)
+    return '{}.{}'.format(payload, sign(signing_key_id, payload))
 
 def create_new_user():
-    secret_token = str(uuid.uuid4())
     user_id = str(uuid.uuid4())
-    secret_token_user_id_map[secret_token] = user_id
-    return (secret_token, user_id)
+    return (create_token(user_id), user_id)
 
+# Raises ValueError for a token that is malformed, forged, expired or revoked
 def authenticate_user(secret_token):
-    return (secret_token, secret_token_user_id_map[secret_token])
+    if secret_token is None:
+        raise ValueError('No session token')
+
+    (key_id, user_id, issued_at, signature) = secret_token.split('.')
+    payload = '{}.{}.{}'.format(key_id, user_id, issued_at)
+
+    if key_id not in keys or not hmac.compare_digest(sign(key_id, payload), signature):
+        raise ValueError('Invalid session token')
+
+    issued_at = int(issued_at)
+
+    if issued_at + settings.SESSION_TTL < time.time():
+        raise ValueError('Expired session token')
+
+    if issued_at <= revoked_user_ids.get(user_id, -1):
+        raise ValueError('Revoked session token')
+
+    return (secret_token, user_id)
+
+# A token past half its lifetime, or signed by an older key, is replaced
+# so active users never see their session expire
+def needs_renewal(secret_token):
+    (key_id, _, issued_at, _) = secret_token.split('.')
+    return key_id != signing_key_id or int(issued_at) + settings.SESSION_TTL / 2 < time.time()
+
+def revoke_user(user_id, revoked_at=None):
+    if revoked_at is None:
+        revoked_at = int(time.time())
+
+    journal.record('revoke_user', user_id, revoked_at)
+    revoked_user_ids[user_id] = revoked_at
+
+    # Revocations older than the TTL only cover tokens that have expired anyway
+    oldest = time.time() - settings.SESSION_TTL
+    for revoked_user_id in [k for k, v in revoked_user_ids.items() if v < oldest]:
+        del revoked_user_ids[revoked_user_id]
+
+# For clients without a session, such as scrapers and admin tools
+def has_bearer_token(headers, token):
+    return bool(token) and hmac.compare_digest(headers.get('Authorization', ''), 'Bearer {}'.format(token))
+
+
+def load_state(state):
+    revoked_user_ids.clear()
+    revoked_user_ids.update(state.get('revoked_user_ids', {}))
+
+journal.register_state('auth', lambda: {'revoked_user_ids': revoked_user_ids}, load_state)
+journal.register_operation('revoke_user', revoke_user)
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+
+import fanout
+import settings
+
+# Backends carry lobby broadcasts to every process with sockets in the lobby.
+# deliver(lobby_id, frame, audience) hands a frame to this process's sockets.
+
+class InMemoryBackend():
+    shared = False
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, lobby_id, frame, audience=None):
+        await self.deliver(lobby_id, frame, audience)
+
+    async def subscribe(self, lobby_id):
+        pass
+
+    async def unsubscribe(self, lobby_id):
+        pass
+
+
+# Relays broadcasts through broker.py so several worker processes can hold
+# sockets for the same lobby. Frames are sent pre-encoded and never re-encoded.
+#
+# Lines up to BROKER_MAX_MESSAGE_BYTES are read, as lobby updates of big
+# lobbies run to hundreds of kilobytes. When the broker connection drops the
+# backend reconnects and subscribes again. The broker keeps no history, so
+# frames published meanwhile are lost, and sockets catch up on their next
+# sync.
+class BrokerBackend():
+    shared = True
+
+    def __init__(self, deliver, socket_path=settings.BROKER_SOCKET_PATH):
+        self.deliver = deliver
+        self.socket_path = socket_path
+        self.subscriptions = set()
+        self.reader = None
+        self.writer = None
+        self.connected = None
+        self.read_task = None
+
+    async def start(self):
+        self.connected = asyncio.Event()
+        await self.connect()
+        self.read_task = asyncio.get_event_loop().create_task(self.read_messages())
+
+    async def stop(self):
+        self.read_task.cancel()
+        self.writer.close()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(
+            self.socket_path,
+            limit = settings.BROKER_MAX_MESSAGE_BYTES
+        )
+
+        for lobby_id in self.subscriptions:
+            self.writer.write(encode_message({'op': 'sub', 'lobby_id': lobby_id}))
+
+        await self.writer.drain()
+        self.connected.set()
+
+    async def reconnect(self):
+        self.connected.clear()
+        self.writer.close()
+
+        while True:
+            await asyncio.sleep(settings.BROKER_RECONNECT_DELAY)
+
+            try:
+                await self.connect()
+                return
+            except OSError as e:
+                logging.warning('Could not reconnect to the broker: {}'.format(e))
+
+    async def publish(self, lobby_id, frame, audience=None):
+        await self.deliver(lobby_id, frame, audience)
+        await self.send({
+            'op': 'pub',
+            'lobby_id': lobby_id,
+            'code': frame.code,
+            'text': frame.text,
+            'state_key': frame.state_key,
+            'audience': audience
+        })
+
+    async def subscribe(self, lobby_id):
+        self.subscriptions.add(lobby_id)
+        await self.send({
+            'op': 'sub',
+            'lobby_id': lobby_id
+        })
+
+    async def unsubscribe(self, lobby_id):
+        self.subscriptions.discard(lobby_id)
+        await self.send({
+            'op': 'unsub',
+            'lobby_id': lobby_id
+        })
+
+    async def send(self, message):
+        line = encode_message(message)
+
+        if len(line) > settings.BROKER_MAX_MESSAGE_BYTES:
+            logging.warning('Not relaying {} of {} bytes, over BROKER_MAX_MESSAGE_BYTES'.format(message.get('code'), len(line)))
+            return
+
+        await self.connected.wait()
+
+        try:
+            self.writer.write(line)
+            await self.writer.drain()
+        except ConnectionError:
+            # read_messages sees the same connection drop and reconnects
+            pass
+
+    async def read_messages(self):
+        while True:
+            try:
+                async for line in self.reader:
+                    message = json.loads(line)
+                    data = None
+
+                    if message['code'] in fanout.CONTROL_CODES:
+                        data = json.loads(message['text'])['data']
+
+                    frame = fanout.Frame(message['code'], data, message['text'], message['state_key'])
+                    audience = message['audience'] and tuple(message['audience'])
+                    await self.deliver(message['lobby_id'], frame, audience)
+            except (ConnectionError, ValueError) as e:
+                logging.warning('Lost the broker connection: {}'.format(e))
+
+            await self.reconnect()
+
+def encode_message(message):
+    return json.dumps(message).encode() + b'\n'
+
+
+def create_backend(deliver):
+    if settings.LOBBY_BACKEND == 'broker':
+        return BrokerBackend(deliver)
+
+    if settings.LOBBY_BACKEND == 'memory':
+        return InMemoryBackend(deliver)
+
+    raise ValueError('Unknown lobby backend {}'.format(settings.LOBBY_BACKEND))
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import os
+
+import settings
+
+# Relays published lobby frames between worker processes over a Unix socket.
+# Each worker subscribes to the lobbies it has sockets for, and receives
+# every frame another worker publishes to them.
+
+# A worker's connection, written to by the handlers of every other worker.
+# Each write waits for the worker to take what it has been sent, so a slow
+# worker slows down the ones publishing to it instead of growing the
+# broker's buffers.
+class WorkerConnection():
+    def __init__(self, writer):
+        self.writer = writer
+        # Only one drain may wait on a writer at a time
+        self.lock = asyncio.Lock()
+
+    async def send(self, line):
+        async with self.lock:
+            self.writer.write(line)
+
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                # Its own handler removes it
+                pass
+
+async def handle_worker(reader, writer, channels):
+    connection = WorkerConnection(writer)
+    subscriptions = set()
+
+    try:
+        async for line in reader:
+            message = json.loads(line)
+            lobby_id = message['lobby_id']
+
+            if message['op'] == 'sub':
+                channels.setdefault(lobby_id, set()).add(connection)
+                subscriptions.add(lobby_id)
+
+            elif message['op'] == 'unsub':
+                channels.get(lobby_id, set()).discard(connection)
+                subscriptions.discard(lobby_id)
+
+            elif message['op'] == 'pub':
+                await asyncio.gather(*[
+                    subscriber.send(line)
+                    for subscriber in channels.get(lobby_id, ())
+                    if subscriber is not connection
+                ])
+
+            if not channels.get(lobby_id, True):
+                del channels[lobby_id]
+    finally:
+        for lobby_id in subscriptions:
+            channels[lobby_id].discard(connection)
+            if not channels[lobby_id]:
+                del channels[lobby_id]
+
+        writer.close()
+
+
+async def serve(socket_path):
+    channels = {}
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    return await asyncio.start_unix_server(
+        lambda reader, writer: handle_worker(reader, writer, channels),
+        path = socket_path,
+        limit = settings.BROKER_MAX_MESSAGE_BYTES
+    )
+
+
+async def main():
+    server = await serve(settings.BROKER_SOCKET_PATH)
+
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+from collections import OrderedDict
+
+# Least recently used bytes values, bounded by their total size. Values
+# larger than max_item_bytes are not cached so one cannot evict the rest.
+class ByteCache():
+    def __init__(self, max_bytes, max_item_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes if max_item_bytes is not None else max_bytes // 8
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self.items[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.max_item_bytes:
+            return
+
+        self.pop(key)
+        self.items[key] = value
+        self.size += len(value)
+
+        while self.size > self.max_bytes:
+            (_, evicted) = self.items.popitem(last = False)
+            self.size -= len(evicted)
+
+    def pop(self, key):
+        value = self.items.pop(key, None)
+
+        if value is not None:
+            self.size -= len(value)
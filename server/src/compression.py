@@ -0,0 +1,35 @@
+from hypercorn.protocol import ws_stream
+from wsproto.extensions import PerMessageDeflate
+from wsproto.frame_protocol import Opcode
+
+from app import app
+import settings
+
+# Hypercorn accepts permessage-deflate whenever a client offers it, which
+# browsers always do, and then compresses every message. Most lobby frames
+# are a few hundred bytes, which deflate barely shrinks, so messages under
+# WEBSOCKET_COMPRESSION_MIN_BYTES are sent as they are. Large ones such as
+# ROUND_ENDED and lobby updates in big lobbies are still compressed.
+#
+# Hypercorn has no hook for this, so the extension class its websocket stream
+# builds is swapped while serving. That is an internal of Hypercorn, which
+# is why it and wsproto are pinned in requirements.txt.
+
+original_extension = ws_stream.PerMessageDeflate
+
+class ThresholdDeflate(PerMessageDeflate):
+    # A message is only left uncompressed when it is sent whole, as the
+    # rest of a fragmented message must match its first frame
+    def frame_outbound(self, proto, opcode, rsv, data, fin):
+        if fin and opcode is not Opcode.CONTINUATION and len(data) < settings.WEBSOCKET_COMPRESSION_MIN_BYTES:
+            return (rsv, data)
+
+        return super().frame_outbound(proto, opcode, rsv, data, fin)
+
+@app.before_serving
+async def install_threshold_deflate():
+    ws_stream.PerMessageDeflate = ThresholdDeflate
+
+@app.after_serving
+async def remove_threshold_deflate():
+    ws_stream.PerMessageDeflate = original_extension
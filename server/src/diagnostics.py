@@ -0,0 +1,182 @@
+import asyncio
+import collections
+import contextvars
+import os
+import sys
+import threading
+import time
+
+from quart import request, websocket
+
+from app import app
+import auth
+import metrics
+from response_helpers import error_response, json_response
+import settings
+
+# Where the event loop spends its time, for when a busy game night slows
+# down. Admin routes need ADMIN_TOKEN as a bearer token.
+#
+# activity names the route or event code being handled. Tasks copy it when
+# they are created, so a slow callback is attributed to the request or
+# broadcast that scheduled it.
+
+activity = contextvars.ContextVar('activity', default = None)
+slow_callbacks = collections.deque(maxlen = settings.SLOW_CALLBACK_LOG_SIZE)
+slow_callback_counts = {}
+loop_lag = metrics.Histogram(metrics.LATENCY_BUCKETS)
+lag_task = None
+profiler_lock = asyncio.Lock()
+
+def record_activity(name):
+    activity.set(name)
+
+@app.before_request
+async def record_route():
+    if request.url_rule is not None:
+        record_activity(request.url_rule.rule)
+
+@app.before_websocket
+async def record_websocket_route():
+    if websocket.url_rule is not None:
+        record_activity(websocket.url_rule.rule)
+
+
+# Every callback the loop runs goes through Handle._run, so timing it there
+# finds slow callbacks without asyncio debug mode. Loops with their own
+# handles, such as uvloop, never call it, so serve.py leaves uvloop out while
+# tracing is on.
+original_handle_run = asyncio.events.Handle._run
+
+def timed_handle_run(handle):
+    started = time.perf_counter()
+    original_handle_run(handle)
+    duration = time.perf_counter() - started
+
+    if duration >= settings.SLOW_CALLBACK_THRESHOLD:
+        record_slow_callback(handle, duration)
+
+def record_slow_callback(handle, duration):
+    name = handle._context.get(activity) or 'unknown'
+    slow_callbacks.append({
+        'at': time.time(),
+        'duration': duration,
+        'activity': name,
+        'callback': repr(handle)[:200]
+    })
+    slow_callback_counts[name] = slow_callback_counts.get(name, 0) + 1
+    app.logger.warning('Slow callback for {} took {:.3f} s'.format(name, duration))
+
+def trace_slow_callbacks():
+    asyncio.events.Handle._run = timed_handle_run
+
+# Lag is how much later than asked for a sleep wakes up, which is how long
+# anything ready to run would have waited
+async def measure_loop_lag(interval):
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        loop_lag.observe(max(0, time.perf_counter() - expected))
+
+@app.before_serving
+async def start_loop_monitor():
+    global lag_task
+
+    if settings.SLOW_CALLBACK_THRESHOLD > 0:
+        loop = asyncio.get_event_loop()
+
+        if isinstance(loop, asyncio.BaseEventLoop):
+            trace_slow_callbacks()
+        else:
+            app.logger.warning('Slow callbacks are not traced on {}'.format(type(loop).__module__))
+
+    if settings.LOOP_LAG_INTERVAL > 0:
+        loop = asyncio.get_event_loop()
+        lag_task = loop.create_task(measure_loop_lag(settings.LOOP_LAG_INTERVAL))
+
+@app.after_serving
+async def stop_loop_monitor():
+    asyncio.events.Handle._run = original_handle_run
+
+    if lag_task is not None:
+        lag_task.cancel()
+
+def collect_metrics():
+    return [
+        ('event_loop_lag_seconds', 'histogram', 'How late the event loop wakes from a sleep', [({}, loop_lag)]),
+        ('slow_callbacks_total', 'counter', 'Event loop callbacks slower than SLOW_CALLBACK_THRESHOLD, by route or event code', [
+            ({'activity': name}, count) for name, count in sorted(slow_callback_counts.items())
+        ])
+    ]
+
+metrics.register_collector(collect_metrics)
+
+
+# Samples the stack of thread_id every interval seconds until stop is set,
+# counting each distinct stack
+def sample_stacks(thread_id, interval, stop, counts):
+    while not stop.wait(interval):
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+
+        if stack:
+            counts[';'.join(reversed(stack))] += 1
+
+# One "frame;frame;frame count" line per stack, for flamegraph.pl or speedscope
+def fold(counts):
+    return ''.join('{} {}\n'.format(stack, count) for stack, count in counts.most_common())
+
+def is_admin():
+    return auth.has_bearer_token(request.headers, settings.ADMIN_TOKEN)
+
+@app.route('/admin/profile', methods = ['POST'])
+async def profile_event_loop():
+    if not is_admin():
+        return error_response(403, 'Admin token required')
+
+    try:
+        message = 'seconds must be a number up to {}'.format(settings.PROFILER_MAX_SECONDS)
+        seconds = float(request.args.get('seconds', 10))
+        assert 0 < seconds <= settings.PROFILER_MAX_SECONDS
+    except (AssertionError, ValueError):
+        return error_response(422, message)
+
+    if profiler_lock.locked():
+        return error_response(409, 'A profile is already running')
+
+    async with profiler_lock:
+        counts = collections.Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target = sample_stacks,
+            args = (threading.get_ident(), settings.PROFILER_INTERVAL, stop, counts),
+            daemon = True
+        )
+        sampler.start()
+
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            sampler.join()
+
+    return app.response_class(response = fold(counts), mimetype = 'text/plain')
+
+@app.route('/admin/slow_callbacks')
+async def fetch_slow_callbacks():
+    if not is_admin():
+        return error_response(403, 'Admin token required')
+
+    return json_response({
+        'threshold': settings.SLOW_CALLBACK_THRESHOLD,
+        'loop_lag': {
+            'count': loop_lag.count,
+            'mean': loop_lag.sum / loop_lag.count if loop_lag.count else 0
+        },
+        'slow_callbacks': list(slow_callbacks)
+    })
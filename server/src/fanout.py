@@ -0,0 +1,145 @@
+import asyncio
+from collections import deque, namedtuple
+import time
+
+import serialization
+import settings
+
+# An event encoded once and shared by every subscriber it is delivered to.
+# Frames with the same state_key carry full state, so a newer one supersedes
+# any older one still waiting in a queue.
+Frame = namedtuple('Frame', ['code', 'data', 'text', 'state_key'])
+
+CONTROL_CODES = {'EXCHANGE_SOCKET', 'RELEASE_ALL', 'RELEASE_USER', 'SLOW_CONSUMER', 'REVOKE_USER', 'UPDATE_PROFILE', 'SERVER_DRAINING'}
+POLICIES = {'coalesce', 'resync', 'disconnect'}
+
+# With FRAME_TIMESTAMPS frames say when they were sent, so load tests can
+# measure how long broadcasts take to arrive
+def encode_frame(code, data, state_key=None):
+    message = {
+        'code': code,
+        'data': data
+    }
+
+    if settings.FRAME_TIMESTAMPS:
+        message['sent_at'] = time.time()
+
+    return Frame(code, data, serialization.dumps(message), state_key)
+
+# Frames already encoded as JSON objects, sent together as one JSON array
+def encode_batch(frames):
+    if len(frames) == 1:
+        return frames[0].text
+
+    return '[{}]'.format(','.join(frame.text for frame in frames))
+
+async def publish(subscribers, frame):
+    for subscriber in subscribers:
+        subscriber.put(frame)
+
+
+class QueueStats():
+    def __init__(self):
+        self.high_water_mark = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.disconnects = 0
+
+
+class Subscriber():
+    def __init__(self, features=(), stats=None,
+                 max_size=settings.SUBSCRIBER_QUEUE_SIZE, policy=settings.SUBSCRIBER_QUEUE_POLICY):
+        if policy not in POLICIES:
+            raise ValueError('Unknown slow consumer policy {}'.format(policy))
+
+        self.features = frozenset(features)
+        self.stats = stats or QueueStats()
+        self.max_size = max_size
+        self.policy = policy
+        self.frames = deque()
+        self.ready = asyncio.Event()
+        self.disconnected = False
+
+    def qsize(self):
+        return len(self.frames)
+
+    def put(self, frame):
+        if self.disconnected:
+            return
+
+        if frame.state_key is not None and self.policy == 'coalesce':
+            self.coalesce(frame.state_key)
+
+        if len(self.frames) >= self.max_size and frame.code not in CONTROL_CODES:
+            if self.policy == 'disconnect':
+                self.disconnect()
+                return
+
+            self.resync()
+
+        self.frames.append(frame)
+        self.stats.high_water_mark = max(self.stats.high_water_mark, len(self.frames))
+        self.ready.set()
+
+    async def get(self):
+        while not self.frames:
+            self.ready.clear()
+            await self.ready.wait()
+
+        return self.frames.popleft()
+
+    # Every frame queued so far, waiting for the first if there are none
+    async def get_all(self):
+        while not self.frames:
+            self.ready.clear()
+            await self.ready.wait()
+
+        (frames, self.frames) = (self.frames, deque())
+        return frames
+
+    def coalesce(self, state_key):
+        kept = deque(f for f in self.frames if f.state_key != state_key)
+        self.stats.coalesced += len(self.frames) - len(kept)
+        self.frames = kept
+
+    def drop_pending(self):
+        kept = deque(f for f in self.frames if f.code in CONTROL_CODES)
+        self.stats.dropped += len(self.frames) - len(kept)
+        self.frames = kept
+
+    def resync(self):
+        self.drop_pending()
+        self.stats.resyncs += 1
+        self.frames.append(encode_frame('RESYNC_REQUIRED', {}))
+
+    def disconnect(self):
+        self.drop_pending()
+        self.stats.disconnects += 1
+        self.frames.append(encode_frame('SLOW_CONSUMER', {}))
+        self.disconnected = True
+        self.ready.set()
+
+
+# Collects items per key and hands each key's items to flush once the window
+# after its first item has passed, or earlier when flush_key is called.
+class EventBatcher():
+    def __init__(self, window, flush):
+        self.window = window
+        self.flush = flush
+        self.pending = {}
+
+    def add(self, key, item):
+        items = self.pending.get(key)
+
+        if items is None:
+            items = self.pending[key] = []
+            asyncio.get_event_loop().call_later(self.window, self.flush_key, key)
+
+        items.append(item)
+
+    def flush_key(self, key):
+        items = self.pending.pop(key, None)
+
+        if items:
+            self.flush(key, items)
@@ -1,12 +1,14 @@
-import json
 from datetime import datetime, timezone
 
 from quart import request, websocket, g
 
 from app import app
 import auth
-from model import get_user_lobby, get_profile
-from response_helpers import error_response
+import lobby
+import serialization
+from model import encode_lobby, get_user_lobby, get_profile
+from response_helpers import error_response, json_response
+import settings
 
 
 @app.before_websocket
@@ -16,7 +18,7 @@ async def ws_manage_user_id():
 
 @app.before_request
 async def manage_user_id():
-    if "handshake" in request.path:
+    if "handshake" in request.path or request.path == '/metrics' or request.path.startswith('/admin/'):
         return
 
     return add_authenticated_user_to_global_context(request)
@@ -36,23 +38,41 @@ def add_authenticated_user_to_global_context(context):
 @app.route('/handshake', methods = ['POST'])
 async def handshake():
     try:
-        (_, user_id) = auth.authenticate_user(request.cookies.get('secret_token'))
-        new_secret_token = None
+        (secret_token, user_id) = auth.authenticate_user(request.cookies.get('secret_token'))
+        new_secret_token = auth.create_token(user_id) if auth.needs_renewal(secret_token) else None
     except (KeyError, ValueError):
         (new_secret_token, user_id) = auth.create_new_user()
 
+    active_lobby = get_user_lobby(user_id)
+    handshake_data = {
+        'user_id': user_id,
+        'utc_time': datetime.now(timezone.utc).timestamp(),
+        'profile': get_profile(user_id)
+    }
+
+    if active_lobby is None:
+        handshake_data['active_lobby'] = None
+        encoded = serialization.encode(handshake_data)
+    else:
+        encoded = serialization.encode_with(handshake_data, 'active_lobby', encode_lobby(active_lobby))
+
     response = app.response_class(
-        response = json.dumps({
-            'user_id': user_id,
-            'active_lobby': get_user_lobby(user_id),
-            'utc_time': datetime.now(timezone.utc).timestamp(),
-            'profile': get_profile(user_id)
-        }),
+        response = encoded,
         status = 200,
         mimetype = 'application/json'
     )
 
     if new_secret_token is not None:
-        response.set_cookie('secret_token', new_secret_token)
+        response.set_cookie('secret_token', new_secret_token, max_age = settings.SESSION_TTL, httponly = True)
+
+    return response
+
+
+# Ends every session of the user, on every worker
+@app.route('/logout', methods = ['POST'])
+async def logout():
+    await lobby.revoke_user_sessions(g.user_id)
 
+    response = json_response({})
+    response.delete_cookie('secret_token')
     return response
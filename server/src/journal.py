@@ -0,0 +1,142 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import json
+import os
+import pickle
+
+# Append-only log of state mutations with periodic snapshots.
+#
+# Mutations call record() and are appended to journal.<generation>.log by a
+# background flush, so fsync never sits on a request's path. A snapshot
+# captures every registered state at a point between two mutations and starts
+# a new generation. Recovery loads the snapshot then replays the journals of
+# its generation onwards.
+
+JOURNAL_PATH = 'journal.{:012d}.log'
+SNAPSHOT_PATH = 'snapshot.pickle'
+
+directory = None
+generation = 0
+pending = []
+replaying = False
+operations = {}
+states = {}
+executor = ThreadPoolExecutor(max_workers = 1)
+
+def register_operation(name, function):
+    operations[name] = function
+
+def register_state(name, dump, load):
+    states[name] = (dump, load)
+
+def record(operation, *args):
+    if directory is not None and not replaying:
+        pending.append(json.dumps([operation, *args]))
+
+def journal_path(journal_generation):
+    return os.path.join(directory, JOURNAL_PATH.format(journal_generation))
+
+def append_lines(path, lines):
+    with open(path, 'a') as file:
+        file.write(''.join(line + '\n' for line in lines))
+        file.flush()
+        os.fsync(file.fileno())
+
+def write_snapshot(data, snapshot_generation):
+    snapshot_path = os.path.join(directory, SNAPSHOT_PATH)
+    temporary_path = snapshot_path + '.tmp'
+
+    with open(temporary_path, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temporary_path, snapshot_path)
+
+    for path in glob.glob(os.path.join(directory, 'journal.*.log')):
+        if path < journal_path(snapshot_generation):
+            os.unlink(path)
+
+def take_pending():
+    global pending
+    lines, pending = pending, []
+    return lines
+
+async def flush():
+    lines = take_pending()
+
+    if lines:
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(executor, append_lines, journal_path(generation), lines)
+
+async def snapshot():
+    global generation
+
+    # Pickled on the event loop, as the state must not change midway. This
+    # pauses every lobby on the worker, see benchmarks/recovery.py
+    lines = take_pending()
+    data = pickle.dumps({
+        'generation': generation + 1,
+        'states': dict((name, dump()) for name, (dump, _) in states.items())
+    })
+    generation += 1
+
+    # Lines before the snapshot still reach the old journal first, so a crash
+    # while the snapshot is written leaves the previous snapshot replayable
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(executor, append_lines, journal_path(generation - 1), lines)
+    await loop.run_in_executor(executor, write_snapshot, data, generation)
+
+async def run_periodically(flush_interval, snapshot_interval):
+    loop = asyncio.get_event_loop()
+    next_snapshot = loop.time() + snapshot_interval
+
+    while True:
+        await asyncio.sleep(flush_interval)
+
+        if loop.time() >= next_snapshot:
+            next_snapshot = loop.time() + snapshot_interval
+            await snapshot()
+        else:
+            await flush()
+
+def replay(path):
+    with open(path) as file:
+        for line in file:
+            try:
+                (operation, *args) = json.loads(line)
+            except ValueError:
+                # A torn final line from a crash mid-write
+                break
+
+            operations[operation](*args)
+
+def restore(journal_directory):
+    global directory, generation, replaying
+
+    directory = journal_directory
+    os.makedirs(directory, exist_ok = True)
+    snapshot_path = os.path.join(directory, SNAPSHOT_PATH)
+
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path, 'rb') as file:
+            data = pickle.load(file)
+
+        generation = data['generation']
+
+        for name, state in data['states'].items():
+            states[name][1](state)
+
+    replaying = True
+
+    try:
+        for path in sorted(glob.glob(os.path.join(directory, 'journal.*.log'))):
+            if path >= journal_path(generation):
+                replay(path)
+                generation = int(os.path.basename(path).split('.')[1])
+    finally:
+        replaying = False
+
+    # Never append after a line that may have been torn
+    generation += 1
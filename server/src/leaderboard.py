@@ -0,0 +1,186 @@
+from bisect import bisect_left, insort
+
+# Maps user_id to {'score', 'position'} entries like the plain dict it replaces,
+# while keeping users bucketed by score so ranks can be updated incrementally.
+# Scores must be changed with add_points or set_score to keep the buckets valid.
+class Leaderboard(dict):
+    def __init__(self, entries=()):
+        super().__init__()
+        self.scores = []
+        self.buckets = {}
+        self.bucket_positions = {}
+        self.moved_user_ids = {}
+        self.dirty_user_ids = {}
+        self.seq = 0
+
+        for user_id, entry in dict(entries).items():
+            self[user_id] = entry
+
+        # Initial entries are the baseline that deltas are relative to
+        self.update_positions()
+        self.dirty_user_ids = {}
+
+    def __setitem__(self, user_id, entry):
+        if user_id in self:
+            self.unbucket(user_id)
+
+        super().__setitem__(user_id, entry)
+        self.bucket(user_id, entry['score'])
+        self.dirty_user_ids[user_id] = None
+
+    def __reduce__(self):
+        return (restore_leaderboard, (dict(self), self.seq, list(self.dirty_user_ids)))
+
+    def __delitem__(self, user_id):
+        self.unbucket(user_id)
+        super().__delitem__(user_id)
+        self.dirty_user_ids[user_id] = None
+
+    def pop(self, user_id, *default):
+        if user_id in self:
+            self.unbucket(user_id)
+            self.dirty_user_ids[user_id] = None
+
+        return super().pop(user_id, *default)
+
+    def update(self, entries=(), **kwargs):
+        for user_id, entry in dict(entries, **kwargs).items():
+            self[user_id] = entry
+
+    def bucket(self, user_id, score):
+        if score not in self.buckets:
+            insort(self.scores, score)
+            self.buckets[score] = {}
+            self.bucket_positions[score] = None
+
+        self.buckets[score][user_id] = None
+        self.moved_user_ids[user_id] = None
+
+    def unbucket(self, user_id):
+        score = self[user_id]['score']
+        bucket = self.buckets[score]
+        del bucket[user_id]
+        self.moved_user_ids.pop(user_id, None)
+
+        if not bucket:
+            del self.scores[bisect_left(self.scores, score)]
+            del self.buckets[score]
+            del self.bucket_positions[score]
+
+    def add_points(self, user_id, points=1):
+        self.set_score(user_id, self[user_id]['score'] + points)
+
+    def set_score(self, user_id, score):
+        self.unbucket(user_id)
+        self[user_id]['score'] = score
+        self.bucket(user_id, score)
+        self.dirty_user_ids[user_id] = None
+
+    def add_points_to(self, user_ids, points=1):
+        get_entry = super().__getitem__
+        buckets = self.buckets
+        old_scores = set()
+        moved_by_score = {}
+
+        # Take every user out of their bucket before adding any back, so
+        # a bucket is only dropped when it really ends up empty
+        for user_id in user_ids:
+            entry = get_entry(user_id)
+            score = entry['score']
+            del buckets[score][user_id]
+            old_scores.add(score)
+            entry['score'] = score + points
+            moved_by_score.setdefault(score + points, []).append(user_id)
+
+        for score, moved_user_ids in moved_by_score.items():
+            if score not in buckets:
+                insort(self.scores, score)
+                buckets[score] = {}
+                self.bucket_positions[score] = None
+
+            moved = dict.fromkeys(moved_user_ids)
+            buckets[score].update(moved)
+            self.moved_user_ids.update(moved)
+            self.dirty_user_ids.update(moved)
+
+        for score in old_scores:
+            if not buckets[score]:
+                del self.scores[bisect_left(self.scores, score)]
+                del buckets[score]
+                del self.bucket_positions[score]
+
+    def set_scores(self, scores):
+        for user_id, score in scores.items():
+            if self[user_id]['score'] != score:
+                self.set_score(user_id, score)
+
+    def rank_of(self, user_id):
+        return len(self.scores) - bisect_left(self.scores, self[user_id]['score'])
+
+    def top(self, k):
+        user_ids = []
+
+        for score in reversed(self.scores):
+            for user_id in self.buckets[score]:
+                if len(user_ids) == k:
+                    return user_ids
+                user_ids.append(user_id)
+
+        return user_ids
+
+    def update_positions(self):
+        changed_user_ids = {}
+
+        def set_position(user_id, position):
+            entry = self[user_id]
+            if entry['position'] != position:
+                entry['position'] = position
+                changed_user_ids[user_id] = None
+                self.dirty_user_ids[user_id] = None
+
+        # Equal scores share a position, so a bucket only needs visiting when
+        # a score above it appeared or disappeared
+        for i, score in enumerate(reversed(self.scores)):
+            position = i + 1
+            if self.bucket_positions[score] != position:
+                self.bucket_positions[score] = position
+                for user_id in self.buckets[score]:
+                    set_position(user_id, position)
+
+        for user_id in self.moved_user_ids:
+            set_position(user_id, self.bucket_positions[self[user_id]['score']])
+
+        self.moved_user_ids = {}
+
+        return list(changed_user_ids)
+
+    # Entries added, removed or changed since the previous delta, with removed
+    # users mapped to None. Call after update_positions.
+    def take_delta(self):
+        self.seq += 1
+        entries = dict((user_id, copy_entry(self[user_id]) if user_id in self else None) for user_id in self.dirty_user_ids)
+        self.dirty_user_ids = {}
+
+        return {
+            'seq': self.seq,
+            'entries': entries
+        }
+
+    def snapshot(self):
+        return {
+            'seq': self.seq,
+            'leaderboard': self
+        }
+
+
+def copy_entry(entry):
+    return {
+        'score': entry['score'],
+        'position': entry['position']
+    }
+
+def restore_leaderboard(entries, seq, dirty_user_ids):
+    leaderboard = Leaderboard(entries)
+    leaderboard.seq = seq
+    leaderboard.dirty_user_ids = dict.fromkeys(dirty_user_ids)
+    return leaderboard
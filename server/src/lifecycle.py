@@ -0,0 +1,65 @@
+import sys
+import time
+
+import settings
+from timer_wheel import TimerWheel
+
+# Every timer in the server shares this wheel, rather than running a task
+# or call_later handle each
+wheel = TimerWheel(settings.TIMER_TICK, settings.TIMER_SLOTS)
+
+# Idle tracking. Activity only updates a timestamp. The single timer per
+# watched key fires at the earliest possible expiry, and is pushed back
+# by however much activity happened since it was set.
+last_activity = {}
+idle_timers = {}
+
+def watch(key, timeout, on_idle):
+    last_activity[key] = time.monotonic()
+    idle_timers[key] = wheel.schedule(timeout, check_idle, key, timeout, on_idle)
+
+def unwatch(key):
+    last_activity.pop(key, None)
+    timer = idle_timers.pop(key, None)
+
+    if timer is not None:
+        wheel.cancel(timer)
+
+def touch(key):
+    if key in last_activity:
+        last_activity[key] = time.monotonic()
+
+def check_idle(key, timeout, on_idle):
+    idle_time = time.monotonic() - last_activity[key]
+
+    if idle_time < timeout:
+        idle_timers[key] = wheel.schedule(timeout - idle_time, check_idle, key, timeout, on_idle)
+    else:
+        unwatch(key)
+        on_idle(key)
+
+# Approximate bytes held by plain data such as a lobby, counting shared
+# objects once. Compact objects are followed through __slots__ and __dict__.
+def estimate_size(obj, seen=None):
+    if seen is None:
+        seen = set()
+
+    if id(obj) in seen:
+        return 0
+
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, seen) for item in obj)
+
+    for name in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, name):
+            size += estimate_size(getattr(obj, name), seen)
+
+    if hasattr(obj, '__dict__') and not isinstance(obj, type):
+        size += estimate_size(vars(obj), seen)
+
+    return size
@@ -1,34 +1,241 @@
 import asyncio
+import random
+import time
+import uuid
 from datetime import datetime, timedelta, timezone
 
 from quart import request, g, websocket
 
 from app import app
-from questions import questions
+import auth
+import backend
+import diagnostics
+import fanout
+import lifecycle
+import metrics
 import model
-from response_helpers import error_response, linked_resource_response, json_response
+import question_bank
+import question_scheduler
+import settings
+from response_helpers import conditional_json_response, error_response, immutable_json_response, linked_resource_response, json_response
 
 LOBBY_URL = "{}lobby/{}"
+# lobby_id is only there for serve.py to find the worker holding the round
+ROUND_QUESTIONS_URL = "{}round/{}/questions?lobby_id={}"
+
+# Lobby ids restart from 1 when the server starts without a journal, so
+# etags include a per process prefix to avoid matching an older lobby
+ETAG_PREFIX = uuid.uuid4().hex[:8]
+
+# Session revocations reach every worker through the lobby backend
+REVOCATIONS_CHANNEL = 'revocations'
+PROFILES_CHANNEL = 'profiles'
 
 all_lobby_queues = {}
+all_lobby_queue_stats = {}
+timer_wheel_task = None
+draining = False
+reaped_lobby_count = 0
+reclaimed_lobby_bytes = 0
+
+# audience is a (feature, enabled) pair limiting delivery to the sockets
+# that did or did not negotiate the feature
+async def broadcast(lobby_id, code, data, audience=None, state_key=None):
+    diagnostics.record_activity(code)
+    started = time.perf_counter()
+    frame = fanout.encode_frame(code, data, state_key)
+    await lobby_backend.publish(lobby_id, frame, audience)
+    metrics.observe_broadcast(code, time.perf_counter() - started)
+
+async def deliver(lobby_id, frame, audience):
+    if lobby_id == REVOCATIONS_CHANNEL:
+        auth.revoke_user(frame.data['user_id'], frame.data['revoked_at'])
+        return
+
+    if lobby_id == PROFILES_CHANNEL:
+        if model.get_profile(frame.data['user_id']) != frame.data:
+            model.update_profile(frame.data['user_id'], frame.data['display_name'], frame.data['image_filename'])
+        return
+
+    subscribers = all_lobby_queues.get(lobby_id, {}).values()
+
+    if audience is not None:
+        (feature, enabled) = audience
+        subscribers = [s for s in subscribers if (feature in s.features) == enabled]
+
+    await fanout.publish(subscribers, frame)
+    metrics.count_messages(frame.code, len(subscribers))
+
+    if frame.code == 'RELEASE_ALL' and lobby_backend.shared:
+        all_lobby_queues.pop(lobby_id, None)
+        all_lobby_queue_stats.pop(lobby_id, None)
+
+lobby_backend = backend.create_backend(deliver)
+
+@app.before_serving
+async def start_lobby_backend():
+    await lobby_backend.start()
+    await lobby_backend.subscribe(REVOCATIONS_CHANNEL)
+    await lobby_backend.subscribe(PROFILES_CHANNEL)
+
+async def revoke_user_sessions(user_id):
+    await lobby_backend.publish(REVOCATIONS_CHANNEL, fanout.encode_frame('REVOKE_USER', {
+        'user_id': user_id,
+        'revoked_at': int(time.time())
+    }))
 
-async def broadcast(lobby_id, code, data):
-    message = {
-        'code': code,
-        'data': data
-    }
+# Profiles are updated on one worker but shown in lobbies on every other
+async def share_profile(user_id):
+    if lobby_backend.shared:
+        await lobby_backend.publish(PROFILES_CHANNEL, fanout.encode_frame('UPDATE_PROFILE', model.get_profile(user_id)))
+
+@app.after_serving
+async def stop_lobby_backend():
+    await lobby_backend.stop()
+
+def flush_answer_batch(lobby_id, answers):
+    if lobby_id not in all_lobby_queues:
+        return
+
+    loop = asyncio.get_event_loop()
+    loop.create_task(broadcast(lobby_id, 'ANSWER_BATCH', {
+        'answers': answers
+    }, ('answer_batch', True)))
+
+answer_batcher = fanout.EventBatcher(settings.ANSWER_BATCH_WINDOW, flush_answer_batch)
+
+@app.before_serving
+async def start_timer_wheel():
+    global timer_wheel_task
+
+    loop = asyncio.get_event_loop()
+    timer_wheel_task = loop.create_task(lifecycle.wheel.run())
+
+@app.after_serving
+async def stop_timer_wheel():
+    timer_wheel_task.cancel()
+
+def open_lobby_queues(lobby_id):
+    all_lobby_queues[lobby_id] = {}
+    all_lobby_queue_stats[lobby_id] = fanout.QueueStats()
+
+    if settings.LOBBY_IDLE_TIMEOUT > 0:
+        lifecycle.watch(lobby_id, settings.LOBBY_IDLE_TIMEOUT, close_idle_lobby)
+
+# With a shared backend, sockets may join a lobby another worker holds, which
+# is only known by its id. Ids this worker hands out must be lobbies it holds.
+def open_remote_lobby_queues(lobby_id):
+    if lobby_id < 1 or (
+        settings.WORKER_COUNT > 1 and
+        model.worker_for_lobby(lobby_id, settings.WORKER_COUNT) == settings.WORKER_INDEX
+    ):
+        raise KeyError(lobby_id)
+
+    all_lobby_queues[lobby_id] = {}
+    all_lobby_queue_stats[lobby_id] = fanout.QueueStats()
+
+# Queues for a lobby held by another worker go with its last socket here
+async def close_remote_lobby_queues(lobby_id):
+    if all_lobby_queues.get(lobby_id) != {}:
+        return
+
+    del all_lobby_queues[lobby_id]
+    all_lobby_queue_stats.pop(lobby_id, None)
+    await lobby_backend.unsubscribe(lobby_id)
+
+def close_idle_lobby(lobby_id):
+    global reaped_lobby_count, reclaimed_lobby_bytes
+
+    if lobby_id not in model.lobbies:
+        return
+
+    reclaimed_bytes = lifecycle.estimate_size(model.lobbies[lobby_id]) + sum(
+        len(frame.text) for queue in all_lobby_queues.get(lobby_id, {}).values() for frame in queue.frames)
+
+    answer_batcher.flush_key(lobby_id)
+    question_scheduler.cancel(lobby_id)
+    model.delete_lobby(lobby_id)
 
-    for queue in all_lobby_queues[lobby_id].values():
-        await queue.put(message)
+    loop = asyncio.get_event_loop()
+    loop.create_task(notify_lobby_closed(lobby_id))
+
+    reaped_lobby_count += 1
+    reclaimed_lobby_bytes += reclaimed_bytes
+    app.logger.info('Closed idle lobby {}, reclaiming about {} bytes'.format(lobby_id, reclaimed_bytes))
+
+# Queue depths and slow consumer counts are listed for the METRICS_LOBBY_LIMIT
+# lobbies with the most frames waiting, and summed over every lobby
+def collect_metrics():
+    lobby_depths = sorted(
+        ((lobby_id, [queue.qsize() for queue in queues.values()]) for lobby_id, queues in all_lobby_queues.items()),
+        key = lambda item: sum(item[1]),
+        reverse = True
+    )
+    listed_depths = lobby_depths[:settings.METRICS_LOBBY_LIMIT]
+    listed_stats = [
+        (lobby_id, all_lobby_queue_stats[lobby_id]) for lobby_id, _ in listed_depths if lobby_id in all_lobby_queue_stats
+    ]
+    queue_stats = all_lobby_queue_stats.values()
+
+    return [
+        ('open_lobbies', 'gauge', 'Lobbies held by this process', [({}, len(model.lobbies))]),
+        ('open_sockets', 'gauge', 'Websockets subscribed to a lobby', [({}, sum(len(depths) for _, depths in lobby_depths))]),
+        ('queued_frames', 'gauge', 'Frames waiting to be sent on all sockets', [({}, sum(sum(depths) for _, depths in lobby_depths))]),
+        ('lobby_sockets', 'gauge', 'Websockets per lobby', [
+            ({'lobby_id': lobby_id}, len(depths)) for lobby_id, depths in listed_depths
+        ]),
+        ('lobby_queued_frames', 'gauge', 'Frames waiting per lobby', [
+            ({'lobby_id': lobby_id}, sum(depths)) for lobby_id, depths in listed_depths
+        ]),
+        ('lobby_max_queue_depth', 'gauge', 'Deepest socket queue per lobby', [
+            ({'lobby_id': lobby_id}, max(depths, default = 0)) for lobby_id, depths in listed_depths
+        ]),
+        ('slow_consumer_events_total', 'counter', 'Slow consumer handling in open lobbies, by kind', [
+            ({'kind': kind}, sum(getattr(stats, kind) for stats in queue_stats))
+            for kind in ['coalesced', 'dropped', 'resyncs', 'disconnects']
+        ]),
+        ('lobby_queue_high_water_mark', 'gauge', 'Most frames ever waiting on one socket per lobby', [
+            ({'lobby_id': lobby_id}, stats.high_water_mark) for lobby_id, stats in listed_stats
+        ]),
+        ('lobby_slow_consumer_events_total', 'counter', 'Slow consumer handling per lobby, by kind', [
+            ({'lobby_id': lobby_id, 'kind': kind}, getattr(stats, kind))
+            for lobby_id, stats in listed_stats
+            for kind in ['coalesced', 'dropped', 'resyncs', 'disconnects']
+        ]),
+        ('question_timers', 'gauge', 'Questions waiting to be ended by the server', [({}, len(question_scheduler.question_timers))]),
+        ('wheel_timers', 'gauge', 'Timers on the shared timer wheel', [({}, lifecycle.wheel.timer_count)]),
+        ('reaped_lobbies_total', 'counter', 'Lobbies closed for being idle', [({}, reaped_lobby_count)]),
+        ('reclaimed_lobby_bytes_total', 'counter', 'Approximate bytes freed by closing idle lobbies', [({}, reclaimed_lobby_bytes)])
+    ]
+
+metrics.register_collector(collect_metrics)
+
+# On shutdown, sockets are told to reconnect at a random point over
+# SERVE_RECONNECT_SPREAD seconds, so a restart does not bring every client
+# back at once. Frames already queued are sent before RELEASE_ALL closes
+# each socket. Lobbies themselves are kept by the journal.
+def drain():
+    global draining
+    draining = True
+
+    for queues in all_lobby_queues.values():
+        for queue in list(queues.values()):
+            queue.put(fanout.encode_frame('SERVER_DRAINING', {
+                'reconnect_after': random.uniform(1, settings.SERVE_RECONNECT_SPREAD)
+            }))
+            queue.put(fanout.encode_frame('RELEASE_ALL', {}))
 
 @app.route('/create_lobby', methods = ['POST'])
 async def create_lobby():
     global all_lobby_queues
 
+    if draining:
+        return error_response(503, 'Server is restarting, try again shortly')
+
     lobby = model.create_lobby(g.user_id)
-    all_lobby_queues[lobby['id']] = {}
+    open_lobby_queues(lobby['id'])
 
-    return linked_resource_response(LOBBY_URL, 201, lobby['id'], lobby)
+    return with_lobby_cookie(linked_resource_response(LOBBY_URL, 201, lobby['id'], lobby, model.encode_lobby), lobby)
 
 @app.route('/join_lobby', methods = ['POST'])
 async def join_lobby():
@@ -45,16 +252,27 @@ async def join_lobby():
     loop = asyncio.get_event_loop()
     loop.create_task(broadcast(lobby['id'], 'USER_JOINED', {
         'user_id': g.user_id,
-        'lobby': lobby
+        'lobby': model.public_lobby(lobby)
     }))
 
-    return linked_resource_response(LOBBY_URL, 200, lobby['id'], lobby)
+    return with_lobby_cookie(linked_resource_response(LOBBY_URL, 200, lobby['id'], lobby, model.encode_lobby), lobby)
+
+# Lets serve.py send requests that do not name a lobby, such as the
+# handshake, to the worker holding the user's lobby
+def with_lobby_cookie(response, lobby):
+    response.set_cookie('lobby_id', str(lobby['id']), max_age = settings.SESSION_TTL, httponly = True)
+    return response
+
+
+def lobby_etag(lobby):
+    return '{}-{}-{}'.format(ETAG_PREFIX, lobby['id'], lobby['v'])
 
 
 @app.route("/get_lobby/<join_code>")
 async def fetch_lobby_by_join_code(join_code):
     try:
-        return json_response(model.read_lobby(join_code=join_code))
+        lobby = model.read_lobby(join_code=join_code)
+        return conditional_json_response(lobby, lobby_etag(lobby), encode = model.encode_lobby)
     except KeyError:
         return error_response(404, 'join_code is incorrect or Lobby is closed')
 
@@ -62,7 +280,8 @@ async def fetch_lobby_by_join_code(join_code):
 @app.route("/lobby/<lobby_id>")
 async def fetch_lobby(lobby_id):
     try:
-        return json_response(model.read_lobby(lobby_id=lobby_id))
+        lobby = model.read_lobby(lobby_id=lobby_id)
+        return conditional_json_response(lobby, lobby_etag(lobby), encode = model.encode_lobby)
     except KeyError:
         return error_response(404, 'lobby_id is incorrect or Lobby is closed')
 
@@ -74,6 +293,9 @@ async def exit_lobby(lobby_id):
     loop = asyncio.get_event_loop()
 
     if lobby['host_id'] == g.user_id:
+        lifecycle.unwatch(lobby['id'])
+        question_scheduler.cancel(lobby['id'])
+        answer_batcher.flush_key(lobby['id'])
         loop.create_task(notify_lobby_closed(lobby['id']))
         model.delete_lobby(lobby['id'])
     else:
@@ -85,7 +307,7 @@ async def exit_lobby(lobby_id):
 async def notify_user_exited(user_id, lobby):
     await broadcast(lobby['id'], 'USER_EXITED', {
         'user_id': user_id,
-        'lobby': lobby
+        'lobby': model.public_lobby(lobby)
     })
     await broadcast(lobby['id'], 'RELEASE_USER', {
         'user_id': user_id,
@@ -95,28 +317,69 @@ async def notify_user_exited(user_id, lobby):
 async def notify_lobby_closed(lobby_id):
     await broadcast(lobby_id, 'LOBBY_CLOSED', {})
     await broadcast(lobby_id, 'RELEASE_ALL', {})
-    all_lobby_queues.pop(lobby_id)
+    await lobby_backend.unsubscribe(lobby_id)
+    all_lobby_queues.pop(lobby_id, None)
+    all_lobby_queue_stats.pop(lobby_id, None)
 
 
 @app.route("/lobby/<lobby_id>/start_round", methods = ['POST'])
 async def start_round(lobby_id):
-    lobby = model.edit_lobby(lobby_id)
+    data = await request.get_json() or {}
 
-    lobby['round'] = {
-        'questions': questions,
-        'answers': model.create_answers_store(lobby['users']),
-        'leaderboard': model.create_leaderboard_store(lobby['users']),
-    }
+    try:
+        message = 'count must be a positive integer'
+        count = int(data.get('count', settings.QUESTIONS_PER_ROUND))
+        assert count > 0
+
+        message = 'auto_advance must be a boolean'
+        auto_advance = data.get('auto_advance', False)
+        assert isinstance(auto_advance, bool)
+
+        message = 'difficulty must be an integer'
+        difficulty = data.get('difficulty')
+        difficulty = None if difficulty is None else int(difficulty)
+    except (AssertionError, ValueError):
+        return error_response(422, message)
 
+    # Sampled before the lobby is edited, as nothing may be awaited between
+    # edit_lobby and start_round. The lobby can close in the meantime.
     loop = asyncio.get_event_loop()
-    loop.create_task(broadcast(lobby['id'], 'ROUND_STARTED', lobby['round']))
+    questions = await loop.run_in_executor(
+        question_bank.executor,
+        question_bank.sample_questions,
+        count,
+        data.get('video_id'),
+        data.get('tag'),
+        difficulty
+    )
+
+    if not questions:
+        return error_response(422, 'no questions match the request')
+
+    try:
+        lobby = model.edit_lobby(lobby_id)
+    except KeyError:
+        return error_response(404, 'lobby_id is incorrect or Lobby is closed')
+
+    question_scheduler.cancel(lobby['id'])
+    round = model.start_round(lobby, questions, auto_advance)
+    manifest = {
+        'manifest_id': round['manifest_id'],
+        'questions_url': ROUND_QUESTIONS_URL.format(request.root_url, round['manifest_id'], lobby['id']),
+        'question_count': len(questions)
+    }
+
+    # The first question is announced after the round it belongs to
+    current_question = begin_question(lobby, 0, notify = False) if auto_advance else None
+
+    loop.create_task(notify_round_started(lobby['id'], round, manifest, current_question))
 
     return json_response({})
 
 @app.route("/lobby/<lobby_id>/start_question", methods = ['POST'])
 async def start_question(lobby_id):
-    lobby = model.edit_lobby(lobby_id)
     data = await request.get_json()
+    lobby = model.edit_lobby(lobby_id)
     requested_question_index = int(data['question_index'])
     current_question = lobby['round'].get('current_question')
 
@@ -132,22 +395,79 @@ async def start_question(lobby_id):
     except AssertionError:
         return error_response(422, message)
 
-    lobby['round']['current_question'] = {
-        'i': requested_question_index,
-        'start_time': (datetime.now(timezone.utc) + timedelta(seconds = 5)).timestamp(),
-        'has_ended': False
-    }
-
-    loop = asyncio.get_event_loop()
-    loop.create_task(broadcast(lobby['id'], 'QUESTION_STARTED', lobby['round']['current_question']))
+    begin_question(lobby, requested_question_index)
 
     return json_response({})
 
+# Clients are given QUESTION_START_DELAY seconds to cue the video. The
+# question then ends on the server once its answers lock, whether or not the
+# host ends it first, so the correct answer arrives before the video reveals
+# it.
+def begin_question(lobby, question_index, notify=True):
+    start_time = (datetime.now(timezone.utc) + timedelta(seconds = settings.QUESTION_START_DELAY)).timestamp()
+    current_question = model.start_question(lobby, question_index, start_time)
+    schedule_question_end(lobby)
+
+    if notify:
+        loop = asyncio.get_event_loop()
+        loop.create_task(broadcast(lobby['id'], 'QUESTION_STARTED', current_question))
+
+    return current_question
+
+def schedule_question_end(lobby):
+    round = lobby['round']
+    question_scheduler.schedule(
+        lobby['id'],
+        question_scheduler.answer_lock_wall_time(round) + settings.ANSWER_LOCK_GRACE,
+        end_question_on_time,
+        lobby['id'],
+        round['current_question']['i']
+    )
+
+# Auto advancing rounds start the next question once the video has played
+# to the end_time of the one before
+def schedule_next_question(lobby):
+    round = lobby['round']
+    question_scheduler.schedule(
+        lobby['id'],
+        question_scheduler.end_wall_time(round),
+        start_next_question_on_time,
+        lobby['id'],
+        round['current_question']['i']
+    )
+
+def current_question_is(lobby_id, question_index, has_ended):
+    try:
+        current_question = model.read_lobby(lobby_id = lobby_id)['round']['current_question']
+        return current_question['i'] == question_index and current_question['has_ended'] == has_ended
+    except (KeyError, TypeError):
+        return False
+
+def end_question_on_time(lobby_id, question_index):
+    if current_question_is(lobby_id, question_index, False):
+        end_and_advance(model.edit_lobby(lobby_id), question_index)
+
+def start_next_question_on_time(lobby_id, question_index):
+    if current_question_is(lobby_id, question_index, True):
+        begin_question(model.edit_lobby(lobby_id), question_index + 1)
+
+# Puts back the timers of questions in progress when the server restarts
+def resume_round(lobby):
+    round = lobby.get('round')
+
+    if round is None or round.get('current_question') is None:
+        return
+
+    if not round['current_question']['has_ended']:
+        schedule_question_end(lobby)
+    elif round.get('auto_advance'):
+        schedule_next_question(model.edit_lobby(lobby['id']))
+
 
 @app.route("/lobby/<lobby_id>/answer_question", methods = ['POST'])
 async def answer_question(lobby_id):
-    lobby = model.edit_lobby(lobby_id)
     data = await request.get_json()
+    lobby = model.edit_lobby(lobby_id)
     question_index = int(data['question_index'])
     answer = str(data['answer'])
 
@@ -160,22 +480,34 @@ async def answer_question(lobby_id):
         message = 'Tried to answer question {}. Current question is {}'.format(question_index, current_question_index)
         return error_response(422, message)
 
-    lobby['round']['answers'][g.user_id][question_index] = answer
+    if question_scheduler.answers_locked(lobby['round']):
+        return error_response(422, 'Answers to question {} are locked'.format(question_index))
 
-    loop = asyncio.get_event_loop()
-    loop.create_task(broadcast(lobby['id'], 'ANSWER_RECEIVED', {
+    question = lobby['round']['questions'][question_index]
+    options = [key[len('answer_text_'):] for key in question if key.startswith('answer_text_')]
+
+    if answer not in options:
+        return error_response(422, 'Answer must be one of {}'.format(', '.join(sorted(options))))
+
+    model.answer_question(lobby, g.user_id, question_index, answer)
+
+    answer_data = {
         'user_id': g.user_id,
         'question_index': question_index,
         'answer': answer
-    }))
+    }
+
+    loop = asyncio.get_event_loop()
+    loop.create_task(broadcast(lobby['id'], 'ANSWER_RECEIVED', answer_data, ('answer_batch', False)))
+    answer_batcher.add(lobby['id'], answer_data)
 
     return json_response({})
 
 
 @app.route("/lobby/<lobby_id>/end_question", methods = ['POST'])
 async def end_question(lobby_id):
-    lobby = model.edit_lobby(lobby_id)
     data = await request.get_json()
+    lobby = model.edit_lobby(lobby_id)
     question_index = int(data['question_index'])
     round = lobby['round']
 
@@ -186,62 +518,136 @@ async def end_question(lobby_id):
     except (KeyError, AssertionError):
         return error_response(422, "Tried to end non-active or ended question")
 
-    round['current_question']['has_ended'] = True
+    end_and_advance(lobby, question_index)
 
-    for user_id in lobby['users']:
-        user_answer = round['answers'][user_id].get(question_index)
-        correct_answer = round['questions'][question_index]['correct_answer']
+    return json_response({})
 
-        if user_answer == correct_answer:
-            round['leaderboard'][user_id]['score'] += 1
+# Questions end here whether the host or their timer ends them
+def end_and_advance(lobby, question_index):
+    auto_advance = lobby['round'].get('auto_advance')
+    finish_question(lobby, question_index)
 
-    model.update_leaderboard_positions(round['leaderboard'])
+    if auto_advance and lobby['round'] is not None:
+        schedule_next_question(lobby)
+
+def finish_question(lobby, question_index):
+    round = lobby['round']
+    question_scheduler.cancel(lobby['id'])
+    answer_batcher.flush_key(lobby['id'])
+    delta = model.end_question(lobby, question_index)
+    reveal = {
+        'i': question_index,
+        'correct_answer': round['questions'][question_index]['correct_answer']
+    }
 
     loop = asyncio.get_event_loop()
-    loop.create_task(broadcast(lobby['id'], 'LEADERBOARD_UPDATED', round['leaderboard']))
+    loop.create_task(broadcast(lobby['id'], 'QUESTION_ENDED', reveal))
+    loop.create_task(notify_leaderboard_updated(lobby['id'], round['leaderboard'], delta))
 
-    if len(round['questions']) == current_question_index + 1:
-        lobby['previous_round'] = round
-        lobby['round'] = None
-        loop.create_task(broadcast(lobby['id'], 'ROUND_ENDED', round))
+    if lobby['round'] is None:
+        loop.create_task(broadcast(lobby['id'], 'ROUND_ENDED', model.public_round(round)))
+
+
+# Sockets that negotiated round_manifest fetch the questions once from the
+# manifest URL. Every socket gets each correct answer in QUESTION_ENDED.
+async def notify_round_started(lobby_id, round, manifest, current_question=None):
+    await broadcast(lobby_id, 'ROUND_STARTED', model.public_round(round), ('round_manifest', False))
+    await broadcast(lobby_id, 'ROUND_STARTED', manifest, ('round_manifest', True))
+
+    if current_question is not None:
+        await broadcast(lobby_id, 'QUESTION_STARTED', current_question)
 
-    return json_response({})
 
+async def notify_leaderboard_updated(lobby_id, leaderboard, delta):
+    await broadcast(lobby_id, 'LEADERBOARD_UPDATED', leaderboard, ('leaderboard_delta', False), 'leaderboard')
+    await broadcast(lobby_id, 'LEADERBOARD_UPDATED', delta, ('leaderboard_delta', True))
+
+
+@app.route("/lobby/<lobby_id>/leaderboard")
+async def fetch_leaderboard(lobby_id):
+    try:
+        lobby = model.read_lobby(lobby_id=lobby_id)
+        round = lobby.get('round') or lobby['previous_round']
+        return json_response(round['leaderboard'].snapshot())
+    except KeyError:
+        return error_response(404, 'lobby_id is incorrect or Lobby has no leaderboard')
+
+
+@app.route("/round/<manifest_id>/questions")
+async def fetch_round_questions(manifest_id):
+    try:
+        questions = model.get_round_manifest_questions(manifest_id)
+    except KeyError:
+        return error_response(404, 'manifest_id is incorrect')
+
+    return immutable_json_response(questions, manifest_id)
+
+
+# Whether frame ends this socket, removing its queue when it is the one
+# subscribed for the user
+def releases_socket(frame, queue, lobby_queues):
+    if frame.code in {'EXCHANGE_SOCKET', 'RELEASE_ALL'}:
+        return True
+
+    if frame.code == 'RELEASE_USER' and frame.data['user_id'] == g.user_id:
+        lobby_queues.pop(g.user_id)
+        return True
+
+    if frame.code == 'SLOW_CONSUMER':
+        if lobby_queues.get(g.user_id) is queue:
+            lobby_queues.pop(g.user_id)
+        return True
+
+    return False
 
 @app.websocket("/lobby/<lobby_id>/ws")
 async def lobby_updates(lobby_id):
     lobby_id = int(lobby_id)
 
     try:
+        if lobby_backend.shared and lobby_id not in all_lobby_queues:
+            open_remote_lobby_queues(lobby_id)
+
         current_lobby_queues = all_lobby_queues[lobby_id]
 
         await websocket.accept()
 
         try:
             existing_user_queue = current_lobby_queues[g.user_id]
-            await existing_user_queue.put({
-                'code': 'EXCHANGE_SOCKET',
-                'data': {}
-            })
+            existing_user_queue.put(fanout.encode_frame('EXCHANGE_SOCKET', {}))
         except KeyError:
             pass
 
-        queue = asyncio.Queue()
+        features = websocket.args.get('features', '').split(',')
+        queue = fanout.Subscriber(features, all_lobby_queue_stats[lobby_id])
         current_lobby_queues[g.user_id] = queue
+        lifecycle.touch(lobby_id)
+        await lobby_backend.subscribe(lobby_id)
+
+        released = False
+
+        # With frame_batch, everything queued since the last send goes out as
+        # one array frame, as a single write
+        while not released:
+            frames = await queue.get_all() if 'frame_batch' in queue.features else [await queue.get()]
+            sendable = []
 
-        while True:
-            data = await queue.get()
+            for frame in frames:
+                released = releases_socket(frame, queue, current_lobby_queues)
 
-            if data['code'] in {'EXCHANGE_SOCKET', 'RELEASE_ALL'}:
-                break
+                if released:
+                    break
 
-            if data['code'] == 'RELEASE_USER' and data['data']['user_id'] == g.user_id:
-                current_lobby_queues.pop(g.user_id)
-                break
+                sendable.append(frame)
 
-            await websocket.send_json(data)
+            if sendable:
+                await websocket.send(fanout.encode_batch(sendable))
+                lifecycle.touch(lobby_id)
 
     except KeyError:
         pass
     except:
         current_lobby_queues.pop(g.user_id)
+    finally:
+        if lobby_backend.shared and lobby_id not in model.lobbies:
+            await close_remote_lobby_queues(lobby_id)
@@ -1,6 +1,10 @@
 from app import app
+import metrics
+import diagnostics
+import compression
 import handshake
 import lobby
+import persistence
 import profile
 
 
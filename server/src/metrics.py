@@ -0,0 +1,146 @@
+import bisect
+import time
+
+from quart import request, g
+
+from app import app
+import auth
+from response_helpers import error_response
+import settings
+
+# Metrics in the Prometheus text format at /metrics. Request latency and
+# broadcasts are recorded as they happen. Anything that can be read from
+# server state, such as open lobbies, is read by collectors registered with
+# register_collector only when /metrics is scraped.
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+FANOUT_BUCKETS = [0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1]
+
+class Histogram():
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+
+        for (bound, count) in zip(self.buckets + ['+Inf'], self.counts):
+            cumulative += count
+            yield (name + '_bucket', dict(labels, le = bound), cumulative)
+
+        yield (name + '_sum', labels, self.sum)
+        yield (name + '_count', labels, self.count)
+
+
+request_latency = {}
+response_counts = {}
+broadcast_duration = {}
+broadcast_messages = {}
+collectors = []
+
+def observe_request(route, method, status, seconds):
+    histogram = request_latency.get((route, method))
+
+    if histogram is None:
+        histogram = request_latency[(route, method)] = Histogram(LATENCY_BUCKETS)
+
+    histogram.observe(seconds)
+    response_counts[(route, method, status)] = response_counts.get((route, method, status), 0) + 1
+
+def observe_broadcast(code, seconds):
+    histogram = broadcast_duration.get(code)
+
+    if histogram is None:
+        histogram = broadcast_duration[code] = Histogram(FANOUT_BUCKETS)
+
+    histogram.observe(seconds)
+
+def count_messages(code, message_count):
+    broadcast_messages[code] = broadcast_messages.get(code, 0) + message_count
+
+# collect returns (name, type, help, samples), with samples as a list of
+# (labels, value) pairs, or (labels, Histogram) pairs for histograms
+def register_collector(collect):
+    collectors.append(collect)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{{{}}}'.format(','.join('{}="{}"'.format(key, escape_label(value)) for key, value in labels.items()))
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def family(name, metric_type, help_text, samples):
+    lines = ['# HELP {} {}'.format(name, help_text), '# TYPE {} {}'.format(name, metric_type)]
+    lines.extend('{}{} {}'.format(sample_name, format_labels(labels), value) for (sample_name, labels, value) in samples)
+    return lines
+
+def render():
+    lines = []
+
+    lines += family('http_request_duration_seconds', 'histogram', 'HTTP request latency by route', (
+        sample
+        for (route, method), histogram in sorted(request_latency.items())
+        for sample in histogram.samples('http_request_duration_seconds', {'route': route, 'method': method})
+    ))
+    lines += family('http_responses_total', 'counter', 'HTTP responses by route and status', (
+        ('http_responses_total', {'route': route, 'method': method, 'status': status}, count)
+        for (route, method, status), count in sorted(response_counts.items())
+    ))
+    lines += family('broadcast_duration_seconds', 'histogram', 'Time to encode and fan out a broadcast, by event code', (
+        sample
+        for code, histogram in sorted(broadcast_duration.items())
+        for sample in histogram.samples('broadcast_duration_seconds', {'code': code})
+    ))
+    lines += family('broadcast_messages_total', 'counter', 'Messages queued for sockets, by event code', (
+        ('broadcast_messages_total', {'code': code}, count)
+        for code, count in sorted(broadcast_messages.items())
+    ))
+
+    for collect in collectors:
+        for (name, metric_type, help_text, samples) in collect():
+            if metric_type == 'histogram':
+                samples = (sample for (labels, histogram) in samples for sample in histogram.samples(name, labels))
+            else:
+                samples = ((name, labels, value) for (labels, value) in samples)
+
+            lines += family(name, metric_type, help_text, samples)
+
+    return '\n'.join(lines) + '\n'
+
+
+# Registered before the handshake check, so rejected requests are timed too
+@app.before_request
+async def start_request_timer():
+    # https://github.com/PyCQA/pylint/issues/3793
+    # pylint: disable=assigning-non-slot
+    g.request_started = time.perf_counter()
+
+@app.after_request
+async def record_request(response):
+    started = g.get('request_started')
+
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        observe_request(route, request.method, response.status_code, time.perf_counter() - started)
+
+    return response
+
+# Scrapers have no session, so with METRICS_TOKEN set they must send it
+# as a bearer token instead
+@app.route('/metrics')
+async def fetch_metrics():
+    if settings.METRICS_TOKEN and not auth.has_bearer_token(request.headers, settings.METRICS_TOKEN):
+        return error_response(403, 'Metrics token required')
+
+    return app.response_class(response = render(), mimetype = 'text/plain; version=0.0.4')
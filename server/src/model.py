@@ -1,14 +1,41 @@
+import hashlib
+import json
+
+import journal
+from leaderboard import Leaderboard
+import lifecycle
+from round_store import AnswersStore, LeaderboardEntry
+import serialization
+import settings
+
 lobby_index = 0
 lobbies = {}
 profiles = {}
+user_lobby_ids = {}
+round_manifests = {}
 
+# Workers started by serve.py each own every WORKER_COUNT-th id, so the id
+# says which worker holds a lobby. See worker_for_lobby. Ids taken by lobbies
+# restored from a journal written under other worker settings are skipped.
 def next_lobby_id():
     global lobby_index
-    lobby_index += 1
-    return lobby_index
 
-def create_lobby(host_id):
-    lobby_id = next_lobby_id()
+    while True:
+        lobby_index += 1
+        lobby_id = (lobby_index - 1) * settings.WORKER_COUNT + settings.WORKER_INDEX + 1
+
+        if lobby_id not in lobbies:
+            return lobby_id
+
+def worker_for_lobby(lobby_id, worker_count):
+    return (int(lobby_id) - 1) % worker_count
+
+# Replay passes the id the lobby was given, as ids depend on the worker
+# settings of the process that assigned them
+def create_lobby(host_id, lobby_id = None):
+    assigned_id = next_lobby_id()
+    lobby_id = assigned_id if lobby_id is None else lobby_id
+    journal.record('create_lobby', host_id, lobby_id)
     lobbies[lobby_id] = {
         'id': lobby_id,
         'host_id': host_id,
@@ -18,6 +45,7 @@ def create_lobby(host_id):
         },
         'v': 1
     }
+    index_user_lobby(host_id, lobby_id)
     return lobbies[lobby_id]
 
 def read_lobby(lobby_id=None, join_code=None):
@@ -28,54 +56,214 @@ def read_lobby(lobby_id=None, join_code=None):
 
 def edit_lobby(id_or_join_code):
     lobby = lobbies[int(id_or_join_code)]
+    journal.record('edit_lobby', lobby['id'])
     lobby['v'] += 1
+    serialization.invalidate(('lobby', lobby['id']))
+    lifecycle.touch(lobby['id'])
     return lobby
 
+# Routes must finish changing a lobby after edit_lobby before awaiting,
+# otherwise a read in between would cache the old lobby under the new v
+def encode_lobby(lobby):
+    return serialization.encode_cached(('lobby', lobby['id']), lobby['v'], public_lobby(lobby))
+
+# The lobby as clients see it, see public_round
+def public_lobby(lobby):
+    data = dict(lobby)
+
+    for key in ('round', 'previous_round'):
+        if key in lobby:
+            data[key] = public_round(lobby[key])
+
+    return data
+
 def delete_lobby(lobby_id):
-    del lobbies[int(lobby_id)]
+    lobby = lobbies.pop(int(lobby_id))
+    journal.record('delete_lobby', lobby['id'])
+    serialization.invalidate(('lobby', lobby['id']))
+
+    for user_id in lobby['users']:
+        unindex_user_lobby(user_id, lobby['id'])
+
+    release_round_manifest(lobby.get('round'))
+    release_round_manifest(lobby.get('previous_round'))
 
 def get_user_lobby(user_id):
-    for lobby_id in lobbies:
-        lobby = lobbies[lobby_id]
-        if user_id in lobby['users']:
-            return lobby
+    try:
+        # The oldest lobby is the one a scan of lobbies would find first
+        return lobbies[min(user_lobby_ids[user_id])]
+    except KeyError:
+        return None
+
+def index_user_lobby(user_id, lobby_id):
+    user_lobby_ids.setdefault(user_id, set()).add(lobby_id)
+
+def unindex_user_lobby(user_id, lobby_id):
+    lobby_ids = user_lobby_ids.get(user_id, set())
+    lobby_ids.discard(lobby_id)
+
+    if not lobby_ids:
+        user_lobby_ids.pop(user_id, None)
+
+def find_user_lobby_index_errors():
+    errors = []
+    expected = {}
+
+    for lobby_id, lobby in lobbies.items():
+        for user_id in lobby['users']:
+            expected.setdefault(user_id, set()).add(lobby_id)
+
+    for user_id in expected.keys() | user_lobby_ids.keys():
+        if expected.get(user_id) != user_lobby_ids.get(user_id):
+            errors.append('user {} is in lobbies {} but indexed in {}'.format(
+                user_id, expected.get(user_id), user_lobby_ids.get(user_id)))
+
+    return errors
 
 def create_answers_store(user_ids):
-    return dict((user_id, {}) for user_id in user_ids)
+    return AnswersStore(user_ids)
 
 def create_leaderboard_store(user_ids):
-    return dict((user_id, new_leaderboard_item()) for user_id in user_ids)
+    return Leaderboard((user_id, new_leaderboard_item()) for user_id in user_ids)
 
 def new_leaderboard_item():
-    return {
-        'score': 0,
-        'position': 1
-    }
+    return LeaderboardEntry()
 
 def update_leaderboard_positions(leaderboard):
-    scores = list(set(map(lambda x : x['score'], leaderboard.values())))
-    scores.reverse()
+    if not isinstance(leaderboard, Leaderboard):
+        leaderboard = Leaderboard(leaderboard)
 
-    for user_id in leaderboard:
-        score = leaderboard[user_id]['score']
-        leaderboard[user_id]['position'] = scores.index(score) + 1
+    return leaderboard.update_positions()
 
 
 def add_user_to_lobby(user_id, lobby):
+    journal.record('add_user_to_lobby', user_id, lobby['id'])
     lobby['users'][user_id] = get_profile(user_id)
+    index_user_lobby(user_id, lobby['id'])
 
-    try:
-        lobby['round']['leaderboard'][user_id] = new_leaderboard_item()
-    except KeyError:
-        pass
+    round = lobby.get('round')
+
+    if round is not None:
+        round['answers'].add_user(user_id)
+        round['leaderboard'][user_id] = new_leaderboard_item()
 
 def remove_user_from_lobby(user_id, lobby):
+    journal.record('remove_user_from_lobby', user_id, lobby['id'])
+
     try:
         del lobby['users'][user_id]
     except KeyError:
         pass
 
+    unindex_user_lobby(user_id, lobby['id'])
+
+# A round's questions without their answers, shared by every round with the
+# same questions. The ID is derived from the content so it never changes.
+def public_question(question):
+    return dict((key, value) for key, value in question.items() if key != 'correct_answer')
+
+# The round as clients see it. Correct answers are withheld until their
+# question ends, and the answers store is left out as it holds every user's
+# answers.
+def public_round(round):
+    if round is None:
+        return None
+
+    current_question = round.get('current_question')
+    ended_count = 0
+
+    if current_question is not None:
+        ended_count = current_question['i'] + (1 if current_question['has_ended'] else 0)
+
+    data = dict((key, value) for key, value in round.items() if key != 'answers')
+    data['questions'] = [
+        question if i < ended_count else public_question(question)
+        for i, question in enumerate(round['questions'])
+    ]
+    return data
+
+def create_round_manifest(questions):
+    public_questions = [public_question(question) for question in questions]
+    manifest_id = hashlib.sha256(json.dumps(public_questions, sort_keys = True).encode()).hexdigest()[:32]
+    manifest = round_manifests.setdefault(manifest_id, {
+        'questions': public_questions,
+        'round_count': 0
+    })
+    manifest['round_count'] += 1
+    return manifest_id
+
+def release_round_manifest(round):
+    if round is None:
+        return
+
+    manifest = round_manifests[round['manifest_id']]
+    manifest['round_count'] -= 1
+
+    if manifest['round_count'] == 0:
+        del round_manifests[round['manifest_id']]
+
+def get_round_manifest_questions(manifest_id):
+    return round_manifests[manifest_id]['questions']
+
+def start_round(lobby, questions, auto_advance=False):
+    journal.record('start_round', lobby['id'], questions, auto_advance)
+    release_round_manifest(lobby.get('round'))
+
+    lobby['round'] = {
+        'manifest_id': create_round_manifest(questions),
+        'questions': questions,
+        'answers': create_answers_store(lobby['users']),
+        'leaderboard': create_leaderboard_store(lobby['users']),
+        'auto_advance': auto_advance
+    }
+    return lobby['round']
+
+def start_question(lobby, question_index, start_time):
+    journal.record('start_question', lobby['id'], question_index, start_time)
+
+    lobby['round']['current_question'] = {
+        'i': question_index,
+        'start_time': start_time,
+        'has_ended': False
+    }
+    return lobby['round']['current_question']
+
+def answer_question(lobby, user_id, question_index, answer):
+    lobby['round']['answers'].record(user_id, question_index, answer)
+    journal.record('answer_question', lobby['id'], user_id, question_index, answer)
+
+def end_question(lobby, question_index):
+    journal.record('end_question', lobby['id'], question_index)
+    round = lobby['round']
+    round['current_question']['has_ended'] = True
+
+    correct_answer = round['questions'][question_index]['correct_answer']
+    user_ids = round['answers'].matching_user_ids(question_index, correct_answer)
+    round['leaderboard'].add_points_to(user_id for user_id in user_ids if user_id in lobby['users'])
+
+    update_leaderboard_positions(round['leaderboard'])
+    delta = round['leaderboard'].take_delta()
+
+    if len(round['questions']) == question_index + 1:
+        release_round_manifest(lobby.get('previous_round'))
+        lobby['previous_round'] = round
+        lobby['round'] = None
+
+    return delta
+
+def rescore_round(lobby):
+    journal.record('rescore_round', lobby['id'])
+    round = lobby['round']
+    correct_answers = [question['correct_answer'] for question in round['questions']]
+    scores = round['answers'].count_matching_answers(correct_answers)
+
+    round['leaderboard'].set_scores(dict(
+        (user_id, score) for user_id, score in scores.items() if user_id in lobby['users']))
+
+    return update_leaderboard_positions(round['leaderboard'])
+
 def update_profile(user_id, display_name, image_filename):
+    journal.record('update_profile', user_id, display_name, image_filename)
     profiles[user_id] = {
         'user_id': user_id,
         'display_name': display_name,
@@ -86,3 +274,33 @@ def get_profile(user_id):
     return profiles.get(user_id, {
         'user_id': user_id
     })
+
+def dump_state():
+    return {
+        'lobby_index': lobby_index,
+        'lobbies': lobbies,
+        'profiles': profiles,
+        'user_lobby_ids': user_lobby_ids,
+        'round_manifests': round_manifests
+    }
+
+def load_state(state):
+    global lobby_index
+    lobby_index = state['lobby_index']
+
+    for name in ['lobbies', 'profiles', 'user_lobby_ids', 'round_manifests']:
+        globals()[name].clear()
+        globals()[name].update(state[name])
+
+journal.register_state('model', dump_state, load_state)
+journal.register_operation('create_lobby', create_lobby)
+journal.register_operation('edit_lobby', edit_lobby)
+journal.register_operation('delete_lobby', delete_lobby)
+journal.register_operation('add_user_to_lobby', lambda user_id, lobby_id: add_user_to_lobby(user_id, lobbies[lobby_id]))
+journal.register_operation('remove_user_from_lobby', lambda user_id, lobby_id: remove_user_from_lobby(user_id, lobbies[lobby_id]))
+journal.register_operation('start_round', lambda lobby_id, *args: start_round(lobbies[lobby_id], *args))
+journal.register_operation('start_question', lambda lobby_id, *args: start_question(lobbies[lobby_id], *args))
+journal.register_operation('answer_question', lambda lobby_id, *args: answer_question(lobbies[lobby_id], *args))
+journal.register_operation('end_question', lambda lobby_id, *args: end_question(lobbies[lobby_id], *args))
+journal.register_operation('rescore_round', lambda lobby_id: rescore_round(lobbies[lobby_id]))
+journal.register_operation('update_profile', update_profile)
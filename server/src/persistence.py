@@ -0,0 +1,37 @@
+import asyncio
+
+from app import app
+import journal
+import lobby
+import model
+import settings
+
+journal_task = None
+
+@app.before_serving
+async def restore_state():
+    global journal_task
+
+    if not settings.JOURNAL_DIR:
+        return
+
+    journal.restore(settings.JOURNAL_DIR)
+
+    for lobby_id in model.lobbies:
+        lobby.open_lobby_queues(lobby_id)
+        lobby.resume_round(model.lobbies[lobby_id])
+
+    loop = asyncio.get_event_loop()
+    journal_task = loop.create_task(journal.run_periodically(
+        settings.JOURNAL_FLUSH_INTERVAL,
+        settings.SNAPSHOT_INTERVAL
+    ))
+
+
+@app.after_serving
+async def save_state():
+    if journal_task is None:
+        return
+
+    journal_task.cancel()
+    await journal.snapshot()
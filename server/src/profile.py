@@ -1,31 +1,315 @@
 import aiofiles
+import asyncio
+import hashlib
 import html
 import base64
+import mimetypes
+import os
+import re
+import time
 import uuid
-from quart import request, g, send_from_directory
-from response_helpers import json_response
+from quart import request, g
+from byte_cache import ByteCache
+from response_helpers import error_response, json_response, not_modified_response, with_cache_headers, IMMUTABLE_CACHE_CONTROL
+import lobby
+import metrics
+import model
 from model import update_profile, get_profile
+import settings
+
+# DecompressionBombError is raised for images with too many pixels to decode
+# safely, and exists only with Pillow installed
+try:
+    from PIL import Image
+    THUMBNAIL_ERRORS = (OSError, Image.DecompressionBombError)
+except ImportError:
+    Image = None
+    THUMBNAIL_ERRORS = (OSError,)
 
 PROFILE_IMAGES_PATH = '/profile_images/{}'
+THUMBNAILS_PATH = PROFILE_IMAGES_PATH.format('thumbnails/{}')
+
+# Images are stored under the sha256 of their content, so identical images
+# are stored once and a filename always refers to the same bytes
+IMAGE_EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/gif': 'gif',
+    'image/webp': 'webp'
+}
+IMAGE_FILENAME_PATTERN = re.compile(r'^[0-9a-f]{64}\.(png|jpg|gif|webp)$')
+# Also matches the uuid names images were given before content addressing
+SERVED_FILENAME_PATTERN = re.compile(r'^[0-9a-zA-Z-]+\.(png|jpg|gif|webp)$')
+UPLOAD_PREFIX = '.upload-'
+PIL_FORMATS = {
+    'png': 'PNG',
+    'jpg': 'JPEG',
+    'gif': 'GIF',
+    'webp': 'WEBP'
+}
 
 from app import app
 
+gc_task = None
+image_cache = ByteCache(settings.PROFILE_IMAGE_CACHE_BYTES)
+pending_thumbnails = {}
+# Images Pillow could not thumbnail, kept while they are referenced
+failed_thumbnails = set()
+
+class ImageTooLarge(Exception):
+    pass
+
+async def store_image(chunks, extension):
+    temp_path = PROFILE_IMAGES_PATH.format('{}{}'.format(UPLOAD_PREFIX, uuid.uuid4()))
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        async with aiofiles.open(temp_path, mode='wb') as file:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > settings.PROFILE_IMAGE_MAX_BYTES:
+                    raise ImageTooLarge()
+
+                digest.update(chunk)
+                await file.write(chunk)
+
+        filename = '{}.{}'.format(digest.hexdigest(), extension)
+        path = PROFILE_IMAGES_PATH.format(filename)
+
+        if os.path.exists(path):
+            # Refreshed so the collector's grace period starts again
+            os.utime(path)
+        else:
+            os.replace(temp_path, path)
+
+        return filename
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+async def single_chunk(data):
+    yield data
+
+@app.route('/profile_image', methods = ['POST'])
+async def handle_upload_profile_image():
+    extension = IMAGE_EXTENSIONS.get(request.mimetype)
+
+    if extension is None:
+        return error_response(415, 'Content-Type must be one of {}'.format(', '.join(IMAGE_EXTENSIONS)))
+
+    if (request.content_length or 0) > settings.PROFILE_IMAGE_MAX_BYTES:
+        return error_response(413, 'Image is larger than {} bytes'.format(settings.PROFILE_IMAGE_MAX_BYTES))
+
+    try:
+        filename = await store_image(request.body, extension)
+    except ImageTooLarge:
+        return error_response(413, 'Image is larger than {} bytes'.format(settings.PROFILE_IMAGE_MAX_BYTES))
+
+    return json_response({
+        'image_filename': filename
+    })
+
 @app.route('/update_profile', methods = ['POST'])
 async def handle_update_profile():
     data = await request.get_json()
     display_name = html.escape(data['display_name'])
-    image_data_url = data['image_data_url']
-    data_url_parts = image_data_url.split(',')
-    image_data = base64.b64decode(data_url_parts[1])
-    unique_filename = '{}.png'.format(str(uuid.uuid4()))
 
-    async with aiofiles.open(PROFILE_IMAGES_PATH.format(unique_filename), mode='wb') as file:
-        await file.write(image_data)
+    if 'image_filename' in data:
+        image_filename = data['image_filename']
+
+        if not IMAGE_FILENAME_PATTERN.match(image_filename) or not os.path.exists(PROFILE_IMAGES_PATH.format(image_filename)):
+            return error_response(422, 'image_filename must be uploaded to /profile_image first')
+    else:
+        # Images sent inline as a data URL, as older clients do
+        (data_url_header, image_data) = data['image_data_url'].split(',', 1)
+        mimetype = data_url_header[len('data:'):].split(';')[0]
 
-    update_profile(g.user_id, display_name, unique_filename)
+        try:
+            image_filename = await store_image(
+                single_chunk(base64.b64decode(image_data)),
+                IMAGE_EXTENSIONS.get(mimetype, 'png')
+            )
+        except ImageTooLarge:
+            return error_response(413, 'Image is larger than {} bytes'.format(settings.PROFILE_IMAGE_MAX_BYTES))
+
+    update_profile(g.user_id, display_name, image_filename)
+    await lobby.share_profile(g.user_id)
 
     return json_response(get_profile(g.user_id))
 
-@app.route('/profile_images/<path:filename>')
+def collect_metrics():
+    return [
+        ('image_cache_requests_total', 'counter', 'Profile image cache lookups, by result', [
+            ({'result': 'hit'}, image_cache.hits),
+            ({'result': 'miss'}, image_cache.misses)
+        ]),
+        ('image_cache_bytes', 'gauge', 'Bytes of profile images held in memory', [({}, image_cache.size)])
+    ]
+
+metrics.register_collector(collect_metrics)
+
+# Filenames never change content, so responses can be cached indefinitely
+# and revalidated by an etag derived from the filename
+async def send_image(path, filename, etag):
+    if not SERVED_FILENAME_PATTERN.match(filename):
+        return error_response(404, 'Image not found')
+
+    if etag in request.if_none_match:
+        return with_cache_headers(not_modified_response(), etag, IMMUTABLE_CACHE_CONTROL)
+
+    image_data = image_cache.get(path)
+
+    if image_data is None:
+        try:
+            async with aiofiles.open(path, mode='rb') as file:
+                image_data = await file.read()
+        except FileNotFoundError:
+            return error_response(404, 'Image not found')
+
+        image_cache.put(path, image_data)
+
+    r = app.response_class(response = image_data, mimetype = mimetypes.guess_type(filename)[0])
+    return with_cache_headers(r, etag, IMMUTABLE_CACHE_CONTROL)
+
+def create_thumbnail(filename):
+    os.makedirs(THUMBNAILS_PATH.format(''), exist_ok = True)
+    image_format = PIL_FORMATS[filename.rsplit('.', 1)[1]]
+
+    with Image.open(PROFILE_IMAGES_PATH.format(filename)) as image:
+        image.thumbnail((settings.PROFILE_THUMBNAIL_SIZE, settings.PROFILE_THUMBNAIL_SIZE))
+
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        temp_path = THUMBNAILS_PATH.format('{}{}'.format(UPLOAD_PREFIX, uuid.uuid4()))
+        image.save(temp_path, format = image_format)
+        os.replace(temp_path, THUMBNAILS_PATH.format(filename))
+
+# Generated once per image, on first request, by one task however many
+# requests arrive while it runs
+async def ensure_thumbnail(filename):
+    if os.path.exists(THUMBNAILS_PATH.format(filename)):
+        return
+
+    if filename not in pending_thumbnails:
+        loop = asyncio.get_event_loop()
+        pending_thumbnails[filename] = loop.run_in_executor(None, create_thumbnail, filename)
+
+    try:
+        await asyncio.shield(pending_thumbnails[filename])
+    finally:
+        pending_thumbnails.pop(filename, None)
+
+@app.route('/profile_images/<filename>')
 async def get_profile_image(filename):
-    return await send_from_directory(PROFILE_IMAGES_PATH.format(''), filename)
+    return await send_image(PROFILE_IMAGES_PATH.format(filename), filename, filename)
+
+# The full size image is sent instead without Pillow installed, or when
+# Pillow cannot read the image. Image files never change, so a failed image
+# is not decoded again.
+@app.route('/profile_images/thumbnails/<filename>')
+async def get_profile_thumbnail(filename):
+    if Image is None or not SERVED_FILENAME_PATTERN.match(filename) or filename in failed_thumbnails:
+        return await get_profile_image(filename)
+
+    try:
+        await ensure_thumbnail(filename)
+    except FileNotFoundError:
+        return error_response(404, 'Image not found')
+    except THUMBNAIL_ERRORS:
+        failed_thumbnails.add(filename)
+        return await get_profile_image(filename)
+
+    return await send_image(THUMBNAILS_PATH.format(filename), filename, 'thumbnail-{}'.format(filename))
+
+
+# Lobbies keep the profile a user had when they joined, so those images
+# stay referenced until the lobby closes
+def referenced_image_filenames():
+    filenames = set(profile.get('image_filename') for profile in model.profiles.values())
+
+    for lobby in model.lobbies.values():
+        filenames.update(profile.get('image_filename') for profile in lobby['users'].values())
+
+    return filenames
+
+# Files younger than grace seconds are kept, as an upload is not
+# referenced until the profile update that follows it. Thumbnails go with
+# their image. Returns the paths removed.
+def collect_images(directory, referenced, grace):
+    oldest_mtime = time.time() - grace
+    removed_paths = []
+
+    for entry in os.scandir(directory):
+        if entry.name in referenced or not entry.is_file() or entry.stat().st_mtime > oldest_mtime:
+            continue
+
+        os.unlink(entry.path)
+        removed_paths.append(entry.path)
+
+    thumbnails_directory = os.path.join(directory, 'thumbnails')
+
+    if os.path.isdir(thumbnails_directory):
+        for entry in os.scandir(thumbnails_directory):
+            if os.path.exists(os.path.join(directory, entry.name)) or entry.stat().st_mtime > oldest_mtime:
+                continue
+
+            os.unlink(entry.path)
+            removed_paths.append(entry.path)
+
+    return removed_paths
+
+# Workers sharing /profile_images each touch the images they refer to, so
+# one that refers to an image keeps it younger than the grace period for
+# the worker that collects them
+def refresh_images(directory, referenced):
+    for filename in referenced:
+        if filename is None:
+            continue
+
+        try:
+            os.utime(os.path.join(directory, filename))
+        except FileNotFoundError:
+            pass
+
+# Every worker refreshes its references but only the first one removes
+# images, which is safe while the grace period is longer than the interval
+async def run_image_collector(interval, grace, collects):
+    loop = asyncio.get_event_loop()
+    directory = PROFILE_IMAGES_PATH.format('')
+
+    while True:
+        await asyncio.sleep(interval)
+        referenced = referenced_image_filenames()
+        failed_thumbnails.intersection_update(referenced)
+
+        if settings.WORKER_COUNT > 1:
+            await loop.run_in_executor(None, refresh_images, directory, referenced)
+
+        if not collects:
+            continue
+
+        removed_paths = await loop.run_in_executor(None, collect_images, directory, referenced, grace)
+
+        for path in removed_paths:
+            image_cache.pop(path)
+
+@app.before_serving
+async def start_image_collector():
+    global gc_task
+
+    if settings.PROFILE_IMAGE_GC_INTERVAL <= 0:
+        return
+
+    loop = asyncio.get_event_loop()
+    gc_task = loop.create_task(run_image_collector(
+        settings.PROFILE_IMAGE_GC_INTERVAL,
+        settings.PROFILE_IMAGE_GC_GRACE,
+        settings.WORKER_INDEX == 0
+    ))
+
+@app.after_serving
+async def stop_image_collector():
+    if gc_task is not None:
+        gc_task.cancel()
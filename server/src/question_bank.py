@@ -0,0 +1,160 @@
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import json
+import random
+import sqlite3
+import sys
+
+from questions import questions as seed_questions
+import settings
+
+# Questions live in SQLite and are only read when sampled for a round, so
+# startup time and memory do not grow with the size of the bank. Each
+# question is stored as its JSON with the indexed fields alongside.
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    video_id TEXT NOT NULL,
+    difficulty INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS questions_video_id ON questions (video_id);
+CREATE INDEX IF NOT EXISTS questions_difficulty ON questions (difficulty);
+CREATE TABLE IF NOT EXISTS question_tags (
+    tag TEXT NOT NULL,
+    question_id INTEGER NOT NULL,
+    PRIMARY KEY (tag, question_id)
+) WITHOUT ROWID;
+'''
+
+connection = None
+
+# The server samples on this one thread rather than on the event loop, as
+# the queries take longer the larger the bank. The connection is shared
+# with it, and only one thread uses it at a time.
+executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'question_bank')
+
+def connect(path=None):
+    global connection
+
+    if connection is not None:
+        connection.close()
+
+    connection = sqlite3.connect(path or settings.QUESTION_BANK_PATH, check_same_thread = False)
+    connection.executescript(SCHEMA)
+    get_question.cache_clear()
+
+    if connection.execute('SELECT id FROM questions LIMIT 1').fetchone() is None:
+        add_questions(seed_questions)
+
+def get_connection():
+    if connection is None:
+        connect()
+
+    return connection
+
+def add_questions(questions):
+    db = get_connection()
+
+    with db:
+        for question in questions:
+            question = dict(question)
+            tags = question.pop('tags', [])
+            difficulty = question.pop('difficulty', 1)
+            cursor = db.execute(
+                'INSERT INTO questions (video_id, difficulty, data) VALUES (?, ?, ?)',
+                (question['video_id'], difficulty, json.dumps(question))
+            )
+            db.executemany(
+                'INSERT OR IGNORE INTO question_tags (tag, question_id) VALUES (?, ?)',
+                [(tag, cursor.lastrowid) for tag in tags]
+            )
+
+# Questions are shared between rounds and must not be modified
+@functools.lru_cache(maxsize = settings.QUESTION_CACHE_SIZE)
+def get_question(question_id):
+    row = get_connection().execute('SELECT data FROM questions WHERE id = ?', (question_id,)).fetchone()
+
+    if row is None:
+        raise KeyError(question_id)
+
+    return json.loads(row[0])
+
+# Returns the table expression, its question id column, conditions and
+# params. Tag filters read question_tags directly so they stay on its index.
+def filter_clause(video_id, tag, difficulty):
+    source = 'questions'
+    id_column = 'questions.id'
+    conditions = []
+    params = []
+
+    if tag is not None:
+        source = 'question_tags'
+        id_column = 'question_tags.question_id'
+        conditions.append('question_tags.tag = ?')
+        params.append(tag)
+
+        if video_id is not None or difficulty is not None:
+            source += ' JOIN questions ON questions.id = question_tags.question_id'
+
+    if video_id is not None:
+        conditions.append('questions.video_id = ?')
+        params.append(video_id)
+
+    if difficulty is not None:
+        conditions.append('questions.difficulty = ?')
+        params.append(difficulty)
+
+    return (source, id_column, conditions, params)
+
+def select_question_ids(filters, select, extra_conditions=(), extra_params=(), suffix=''):
+    (source, id_column, conditions, params) = filters
+    conditions = conditions + [condition.format(id_column) for condition in extra_conditions]
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    sql = 'SELECT {} FROM {}{}{}'.format(select.format(id_column), source, where, suffix.format(id_column))
+
+    return get_connection().execute(sql, params + list(extra_params)).fetchone()[0]
+
+def count_questions(video_id=None, tag=None, difficulty=None):
+    return select_question_ids(filter_clause(video_id, tag, difficulty), 'COUNT(*)')
+
+# Seeks to random ids in the matching id range through the indexes rather
+# than reading every matching row. Ids sitting after a gap are picked more
+# often, so once picks start repeating the rest are drawn by exact offset.
+def sample_questions(count, video_id=None, tag=None, difficulty=None):
+    filters = filter_clause(video_id, tag, difficulty)
+    total = select_question_ids(filters, 'COUNT(*)')
+    count = min(count, total)
+    question_ids = {}
+
+    if count == 0:
+        return []
+
+    # Separate queries so SQLite answers MIN and MAX from one index lookup each
+    min_id = select_question_ids(filters, 'MIN({})')
+    max_id = select_question_ids(filters, 'MAX({})')
+
+    for _ in range(count * 2):
+        if len(question_ids) == count:
+            break
+        question_id = select_question_ids(filters, '{}', ['{} >= ?'], [random.randint(min_id, max_id)], ' ORDER BY {} LIMIT 1')
+        question_ids[question_id] = None
+
+    while len(question_ids) < count:
+        question_id = select_question_ids(filters, '{}', [], [random.randrange(total)], ' ORDER BY {} LIMIT 1 OFFSET ?')
+        question_ids[question_id] = None
+
+    return [get_question(question_id) for question_id in question_ids]
+
+
+def main():
+    # Imports questions from a file of JSON lines, one question per line
+    with open(sys.argv[1]) as f:
+        add_questions(json.loads(line) for line in f if line.strip())
+
+    print('{} questions in {}'.format(count_questions(), settings.QUESTION_BANK_PATH))
+
+
+if __name__ == "__main__":
+    main()
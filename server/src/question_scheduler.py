@@ -0,0 +1,46 @@
+import time
+
+import lifecycle
+import settings
+
+# Question timings are positions in the video. The current question's
+# start_time is the wall time its video start_time plays at, so every other
+# timing is at the same offset. Each lobby has at most one question timer,
+# on the wheel shared by the whole server.
+question_timers = {}
+
+def wall_time(current_question, question, video_time):
+    return current_question['start_time'] + video_time - question['start_time']
+
+def answer_lock_wall_time(round):
+    current_question = round['current_question']
+    question = round['questions'][current_question['i']]
+    return wall_time(current_question, question, question['answer_lock_time'])
+
+def end_wall_time(round):
+    current_question = round['current_question']
+    question = round['questions'][current_question['i']]
+    return wall_time(current_question, question, question['end_time'])
+
+# Answers sent just before the lock get ANSWER_LOCK_GRACE seconds to arrive
+def answers_locked(round, now=None):
+    if now is None:
+        now = time.time()
+
+    return now > answer_lock_wall_time(round) + settings.ANSWER_LOCK_GRACE
+
+# Replaces any timer the lobby already has
+def schedule(lobby_id, at, callback, *args):
+    cancel(lobby_id)
+    delay = max(0, at - time.time())
+    question_timers[lobby_id] = lifecycle.wheel.schedule(delay, fire, lobby_id, callback, args)
+
+def fire(lobby_id, callback, args):
+    question_timers.pop(lobby_id, None)
+    callback(*args)
+
+def cancel(lobby_id):
+    timer = question_timers.pop(lobby_id, None)
+
+    if timer is not None:
+        lifecycle.wheel.cancel(timer)
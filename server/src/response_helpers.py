@@ -1,18 +1,45 @@
-import json
-
 from quart import request, g, websocket
 from app import app
+import serialization
 
-def json_response(data):
+# encode can be given to reuse already encoded data, see model.encode_lobby
+def json_response(data, encode=None):
     return app.response_class(
-        response = json.dumps(data),
+        response = (encode or serialization.encode)(data),
         mimetype = 'application/json'
     )
 
 
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def not_modified_response():
+    return app.response_class(response = '', status = 304)
+
+
+def with_cache_headers(r, etag, cache_control):
+    r.set_etag(etag)
+    r.headers['Cache-Control'] = cache_control
+    return r
+
+
+# Requests that already hold the current etag get a 304 and data is not encoded
+def conditional_json_response(data, etag, cache_control='no-cache', encode=None):
+    if etag in request.if_none_match:
+        r = not_modified_response()
+    else:
+        r = json_response(data, encode)
+
+    return with_cache_headers(r, etag, cache_control)
+
+
+# For resources that never change once created, so clients and proxies can keep them
+def immutable_json_response(data, etag):
+    return conditional_json_response(data, etag, IMMUTABLE_CACHE_CONTROL)
+
+
 def error_response(response_code, message):
     return app.response_class(
-        response = json.dumps({
+        response = serialization.encode({
             'message': message
         }),
         status = response_code,
@@ -20,9 +47,9 @@ def error_response(response_code, message):
     )
 
 
-def linked_resource_response(resource_url, response_code, resource_id, resource_data):
+def linked_resource_response(resource_url, response_code, resource_id, resource_data, encode=None):
     r = app.response_class(
-        response = json.dumps(resource_data),
+        response = (encode or serialization.encode)(resource_data),
         status = response_code,
         mimetype = 'application/json'
     )
@@ -0,0 +1,114 @@
+from array import array
+
+import scoring
+
+# A round's answers stored by user slot rather than as a dict per user.
+# Each user gets a dense slot when added. Each question's answers are one
+# byte per slot holding a code into the round's distinct answer strings,
+# with 0 meaning no answer.
+class AnswersStore():
+    __slots__ = ['user_ids', 'slots', 'columns', 'choices', 'choice_codes']
+
+    def __init__(self, user_ids=()):
+        self.user_ids = []
+        self.slots = {}
+        self.columns = {}
+        self.choices = [None]
+        self.choice_codes = {}
+
+        for user_id in user_ids:
+            self.add_user(user_id)
+
+    def add_user(self, user_id):
+        if user_id in self.slots:
+            return
+
+        self.slots[user_id] = len(self.user_ids)
+        self.user_ids.append(user_id)
+
+        for column in self.columns.values():
+            column.append(0)
+
+    def choice_code(self, answer):
+        try:
+            return self.choice_codes[answer]
+        except KeyError:
+            pass
+
+        code = len(self.choices)
+
+        if code == 256:
+            for question_index, column in self.columns.items():
+                self.columns[question_index] = array('H', list(column))
+        elif code == 65536:
+            raise ValueError('Too many distinct answers in round')
+
+        self.choices.append(answer)
+        self.choice_codes[answer] = code
+        return code
+
+    def column(self, question_index):
+        try:
+            return self.columns[question_index]
+        except KeyError:
+            pass
+
+        if len(self.choices) > 256:
+            column = array('H', bytes(2 * len(self.user_ids)))
+        else:
+            column = bytearray(len(self.user_ids))
+
+        self.columns[question_index] = column
+        return column
+
+    def record(self, user_id, question_index, answer):
+        code = self.choice_code(answer)
+        self.column(question_index)[self.slots[user_id]] = code
+
+    def get(self, user_id, question_index):
+        try:
+            return self.choices[self.columns[question_index][self.slots[user_id]]]
+        except KeyError:
+            return None
+
+    def matching_user_ids(self, question_index, answer):
+        code = self.choice_codes.get(answer)
+
+        if code is None or question_index not in self.columns:
+            return []
+
+        return [self.user_ids[slot] for slot in scoring.matching_slots(self.columns[question_index], code)]
+
+    def count_matching_answers(self, correct_answers):
+        questions = [i for i in range(len(correct_answers)) if i in self.columns]
+        counts = scoring.count_matches(
+            [self.columns[i] for i in questions],
+            [self.choice_codes.get(correct_answers[i]) for i in questions],
+            len(self.user_ids)
+        )
+        return dict(zip(self.user_ids, counts))
+
+    def user_answers(self, user_id):
+        slot = self.slots[user_id]
+        return dict((i, self.choices[column[slot]]) for i, column in self.columns.items() if column[slot])
+
+    def to_json(self):
+        return dict((user_id, self.user_answers(user_id)) for user_id in self.user_ids)
+
+
+class LeaderboardEntry():
+    __slots__ = ['score', 'position']
+
+    def __init__(self, score=0, position=1):
+        self.score = score
+        self.position = position
+
+    # entry['score'] works as it did for dict entries, at attribute speed
+    __getitem__ = object.__getattribute__
+    __setitem__ = object.__setattr__
+
+    def to_json(self):
+        return {
+            'score': self.score,
+            'position': self.position
+        }
@@ -0,0 +1,315 @@
+import asyncio
+from http.cookies import CookieError, SimpleCookie
+import itertools
+import json
+import re
+import zlib
+from urllib.parse import parse_qs, urlsplit
+
+import model
+import settings
+
+# Routes each HTTP request and websocket to the worker holding the lobby it
+# names, so a lobby's state and its sockets stay in one process. Lobbies
+# are named in the path, the join_lobby body, a lobby_id query parameter or
+# the lobby_id cookie set on joining. Other requests stay with one worker
+# per user, and new users are spread round robin. ?worker= picks a worker
+# directly, for /metrics and /admin/ routes.
+#
+# Every request comes through here, not only websockets, because a lobby
+# lives in the memory of one worker and its HTTP routes change it there.
+# Hypercorn spreads connections between processes with no say over which
+# one gets them.
+#
+# Requests and responses are passed through unchanged, with keep-alive, and
+# a websocket is spliced through once its upgrade is accepted. Bodies that
+# fit in one read, and the join_lobby body routing needs, are sent along
+# with the head. Larger bodies are streamed to the worker as they arrive,
+# and those over SERVE_MAX_BODY_BYTES get a 413. Clients that send
+# Expect: 100-continue wait for an interim response before their body, so
+# theirs are streamed too, and join_lobby is told to continue here.
+
+LOBBY_PATH_PATTERN = re.compile(r'^/(?:lobby|get_lobby)/(\d+)(?:/|$)')
+READ_SIZE = 64 * 1024
+# A join_lobby body only holds the join code
+ROUTING_BODY_MAX_BYTES = 4 * 1024
+
+class BadRequest(Exception):
+    pass
+
+class BodyTooLarge(Exception):
+    pass
+
+def parse_head(head):
+    try:
+        (start_line, *header_lines) = head.decode('latin-1').split('\r\n')
+        (first, second, third) = start_line.split(' ', 2)
+        headers = dict(
+            (name.strip().lower(), value.strip())
+            for (name, value) in (line.split(':', 1) for line in header_lines if line)
+        )
+    except ValueError:
+        raise BadRequest()
+
+    return (first, second, third, headers)
+
+def lobby_id_for(method, target, headers, body):
+    url = urlsplit(target)
+    match = LOBBY_PATH_PATTERN.match(url.path)
+
+    if match:
+        return int(match.group(1))
+
+    if url.path == '/join_lobby' and method == 'POST':
+        return int(json.loads(body)['join_code'])
+
+    query = parse_qs(url.query)
+
+    if 'lobby_id' in query:
+        return int(query['lobby_id'][0])
+
+    cookie = SimpleCookie(headers.get('cookie', '')).get('lobby_id')
+    return int(cookie.value) if cookie is not None else None
+
+def routes_by_body(method, target):
+    return method == 'POST' and urlsplit(target).path == '/join_lobby'
+
+def choose_worker(method, target, headers, body, worker_count, round_robin):
+    try:
+        lobby_id = lobby_id_for(method, target, headers, body)
+
+        if lobby_id is not None:
+            return model.worker_for_lobby(lobby_id, worker_count)
+
+        query = parse_qs(urlsplit(target).query)
+
+        if 'worker' in query:
+            return int(query['worker'][0]) % worker_count
+
+        secret_token = SimpleCookie(headers.get('cookie', '')).get('secret_token')
+
+        if secret_token is not None:
+            user_id = secret_token.value.split('.')[1]
+            return zlib.crc32(user_id.encode()) % worker_count
+    except (ValueError, KeyError, IndexError, TypeError, CookieError):
+        pass
+
+    return next(round_robin) % worker_count
+
+
+# Chunked bodies are passed on with their framing, and trailers
+async def read_chunked(reader):
+    while True:
+        size_line = await reader.readuntil(b'\r\n')
+        size = int(size_line.split(b';')[0], 16)
+
+        if size == 0:
+            yield size_line
+
+            while True:
+                line = await reader.readuntil(b'\r\n')
+                yield line
+
+                if line == b'\r\n':
+                    return
+
+        yield size_line + await reader.readexactly(size + 2)
+
+async def read_body(reader, headers, until_eof=False):
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        async for piece in read_chunked(reader):
+            yield piece
+    elif 'content-length' in headers:
+        remaining = int(headers['content-length'])
+
+        while remaining > 0:
+            piece = await reader.read(min(remaining, READ_SIZE))
+
+            if not piece:
+                raise asyncio.IncompleteReadError(b'', remaining)
+
+            remaining -= len(piece)
+            yield piece
+    elif until_eof:
+        while piece := await reader.read(READ_SIZE):
+            yield piece
+
+async def limit_body(pieces, max_bytes):
+    size = 0
+
+    async for piece in pieces:
+        size += len(piece)
+
+        if size > max_bytes:
+            raise BodyTooLarge()
+
+        yield piece
+
+# Workers may answer before reading all of a streamed body, as failed
+# uploads do, and then close the connection. The rest of the body is read
+# and dropped so the client still gets the response. Returns whether the
+# whole body reached the worker.
+async def send_body(pieces, writer, response):
+    sent = True
+
+    async for piece in pieces:
+        if sent and response.done():
+            sent = False
+
+        if sent:
+            try:
+                writer.write(piece)
+                await writer.drain()
+            except ConnectionError:
+                sent = False
+
+    return sent
+
+def keeps_alive(version, headers):
+    connection = headers.get('connection', '').lower()
+
+    if version == 'HTTP/1.0':
+        return 'keep-alive' in connection
+
+    return 'close' not in connection
+
+async def splice(reader, writer):
+    try:
+        while data := await reader.read(READ_SIZE):
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+
+def expects_continue(headers):
+    return headers.get('expect', '').lower() == '100-continue'
+
+# Interim responses, such as 100 Continue, are passed on until the final
+# one. 101 Switching Protocols is final.
+async def relay_response(method, upstream_reader, client_writer):
+    while True:
+        head = await upstream_reader.readuntil(b'\r\n\r\n')
+        (version, status, _, headers) = parse_head(head[:-4])
+        status = int(status)
+        client_writer.write(head)
+
+        if status >= 200 or status == 101:
+            break
+
+        await client_writer.drain()
+
+    has_body = method != 'HEAD' and status >= 200 and status not in (204, 304)
+    length_known = 'content-length' in headers or 'chunked' in headers.get('transfer-encoding', '').lower()
+
+    if has_body:
+        async for piece in read_body(upstream_reader, headers, until_eof = True):
+            client_writer.write(piece)
+            await client_writer.drain()
+
+    await client_writer.drain()
+    return (status, keeps_alive(version, headers) and (length_known or not has_body))
+
+class Router():
+    def __init__(self, worker_count, socket_path=settings.WORKER_SOCKET_PATH):
+        self.worker_count = worker_count
+        self.socket_path = socket_path
+        self.round_robin = itertools.count()
+
+    async def open_upstream(self, worker):
+        return await asyncio.open_unix_connection(self.socket_path.format(worker))
+
+    async def handle_connection(self, client_reader, client_writer):
+        upstreams = {}
+
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(client_reader.readuntil(b'\r\n\r\n'), settings.SERVE_KEEP_ALIVE)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    return
+
+                (method, target, version, headers) = parse_head(head[:-4])
+
+                try:
+                    content_length = int(headers.get('content-length', 0))
+                except ValueError:
+                    raise BadRequest()
+
+                if content_length > settings.SERVE_MAX_BODY_BYTES:
+                    raise BodyTooLarge()
+
+                body = limit_body(read_body(client_reader, headers), settings.SERVE_MAX_BODY_BYTES)
+                head_body = b''
+
+                if routes_by_body(method, target):
+                    if expects_continue(headers):
+                        client_writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+                    head_body = b''.join([piece async for piece in limit_body(body, ROUTING_BODY_MAX_BYTES)])
+                elif (
+                    content_length <= READ_SIZE and
+                    not expects_continue(headers) and
+                    'chunked' not in headers.get('transfer-encoding', '').lower()
+                ):
+                    head_body = b''.join([piece async for piece in body])
+
+                worker = choose_worker(method, target, headers, head_body, self.worker_count, self.round_robin)
+
+                if worker not in upstreams:
+                    try:
+                        upstreams[worker] = await self.open_upstream(worker)
+                    except OSError:
+                        client_writer.write(b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                        return
+
+                (upstream_reader, upstream_writer) = upstreams[worker]
+                # Nothing is left of the body when it was all sent with the head
+                upstream_writer.write(head + head_body)
+                response = asyncio.ensure_future(relay_response(method, upstream_reader, client_writer))
+
+                try:
+                    body_sent = await send_body(body, upstream_writer, response)
+                    (status, upstream_alive) = await response
+                finally:
+                    response.cancel()
+
+                # Either side closing the websocket ends it for both
+                if status == 101:
+                    splices = [
+                        asyncio.ensure_future(splice(client_reader, upstream_writer)),
+                        asyncio.ensure_future(splice(upstream_reader, client_writer))
+                    ]
+                    await asyncio.wait(splices, return_when = asyncio.FIRST_COMPLETED)
+
+                    for task in splices:
+                        task.cancel()
+
+                    return
+
+                # A worker connection that stopped taking the body can't be
+                # reused, but the client's still can
+                if not upstream_alive or not body_sent:
+                    upstreams.pop(worker)[1].close()
+
+                if not keeps_alive(version, headers) or not upstream_alive:
+                    return
+        except BadRequest:
+            client_writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+        except BodyTooLarge:
+            client_writer.write(b'HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError):
+            pass
+        finally:
+            for (_, upstream_writer) in upstreams.values():
+                upstream_writer.close()
+
+            client_writer.close()
+
+    async def serve(self, host, port):
+        return await asyncio.start_server(
+            self.handle_connection,
+            host,
+            port,
+            backlog = settings.SERVE_BACKLOG,
+            reuse_address = True
+        )
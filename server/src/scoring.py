@@ -0,0 +1,40 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Answer columns are bytearrays or array('H'), one answer code per user slot.
+
+def column_dtype(column):
+    return numpy.uint8 if memoryview(column).itemsize == 1 else numpy.uint16
+
+def matching_slots(column, code):
+    if numpy is not None:
+        return numpy.flatnonzero(numpy.frombuffer(column, dtype = column_dtype(column)) == code).tolist()
+
+    if isinstance(column, bytearray):
+        slots = []
+        slot = column.find(code)
+        while slot != -1:
+            slots.append(slot)
+            slot = column.find(code, slot + 1)
+        return slots
+
+    return [slot for slot, answer_code in enumerate(column) if answer_code == code]
+
+# Correct answer counts per slot for a round, given each question's column
+# and correct code (None when nobody gave the correct answer)
+def count_matches(columns, codes, slot_count):
+    if numpy is not None:
+        counts = numpy.zeros(slot_count, dtype = numpy.int64)
+        for column, code in zip(columns, codes):
+            if code is not None:
+                counts += numpy.frombuffer(column, dtype = column_dtype(column)) == code
+        return counts.tolist()
+
+    counts = [0] * slot_count
+    for column, code in zip(columns, codes):
+        if code is not None:
+            for slot in matching_slots(column, code):
+                counts[slot] += 1
+    return counts
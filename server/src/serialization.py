@@ -0,0 +1,72 @@
+import json
+
+import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Compact model objects (answer stores, leaderboard entries) provide to_json
+# returning the plain structure the API has always exposed.
+def to_json(obj):
+    try:
+        return obj.to_json()
+    except AttributeError:
+        raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+def encode_stdlib(data):
+    return json.dumps(data, default = to_json).encode()
+
+def encode_orjson(data):
+    return orjson.dumps(data, default = to_json, option = orjson.OPT_NON_STR_KEYS)
+
+# Encoders take data and return JSON as UTF-8 bytes
+encoders = {
+    'json': encode_stdlib
+}
+
+if orjson is not None:
+    encoders['orjson'] = encode_orjson
+
+def register_encoder(name, encoder):
+    encoders[name] = encoder
+
+def use_encoder(name):
+    global encode
+
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in encoders else 'json'
+
+    encode = encoders[name]
+
+use_encoder(settings.JSON_ENCODER)
+
+def dumps(data):
+    return encode(data).decode()
+
+# Encodes data with data[key] replaced by JSON that was already encoded
+def encode_with(data, key, encoded):
+    rest = encode(dict((k, v) for k, v in data.items() if k != key))
+    head = encode({key: None})[:-len(b'null}')]
+
+    return head + encoded + (b',' + rest[1:] if len(rest) > 2 else b'}')
+
+# Encoded bytes of versioned objects such as lobbies, reused until the
+# version changes or the key is invalidated
+encoded_cache = {}
+
+def encode_cached(key, version, data):
+    try:
+        (cached_version, encoded) = encoded_cache[key]
+        if cached_version == version:
+            return encoded
+    except KeyError:
+        pass
+
+    encoded = encode(data)
+    encoded_cache[key] = (version, encoded)
+    return encoded
+
+def invalidate(key):
+    encoded_cache.pop(key, None)
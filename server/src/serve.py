@@ -0,0 +1,176 @@
+import asyncio
+import os
+import signal
+import sys
+import time
+
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+
+import settings
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Production entrypoint, instead of the development server in main.py:
+#
+#   python serve.py
+#
+# The app runs under Hypercorn, on uvloop when it is installed and slow
+# callback tracing, which only works on asyncio's own loop, is off. With
+# SERVE_WORKERS above 1, each worker is a process listening on its own Unix
+# socket, and router.py sends each request to the worker holding its lobby.
+# The broker relays revocations and profiles between them.
+#
+# SIGTERM drains: no new lobbies are created, every socket is sent what it
+# has queued and then released, and requests in progress get
+# SERVE_DRAIN_TIMEOUT seconds to finish. Lobbies survive the restart when
+# JOURNAL_DIR is set.
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def hypercorn_config(bind):
+    config = Config()
+    config.bind = [bind]
+    config.backlog = settings.SERVE_BACKLOG
+    config.keep_alive_timeout = settings.SERVE_KEEP_ALIVE
+    config.graceful_timeout = settings.SERVE_DRAIN_TIMEOUT
+    config.accesslog = None
+    config.errorlog = '-'
+    return config
+
+async def run_worker(bind):
+    from main import app
+    import lobby
+
+    shutdown = asyncio.Event()
+
+    def drain():
+        lobby.drain()
+        shutdown.set()
+
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signal_number, drain)
+
+    await serve(app, hypercorn_config(bind), shutdown_trigger = shutdown.wait)
+
+
+# Every worker must accept every session and keep its own journal. Profile
+# images are shared, and only worker 0 removes them.
+def worker_environment(worker_index, session_keys):
+    environment = dict(os.environ)
+    environment.update({
+        'SERVE_WORKERS': '1',
+        'SERVE_BIND': 'unix:{}'.format(settings.WORKER_SOCKET_PATH.format(worker_index)),
+        'WORKER_INDEX': str(worker_index),
+        'WORKER_COUNT': str(settings.SERVE_WORKERS),
+        'SESSION_KEYS': session_keys
+    })
+    environment.setdefault('LOBBY_BACKEND', 'broker')
+
+    if settings.JOURNAL_DIR:
+        environment['JOURNAL_DIR'] = os.path.join(settings.JOURNAL_DIR, 'worker_{}'.format(worker_index))
+
+    return environment
+
+def remove_sockets(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.unlink(path)
+
+class StartupFailed(Exception):
+    pass
+
+# Fails as soon as one of the processes exits, rather than waiting for a
+# socket it will never create
+async def wait_for_sockets(paths, processes):
+    deadline = time.monotonic() + settings.SERVE_STARTUP_TIMEOUT
+
+    while not all(os.path.exists(path) for path in paths):
+        for process in processes:
+            if process.returncode is not None:
+                raise StartupFailed('Process {} exited with {} during startup'.format(process.pid, process.returncode))
+
+        if time.monotonic() > deadline:
+            raise StartupFailed('No socket at {} after {} seconds'.format(
+                ', '.join(path for path in paths if not os.path.exists(path)),
+                settings.SERVE_STARTUP_TIMEOUT
+            ))
+
+        await asyncio.sleep(0.05)
+
+async def stop_processes(processes):
+    for process in processes:
+        if process.returncode is None:
+            process.send_signal(signal.SIGTERM)
+
+    await asyncio.gather(*[process.wait() for process in processes])
+
+async def run_workers():
+    import auth
+    from router import Router
+
+    session_keys = ','.join('{}:{}'.format(key_id, key) for key_id, key in auth.load_keys().items())
+    socket_paths = [settings.WORKER_SOCKET_PATH.format(i) for i in range(settings.SERVE_WORKERS)]
+
+    remove_sockets(socket_paths + [settings.BROKER_SOCKET_PATH])
+
+    broker = await asyncio.create_subprocess_exec(sys.executable, os.path.join(SRC_DIR, 'broker.py'))
+    workers = []
+
+    try:
+        # Workers connect to the broker as they start
+        await wait_for_sockets([settings.BROKER_SOCKET_PATH], [broker])
+
+        workers = [
+            await asyncio.create_subprocess_exec(
+                sys.executable, os.path.join(SRC_DIR, 'serve.py'),
+                env = worker_environment(i, session_keys)
+            )
+            for i in range(settings.SERVE_WORKERS)
+        ]
+
+        await wait_for_sockets(socket_paths, [broker] + workers)
+    except StartupFailed:
+        await stop_processes(workers + [broker])
+        remove_sockets(socket_paths)
+        raise
+
+    (host, port) = settings.SERVE_BIND.rsplit(':', 1)
+    server = await Router(settings.SERVE_WORKERS).serve(host, int(port))
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signal_number, stopping.set)
+
+    await asyncio.wait(
+        [asyncio.ensure_future(stopping.wait())] + [asyncio.ensure_future(worker.wait()) for worker in workers],
+        return_when = asyncio.FIRST_COMPLETED
+    )
+
+    # Workers drain their own sockets, which the router passes on until
+    # they close
+    server.close()
+
+    await stop_processes(workers)
+    await stop_processes([broker])
+    remove_sockets(socket_paths)
+
+def main():
+    if uvloop is not None and settings.SLOW_CALLBACK_THRESHOLD <= 0:
+        uvloop.install()
+
+    if settings.SERVE_WORKERS > 1:
+        try:
+            asyncio.run(run_workers())
+        except StartupFailed as e:
+            sys.exit(str(e))
+    else:
+        asyncio.run(run_worker(settings.SERVE_BIND))
+
+if __name__ == "__main__":
+    main()
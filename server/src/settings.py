@@ -0,0 +1,50 @@
+import os
+
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get('SUBSCRIBER_QUEUE_SIZE', 256))
+SUBSCRIBER_QUEUE_POLICY = os.environ.get('SUBSCRIBER_QUEUE_POLICY', 'coalesce')
+ANSWER_BATCH_WINDOW = float(os.environ.get('ANSWER_BATCH_WINDOW', 0.1))
+LOBBY_BACKEND = os.environ.get('LOBBY_BACKEND', 'memory')
+BROKER_SOCKET_PATH = os.environ.get('BROKER_SOCKET_PATH', '/tmp/tv_quiz_party_broker.sock')
+BROKER_MAX_MESSAGE_BYTES = int(os.environ.get('BROKER_MAX_MESSAGE_BYTES', 16 * 1024 * 1024))
+BROKER_RECONNECT_DELAY = float(os.environ.get('BROKER_RECONNECT_DELAY', 1))
+JOURNAL_DIR = os.environ.get('JOURNAL_DIR', '')
+JOURNAL_FLUSH_INTERVAL = float(os.environ.get('JOURNAL_FLUSH_INTERVAL', 0.05))
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', 60))
+QUESTION_BANK_PATH = os.environ.get('QUESTION_BANK_PATH', '/tmp/tv_quiz_party_questions.db')
+QUESTION_CACHE_SIZE = int(os.environ.get('QUESTION_CACHE_SIZE', 1024))
+QUESTIONS_PER_ROUND = int(os.environ.get('QUESTIONS_PER_ROUND', 3))
+JSON_ENCODER = os.environ.get('JSON_ENCODER', 'auto')
+PROFILE_IMAGE_MAX_BYTES = int(os.environ.get('PROFILE_IMAGE_MAX_BYTES', 2 * 1024 * 1024))
+PROFILE_IMAGE_GC_INTERVAL = float(os.environ.get('PROFILE_IMAGE_GC_INTERVAL', 300))
+PROFILE_IMAGE_GC_GRACE = float(os.environ.get('PROFILE_IMAGE_GC_GRACE', 3600))
+PROFILE_IMAGE_CACHE_BYTES = int(os.environ.get('PROFILE_IMAGE_CACHE_BYTES', 32 * 1024 * 1024))
+PROFILE_THUMBNAIL_SIZE = int(os.environ.get('PROFILE_THUMBNAIL_SIZE', 96))
+SESSION_KEYS = os.environ.get('SESSION_KEYS', '')
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 30 * 24 * 60 * 60))
+TIMER_TICK = float(os.environ.get('TIMER_TICK', 0.05))
+TIMER_SLOTS = int(os.environ.get('TIMER_SLOTS', 1024))
+LOBBY_IDLE_TIMEOUT = float(os.environ.get('LOBBY_IDLE_TIMEOUT', 2 * 60 * 60))
+QUESTION_START_DELAY = float(os.environ.get('QUESTION_START_DELAY', 5))
+ANSWER_LOCK_GRACE = float(os.environ.get('ANSWER_LOCK_GRACE', 0.5))
+FRAME_TIMESTAMPS = os.environ.get('FRAME_TIMESTAMPS', '') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_LOBBY_LIMIT = int(os.environ.get('METRICS_LOBBY_LIMIT', 20))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+PROFILER_INTERVAL = float(os.environ.get('PROFILER_INTERVAL', 0.005))
+PROFILER_MAX_SECONDS = float(os.environ.get('PROFILER_MAX_SECONDS', 60))
+LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL', 0.25))
+SLOW_CALLBACK_THRESHOLD = float(os.environ.get('SLOW_CALLBACK_THRESHOLD', 0.1))
+SLOW_CALLBACK_LOG_SIZE = int(os.environ.get('SLOW_CALLBACK_LOG_SIZE', 100))
+SERVE_BIND = os.environ.get('SERVE_BIND', '0.0.0.0:5000')
+SERVE_WORKERS = int(os.environ.get('SERVE_WORKERS', 1))
+SERVE_KEEP_ALIVE = float(os.environ.get('SERVE_KEEP_ALIVE', 75))
+SERVE_BACKLOG = int(os.environ.get('SERVE_BACKLOG', 2048))
+# Profile images sent inline as data URLs are a third larger than the image
+SERVE_MAX_BODY_BYTES = int(os.environ.get('SERVE_MAX_BODY_BYTES', 2 * PROFILE_IMAGE_MAX_BYTES))
+SERVE_DRAIN_TIMEOUT = float(os.environ.get('SERVE_DRAIN_TIMEOUT', 15))
+SERVE_STARTUP_TIMEOUT = float(os.environ.get('SERVE_STARTUP_TIMEOUT', 30))
+SERVE_RECONNECT_SPREAD = float(os.environ.get('SERVE_RECONNECT_SPREAD', 10))
+WORKER_SOCKET_PATH = os.environ.get('WORKER_SOCKET_PATH', '/tmp/tv_quiz_party_worker_{}.sock')
+WORKER_INDEX = int(os.environ.get('WORKER_INDEX', 0))
+WORKER_COUNT = int(os.environ.get('WORKER_COUNT', 1))
+WEBSOCKET_COMPRESSION_MIN_BYTES = int(os.environ.get('WEBSOCKET_COMPRESSION_MIN_BYTES', 1024))
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import time
+
+# A hashed timer wheel: timers are hashed into slot_count slots by their
+# expiry tick, and every tick only the current slot is visited. Scheduling
+# and cancelling are O(1) however many timers there are. Timers further
+# away than one turn of the wheel wait for the rounds they need.
+class TimerWheel():
+    def __init__(self, tick, slot_count, clock=time.monotonic):
+        self.tick = tick
+        self.slots = [dict() for _ in range(slot_count)]
+        self.clock = clock
+        self.current_tick = int(clock() / tick)
+        self.timer_count = 0
+
+    def schedule(self, delay, callback, *args):
+        ticks = max(1, int(-(-delay // self.tick)))
+        expiry_tick = self.current_tick + ticks
+        timer = Timer(expiry_tick, callback, args)
+        self.slots[expiry_tick % len(self.slots)][timer] = None
+        self.timer_count += 1
+        return timer
+
+    def cancel(self, timer):
+        slot = self.slots[timer.expiry_tick % len(self.slots)]
+
+        if slot.pop(timer, False) is None:
+            self.timer_count -= 1
+
+    # Fires every timer due up to now, and returns how many fired
+    def advance(self):
+        now_tick = int(self.clock() / self.tick)
+        fired_count = 0
+
+        while self.current_tick < now_tick:
+            self.current_tick += 1
+            slot = self.slots[self.current_tick % len(self.slots)]
+            due = [timer for timer in slot if timer.expiry_tick <= self.current_tick]
+
+            for timer in due:
+                # An earlier callback may have cancelled it
+                if slot.pop(timer, False) is not None:
+                    continue
+
+                self.timer_count -= 1
+                fired_count += 1
+
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    logging.exception('Timer callback failed')
+
+        return fired_count
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            self.advance()
+
+
+class Timer():
+    __slots__ = ['expiry_tick', 'callback', 'args']
+
+    def __init__(self, expiry_tick, callback, args):
+        self.expiry_tick = expiry_tick
+        self.callback = callback
+        self.args = args
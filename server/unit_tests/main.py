@@ -1,6 +1,36 @@
+import asyncio
+import collections
+import json
+import os
+import re
+import tempfile
+import threading
+import time
 import unittest
 
+from wsproto.frame_protocol import FrameProtocol
+
+from app import app
+import auth
+import backend
+import broker
+import byte_cache
+import compression
+import diagnostics
+import fanout
+import handshake
+import journal
+import lobby
+import metrics
 import model
+import profile
+import question_bank
+import question_scheduler
+import router
+import scoring
+import serialization
+import settings
+import timer_wheel
 
 class UnitTests(unittest.IsolatedAsyncioTestCase):
     def test_create_answers_store(self):
@@ -11,7 +41,9 @@ class UnitTests(unittest.IsolatedAsyncioTestCase):
             k2: {}
         }
         store = model.create_answers_store(users)
-        self.assertIsNot(store[k1], store[k2])
+        store.record(k1, 0, '1')
+        self.assertEqual(store.get(k1, 0), '1')
+        self.assertIsNone(store.get(k2, 0))
 
     def test_update_leaderboard_positions(self):
         leaderboard = {
@@ -52,10 +84,772 @@ class UnitTests(unittest.IsolatedAsyncioTestCase):
             }
         })
 
+    def test_answers_store_keeps_api_shape(self):
+        store = model.create_answers_store(['p1', 'p2'])
+        store.record('p1', 0, '2')
+        store.add_user('p3')
+        store.record('p3', 1, '1')
+
+        for i in range(300):
+            store.record('p2', 0, 'answer {}'.format(i))
+
+        self.assertEqual(store.get('p1', 0), '2')
+        self.assertEqual(store.get('p2', 0), 'answer 299')
+        self.assertEqual(json.loads(serialization.dumps(store)), {
+            'p1': {'0': '2'},
+            'p2': {'0': 'answer 299'},
+            'p3': {'1': '1'}
+        })
+
+    def test_scoring_matches_with_and_without_numpy(self):
+        lobby = model.create_lobby('p0')
+        user_ids = ['p{}'.format(i) for i in range(1, 600)]
+        for user_id in user_ids:
+            model.add_user_to_lobby(user_id, lobby)
+
+        model.start_round(lobby, [{'correct_answer': '1'}, {'correct_answer': '2'}])
+        for i, user_id in enumerate(user_ids):
+            model.answer_question(lobby, user_id, 0, str(i % 3))
+            model.answer_question(lobby, user_id, 1, str(i % 4))
+
+        answers = lobby['round']['answers']
+        expected = [user_id for user_id in answers.user_ids if answers.get(user_id, 0) == '1']
+        numpy = scoring.numpy
+
+        try:
+            for scoring.numpy in [numpy, None]:
+                self.assertEqual(answers.matching_user_ids(0, '1'), expected)
+                model.rescore_round(lobby)
+                self.assertEqual(lobby['round']['leaderboard']['p1']['score'], 0)
+                self.assertEqual(lobby['round']['leaderboard']['p2']['score'], 1)
+                self.assertEqual(lobby['round']['leaderboard']['p3']['score'], 1)
+                self.assertEqual(lobby['round']['leaderboard']['p11']['score'], 2)
+        finally:
+            scoring.numpy = numpy
+            model.delete_lobby(lobby['id'])
+
+    async def test_question_bank_samples_by_index(self):
+        connection = question_bank.connection
+
+        def restore_connection():
+            question_bank.connection.close()
+            question_bank.connection = connection
+            question_bank.get_question.cache_clear()
+
+        # connect closes the connection it replaces, which other tests use
+        question_bank.connection = None
+        question_bank.connect(os.path.join(tempfile.mkdtemp(), 'questions.db'))
+        self.addCleanup(restore_connection)
+        question_bank.add_questions([
+            {
+                'video_id': 'video_{}'.format(i % 4),
+                'difficulty': i % 3,
+                'tags': ['even'] if i % 2 == 0 else [],
+                'correct_answer': str(i)
+            }
+            for i in range(100)
+        ])
+
+        self.assertEqual(question_bank.count_questions(), 103)
+        self.assertEqual(len(question_bank.sample_questions(10)), 10)
+
+        questions = question_bank.sample_questions(100, video_id = 'video_1', difficulty = 2)
+        self.assertEqual(len(questions), 8)
+        self.assertTrue(all(q['video_id'] == 'video_1' and int(q['correct_answer']) % 3 == 2 for q in questions))
+
+        questions = question_bank.sample_questions(5, tag = 'even')
+        self.assertEqual(len(questions), 5)
+        self.assertTrue(all(int(q['correct_answer']) % 2 == 0 for q in questions))
+        self.assertNotIn('tags', questions[0])
+
+        self.assertEqual(question_bank.sample_questions(5, tag = 'missing'), [])
+
+        loop = asyncio.get_event_loop()
+        questions = await loop.run_in_executor(question_bank.executor, question_bank.sample_questions, 5, 'video_2')
+        self.assertTrue(all(q['video_id'] == 'video_2' for q in questions))
+
+    async def test_start_round_changes_the_lobby_only_after_sampling(self):
+        sample_questions = question_bank.sample_questions
+        sampling = threading.Event()
+        sampled = threading.Event()
+
+        def slow_sample_questions(*args):
+            sampling.set()
+            sampled.wait(5)
+            return sample_questions(*args)
+
+        question_bank.sample_questions = slow_sample_questions
+        self.addCleanup(setattr, question_bank, 'sample_questions', sample_questions)
+        self.addCleanup(setattr, model, 'lobby_index', model.lobby_index)
+        loop = asyncio.get_event_loop()
+
+        async with app.test_app() as test_app:
+            client = test_app.test_client()
+            await client.post('/handshake', json = {})
+            await client.post('/update_profile', json = {'display_name': 'Host', 'image_data_url': 'data:image/png;base64,aW1hZ2U='})
+            lobby_id = (await (await client.post('/create_lobby')).get_json())['id']
+            lobby_url = '/lobby/{}'.format(lobby_id)
+            self.addCleanup(lambda: lobby_id in model.lobbies and model.delete_lobby(lobby_id))
+
+            starting = asyncio.ensure_future(client.post(lobby_url + '/start_round', json = {'count': 1}))
+            await loop.run_in_executor(None, sampling.wait, 5)
+
+            # Read while the questions are sampled
+            response = await client.get(lobby_url)
+            self.assertIsNone((await response.get_json()).get('round'))
+            etag = response.headers['ETag']
+
+            sampled.set()
+            self.assertEqual((await starting).status_code, 200)
+
+            response = await client.get(lobby_url, headers = {'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNotNone((await response.get_json())['round'])
+
+            # A lobby that closes while sampling is not given the round
+            sampling.clear()
+            sampled.clear()
+            starting = asyncio.ensure_future(client.post(lobby_url + '/start_round', json = {'count': 1}))
+            await loop.run_in_executor(None, sampling.wait, 5)
+            manifest_count = len(model.round_manifests)
+            model.delete_lobby(lobby_id)
+            sampled.set()
+            self.assertEqual((await starting).status_code, 404)
+            self.assertEqual(len(model.round_manifests), manifest_count - 1)
+
+    def test_leaderboard_ranks_users_incrementally(self):
+        leaderboard = model.create_leaderboard_store(['p1', 'p2', 'p3'])
+        self.assertEqual(model.update_leaderboard_positions(leaderboard), [])
+
+        leaderboard.add_points('p2', 2)
+        leaderboard.add_points('p3')
+        self.assertEqual(sorted(model.update_leaderboard_positions(leaderboard)), ['p1', 'p3'])
+        self.assertEqual(leaderboard.rank_of('p2'), 1)
+        self.assertEqual(leaderboard.rank_of('p1'), 3)
+        self.assertEqual(leaderboard.top(2), ['p2', 'p3'])
+
+        leaderboard.add_points('p3')
+        self.assertEqual(sorted(model.update_leaderboard_positions(leaderboard)), ['p1', 'p3'])
+        self.assertEqual(leaderboard['p1']['position'], 2)
+        self.assertEqual(leaderboard['p3']['position'], 1)
+
+        del leaderboard['p2']
+        leaderboard['p4'] = model.new_leaderboard_item()
+        model.update_leaderboard_positions(leaderboard)
+        self.assertEqual(json.loads(serialization.dumps(leaderboard)), {
+            'p1': {'score': 0, 'position': 2},
+            'p3': {'score': 2, 'position': 1},
+            'p4': {'score': 0, 'position': 2}
+        })
+
     def test_edit_lobby_can_find_by_join_code(self):
         lobby = model.create_lobby('foo')
         expected_same_lobby = model.edit_lobby(lobby['join_code'])
         self.assertIs(lobby, expected_same_lobby)
 
+    def test_user_lobby_index_follows_membership(self):
+        lobby = model.create_lobby('host')
+        model.add_user_to_lobby('guest', lobby)
+        self.assertIs(model.get_user_lobby('guest'), lobby)
+
+        model.remove_user_from_lobby('guest', lobby)
+        self.assertIsNone(model.get_user_lobby('guest'))
+
+        model.add_user_to_lobby('guest', lobby)
+        model.delete_lobby(lobby['id'])
+        self.assertIsNone(model.get_user_lobby('host'))
+        self.assertIsNone(model.get_user_lobby('guest'))
+        self.assertEqual(model.find_user_lobby_index_errors(), [])
+
+    def test_encoders_agree_and_lobby_encoding_is_cached(self):
+        lobby = model.create_lobby('host')
+        model.add_user_to_lobby('guest', lobby)
+        model.start_round(lobby, [{'video_id': 'v', 'correct_answer': '1'}])
+        model.answer_question(lobby, 'guest', 0, '1')
+
+        for name in serialization.encoders:
+            serialization.use_encoder(name)
+            self.assertEqual(json.loads(serialization.encode(lobby)), json.loads(serialization.encoders['json'](lobby)))
+
+            encoded = serialization.encode_with({'a': 1}, 'lobby', serialization.encode(lobby))
+            self.assertEqual(json.loads(encoded), {'a': 1, 'lobby': json.loads(serialization.encode(lobby))})
+
+        serialization.use_encoder('auto')
+
+        encoded = model.encode_lobby(lobby)
+        self.assertIs(model.encode_lobby(lobby), encoded)
+
+        model.remove_user_from_lobby('guest', model.edit_lobby(lobby['id']))
+        self.assertNotIn('guest', json.loads(model.encode_lobby(lobby))['users'])
+
+    def test_public_round_withholds_answers_until_question_ends(self):
+        lobby_index = model.lobby_index
+        lobby = model.create_lobby('host')
+        self.addCleanup(setattr, model, 'lobby_index', lobby_index)
+        self.addCleanup(model.delete_lobby, lobby['id'])
+        model.start_round(lobby, [{'correct_answer': '1'}, {'correct_answer': '2'}])
+        model.start_question(lobby, 0, 0)
+        model.answer_question(lobby, 'host', 0, '1')
+
+        round = model.public_round(lobby['round'])
+        self.assertNotIn('answers', round)
+        self.assertEqual(round['questions'], [{}, {}])
+
+        model.end_question(lobby, 0)
+        self.assertEqual(model.public_round(lobby['round'])['questions'], [{'correct_answer': '1'}, {}])
+
+        model.start_question(lobby, 1, 0)
+        model.end_question(lobby, 1)
+        self.assertEqual(json.loads(model.encode_lobby(model.edit_lobby(lobby['id'])))['previous_round']['questions'], [
+            {'correct_answer': '1'},
+            {'correct_answer': '2'}
+        ])
+
+    def test_image_collector_keeps_referenced_and_recent_images(self):
+        directory = tempfile.mkdtemp()
+        day_ago = time.time() - 24 * 60 * 60
+
+        os.mkdir(os.path.join(directory, 'thumbnails'))
+
+        for name in ['referenced.png', 'unreferenced.png', 'recent.png', 'thumbnails/referenced.png', 'thumbnails/unreferenced.png']:
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(b'image')
+            if name != 'recent.png':
+                os.utime(os.path.join(directory, name), (day_ago, day_ago))
+
+        removed_paths = profile.collect_images(directory, {'referenced.png'}, 60 * 60)
+
+        self.assertEqual(removed_paths, [
+            os.path.join(directory, 'unreferenced.png'),
+            os.path.join(directory, 'thumbnails', 'unreferenced.png')
+        ])
+        self.assertEqual(sorted(os.listdir(directory)), ['recent.png', 'referenced.png', 'thumbnails'])
+
+    async def test_thumbnail_failures_serve_the_image_without_decoding_again(self):
+        directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(directory, 'thumbnails'))
+        self.addCleanup(setattr, profile, 'PROFILE_IMAGES_PATH', profile.PROFILE_IMAGES_PATH)
+        self.addCleanup(setattr, profile, 'THUMBNAILS_PATH', profile.THUMBNAILS_PATH)
+        (profile.PROFILE_IMAGES_PATH, profile.THUMBNAILS_PATH) = (directory + '/{}', directory + '/thumbnails/{}')
+        self.addCleanup(setattr, profile.Image, 'MAX_IMAGE_PIXELS', profile.Image.MAX_IMAGE_PIXELS)
+        # Twice this many pixels is decoded as a decompression bomb
+        profile.Image.MAX_IMAGE_PIXELS = 10
+        self.addCleanup(profile.failed_thumbnails.clear)
+
+        profile.Image.new('RGB', (10, 10)).save(os.path.join(directory, 'bomb.png'))
+        with open(os.path.join(directory, 'broken.png'), 'wb') as f:
+            f.write(b'not an image')
+
+        create_thumbnail = profile.create_thumbnail
+        created = []
+        self.addCleanup(setattr, profile, 'create_thumbnail', create_thumbnail)
+        profile.create_thumbnail = lambda filename: created.append(filename) or create_thumbnail(filename)
+
+        async with app.test_app() as test_app:
+            client = test_app.test_client()
+            await client.post('/handshake', json = {})
+
+            for filename in ['bomb.png', 'broken.png'] * 2:
+                response = await client.get('/profile_images/thumbnails/{}'.format(filename))
+                self.assertEqual(response.status_code, 200)
+                with open(os.path.join(directory, filename), 'rb') as f:
+                    self.assertEqual(await response.get_data(), f.read())
+
+        self.assertEqual(created, ['bomb.png', 'broken.png'])
+        self.assertEqual(os.listdir(os.path.join(directory, 'thumbnails')), [])
+
+    def test_image_refresh_keeps_images_other_workers_refer_to(self):
+        directory = tempfile.mkdtemp()
+        day_ago = time.time() - 24 * 60 * 60
+
+        for name in ['elsewhere.png', 'unreferenced.png']:
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(b'image')
+            os.utime(os.path.join(directory, name), (day_ago, day_ago))
+
+        profile.refresh_images(directory, {'elsewhere.png', 'missing.png', None})
+        removed_paths = profile.collect_images(directory, set(), 60 * 60)
+
+        self.assertEqual(removed_paths, [os.path.join(directory, 'unreferenced.png')])
+
+    def test_session_tokens_rotate_expire_and_revoke(self):
+        (keys, signing_key_id) = (auth.keys, auth.signing_key_id)
+
+        try:
+            auth.keys = {'old': 'old secret'}
+            auth.signing_key_id = 'old'
+            (old_token, user_id) = auth.create_new_user()
+
+            auth.keys = {'new': 'new secret', 'old': 'old secret'}
+            auth.signing_key_id = 'new'
+            self.assertEqual(auth.authenticate_user(old_token), (old_token, user_id))
+            self.assertTrue(auth.needs_renewal(old_token))
+
+            new_token = auth.create_token(user_id)
+            self.assertFalse(auth.needs_renewal(new_token))
+
+            expired_token = auth.create_token(user_id, int(time.time()) - auth.settings.SESSION_TTL - 1)
+            for token in [expired_token, new_token[:-1], 'not a token', None]:
+                with self.assertRaises(ValueError):
+                    auth.authenticate_user(token)
+
+            auth.revoke_user(user_id)
+            with self.assertRaises(ValueError):
+                auth.authenticate_user(new_token)
+        finally:
+            (auth.keys, auth.signing_key_id) = (keys, signing_key_id)
+            auth.revoked_user_ids.clear()
+
+    def test_timer_wheel_fires_due_timers_across_turns(self):
+        now = [0.0]
+        wheel = timer_wheel.TimerWheel(1, 8, lambda: now[0])
+        fired = []
+
+        wheel.schedule(3, fired.append, 'soon')
+        wheel.schedule(20, fired.append, 'after two turns')
+        cancelled = wheel.schedule(5, fired.append, 'cancelled')
+        wheel.cancel(cancelled)
+
+        now[0] = 10
+        self.assertEqual(wheel.advance(), 1)
+        self.assertEqual(fired, ['soon'])
+
+        wheel.schedule(1, fired.append, 'next tick')
+        now[0] = 20
+        wheel.advance()
+        self.assertEqual(fired, ['soon', 'next tick', 'after two turns'])
+        self.assertEqual(wheel.timer_count, 0)
+
+    def test_question_timings_follow_the_video(self):
+        round = {
+            'questions': [{'start_time': 300.0, 'answer_lock_time': 320.0, 'end_time': 340.0}],
+            'current_question': {'i': 0, 'start_time': 1000.0, 'has_ended': False}
+        }
+
+        self.assertEqual(question_scheduler.answer_lock_wall_time(round), 1020.0)
+        self.assertEqual(question_scheduler.end_wall_time(round), 1040.0)
+        self.assertFalse(question_scheduler.answers_locked(round, 1020.0))
+        self.assertTrue(question_scheduler.answers_locked(round, 1021.0))
+
+        fired = []
+        timer_count = question_scheduler.lifecycle.wheel.timer_count
+        question_scheduler.schedule('lobby', time.time() + 60, fired.append, 'first')
+        question_scheduler.schedule('lobby', time.time() + 30, fired.append, 'second')
+        self.assertEqual(question_scheduler.lifecycle.wheel.timer_count, timer_count + 1)
+
+        question_scheduler.cancel('lobby')
+        self.assertEqual(question_scheduler.lifecycle.wheel.timer_count, timer_count)
+        self.assertNotIn('lobby', question_scheduler.question_timers)
+        self.assertEqual(fired, [])
+
+    async def test_ending_an_auto_advance_question_schedules_the_next(self):
+        lobby_index = model.lobby_index
+        lobby_data = model.create_lobby('host')
+        self.addCleanup(setattr, model, 'lobby_index', lobby_index)
+        self.addCleanup(model.delete_lobby, lobby_data['id'])
+        self.addCleanup(question_scheduler.cancel, lobby_data['id'])
+
+        question = {'start_time': 300.0, 'answer_lock_time': 320.0, 'end_time': 340.0, 'correct_answer': '1'}
+        model.start_round(lobby_data, [dict(question), dict(question)], True)
+        lobby.begin_question(lobby_data, 0, notify = False)
+
+        # Not yet ended, so the timer for the next question does nothing
+        lobby.start_next_question_on_time(lobby_data['id'], 0)
+        self.assertEqual(lobby_data['round']['current_question']['i'], 0)
+
+        lobby.end_and_advance(lobby_data, 0)
+        self.assertTrue(lobby_data['round']['current_question']['has_ended'])
+        self.assertIn(lobby_data['id'], question_scheduler.question_timers)
+
+        lobby.start_next_question_on_time(lobby_data['id'], 0)
+        self.assertEqual(lobby_data['round']['current_question']['i'], 1)
+        self.assertFalse(lobby_data['round']['current_question']['has_ended'])
+
+    def test_metrics_render_cumulative_histograms(self):
+        histogram = metrics.Histogram([0.1, 1])
+        for value in [0.05, 0.5, 0.5, 5]:
+            histogram.observe(value)
+
+        self.assertEqual(list(histogram.samples('latency', {'route': '/'})), [
+            ('latency_bucket', {'route': '/', 'le': 0.1}, 1),
+            ('latency_bucket', {'route': '/', 'le': 1}, 3),
+            ('latency_bucket', {'route': '/', 'le': '+Inf'}, 4),
+            ('latency_sum', {'route': '/'}, 6.05),
+            ('latency_count', {'route': '/'}, 4)
+        ])
+        self.assertEqual(metrics.format_labels({'code': 'a"b'}), '{code="a\\"b"}')
+
+    def test_stack_sampler_folds_stacks_of_a_thread(self):
+        stop = threading.Event()
+        counts = collections.Counter()
+
+        def busy():
+            while not stop.is_set():
+                pass
+
+        worker = threading.Thread(target = busy)
+        worker.start()
+        sampler = threading.Thread(target = diagnostics.sample_stacks, args = (worker.ident, 0.001, stop, counts))
+        sampler.start()
+        time.sleep(0.05)
+        stop.set()
+        sampler.join()
+        worker.join()
+
+        folded = diagnostics.fold(counts).splitlines()
+        self.assertTrue(folded)
+        self.assertTrue(all(line.split(' ')[-1].isdigit() for line in folded))
+        self.assertTrue(all(';busy (main.py:' in line for line in folded))
+
+    def test_router_pins_lobbies_to_the_worker_that_created_them(self):
+        (worker_index, worker_count, lobby_index) = (settings.WORKER_INDEX, settings.WORKER_COUNT, model.lobby_index)
+        (settings.WORKER_INDEX, settings.WORKER_COUNT) = (2, 3)
+
+        try:
+            lobby_ids = [model.next_lobby_id() for _ in range(3)]
+        finally:
+            (settings.WORKER_INDEX, settings.WORKER_COUNT, model.lobby_index) = (worker_index, worker_count, lobby_index)
+
+        self.assertEqual(lobby_ids, [3, 6, 9])
+        self.assertEqual([model.worker_for_lobby(i, 3) for i in lobby_ids], [2, 2, 2])
+
+        round_robin = iter(range(100))
+        choose = lambda method, target, headers={}, body=b'': router.choose_worker(method, target, headers, body, 3, round_robin)
+        self.assertEqual(choose('GET', '/lobby/5/ws'), 1)
+        self.assertEqual(choose('POST', '/lobby/6/answer_question'), 2)
+        self.assertEqual(choose('POST', '/join_lobby', body = b'{"join_code": 4}'), 0)
+        self.assertEqual(choose('GET', '/round/abc/questions?lobby_id=8'), 1)
+        self.assertEqual(choose('POST', '/handshake', {'cookie': 'secret_token=t; lobby_id=9'}), 2)
+        self.assertEqual(choose('GET', '/metrics?worker=1'), 1)
+
+        token_cookie = {'cookie': 'secret_token=key.user_1.sig'}
+        self.assertEqual(choose('POST', '/update_profile', token_cookie), choose('POST', '/create_lobby', token_cookie))
+        self.assertEqual([choose('POST', '/handshake'), choose('POST', '/join_lobby', body = b'{}')], [0, 1])
+
+    async def test_router_streams_bodies_and_rejects_large_ones(self):
+        socket_path = os.path.join(tempfile.mkdtemp(), 'worker_{}.sock')
+        body = b'0' * (router.READ_SIZE + 1)
+        head_received = asyncio.Event()
+        bodies = []
+
+        async def handle_upstream(reader, writer):
+            await reader.readuntil(b'\r\n\r\n')
+            head_received.set()
+            bodies.append(await reader.readexactly(len(body)))
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+            await writer.drain()
+
+        worker = await asyncio.start_unix_server(handle_upstream, socket_path.format(0))
+        server = await router.Router(1, socket_path).serve('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+
+        try:
+            (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+            writer.write('POST /profile_image HTTP/1.1\r\nContent-Length: {}\r\n\r\n'.format(len(body)).encode())
+            await asyncio.wait_for(head_received.wait(), 1)
+            writer.write(body)
+            self.assertTrue((await reader.readuntil(b'\r\n\r\n')).startswith(b'HTTP/1.1 200'))
+            self.assertEqual(bodies, [body])
+            writer.close()
+
+            (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+            writer.write('POST /profile_image HTTP/1.1\r\nContent-Length: {}\r\n\r\n'.format(settings.SERVE_MAX_BODY_BYTES + 1).encode())
+            self.assertTrue((await reader.read()).startswith(b'HTTP/1.1 413'))
+            writer.close()
+        finally:
+            server.close()
+            worker.close()
+
+    async def test_router_passes_on_interim_responses(self):
+        socket_path = os.path.join(tempfile.mkdtemp(), 'worker_{}.sock')
+
+        # As Hypercorn does, 100 Continue is sent once the head is read
+        async def handle_upstream(reader, writer):
+            head = await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            length = int(re.search(rb'Content-Length: (\d+)', head).group(1))
+            body = await reader.readexactly(length)
+            writer.write('HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n'.format(len(body)).encode() + body)
+            await writer.drain()
+
+        worker = await asyncio.start_unix_server(handle_upstream, socket_path.format(0))
+        server = await router.Router(1, socket_path).serve('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+
+        try:
+            for (path, body) in [('/profile_image', b'image'), ('/join_lobby', b'{"join_code": "1"}')]:
+                (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+                writer.write('POST {} HTTP/1.1\r\nContent-Length: {}\r\nExpect: 100-continue\r\n\r\n'.format(path, len(body)).encode())
+
+                # The body is only sent once the client is told to continue
+                self.assertEqual(await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 1), b'HTTP/1.1 100 Continue\r\n\r\n')
+                writer.write(body)
+
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 1)
+
+                # join_lobby is continued by the router, and then the worker
+                if head.startswith(b'HTTP/1.1 100'):
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 1)
+
+                self.assertTrue(head.startswith(b'HTTP/1.1 200'))
+                self.assertEqual(await reader.readexactly(len(body)), body)
+                writer.close()
+        finally:
+            server.close()
+            worker.close()
+
+    def test_byte_cache_evicts_least_recently_used(self):
+        cache = byte_cache.ByteCache(10, 6)
+        cache.put('a', b'aaaa')
+        cache.put('b', b'bbbb')
+        cache.get('a')
+        cache.put('c', b'cccc')
+        cache.put('too_large', b'1234567')
+
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNone(cache.get('too_large'))
+        self.assertEqual(cache.get('a'), b'aaaa')
+        self.assertEqual(cache.size, 8)
+
+    async def test_publish_shares_one_encoded_frame(self):
+        queues = [fanout.Subscriber(), fanout.Subscriber()]
+        frame = fanout.encode_frame('USER_JOINED', {'user_id': 'foo'})
+        await fanout.publish(queues, frame)
+
+        first = await queues[0].get()
+        second = await queues[1].get()
+        self.assertIs(first.text, second.text)
+        self.assertEqual(json.loads(first.text), {
+            'code': 'USER_JOINED',
+            'data': {'user_id': 'foo'}
+        })
+
+    async def test_subscriber_coalesces_superseded_state(self):
+        subscriber = fanout.Subscriber(max_size=2, policy='coalesce')
+        subscriber.put(fanout.encode_frame('LEADERBOARD_UPDATED', {'v': 1}, 'leaderboard'))
+        subscriber.put(fanout.encode_frame('ANSWER_RECEIVED', {}))
+        subscriber.put(fanout.encode_frame('LEADERBOARD_UPDATED', {'v': 2}, 'leaderboard'))
+
+        self.assertEqual((await subscriber.get()).code, 'ANSWER_RECEIVED')
+        self.assertEqual((await subscriber.get()).data, {'v': 2})
+        self.assertEqual(subscriber.stats.coalesced, 1)
+        self.assertEqual(subscriber.stats.high_water_mark, 2)
+
+    async def test_subscriber_hands_over_all_queued_frames_as_one_batch(self):
+        subscriber = fanout.Subscriber()
+        subscriber.put(fanout.encode_frame('LEADERBOARD_UPDATED', {'v': 1}))
+        subscriber.put(fanout.encode_frame('ROUND_ENDED', {}))
+
+        frames = await subscriber.get_all()
+        self.assertEqual(subscriber.qsize(), 0)
+        self.assertEqual([frame['code'] for frame in json.loads(fanout.encode_batch(frames))], ['LEADERBOARD_UPDATED', 'ROUND_ENDED'])
+        self.assertEqual(fanout.encode_batch(list(frames)[:1]), frames[0].text)
+
+    def test_websocket_deflate_skips_small_messages(self):
+        extension = compression.ThresholdDeflate()
+        extension.finalize('permessage-deflate')
+        protocol = FrameProtocol(client = False, extensions = [extension])
+        rsv1 = 0x40
+
+        small = protocol.send_data('x' * (settings.WEBSOCKET_COMPRESSION_MIN_BYTES - 1))
+        large = protocol.send_data('x' * settings.WEBSOCKET_COMPRESSION_MIN_BYTES * 4)
+
+        self.assertFalse(small[0] & rsv1)
+        self.assertTrue(large[0] & rsv1)
+        self.assertLess(len(large), settings.WEBSOCKET_COMPRESSION_MIN_BYTES)
+
+    async def test_full_subscriber_resyncs_but_keeps_control_frames(self):
+        subscriber = fanout.Subscriber(max_size=2, policy='resync')
+        subscriber.put(fanout.encode_frame('ANSWER_RECEIVED', {}))
+        subscriber.put(fanout.encode_frame('RELEASE_USER', {'user_id': 'foo'}))
+        subscriber.put(fanout.encode_frame('ANSWER_RECEIVED', {}))
+
+        codes = [(await subscriber.get()).code for _ in range(3)]
+        self.assertEqual(codes, ['RELEASE_USER', 'RESYNC_REQUIRED', 'ANSWER_RECEIVED'])
+        self.assertEqual(subscriber.stats.dropped, 1)
+
+    async def test_full_subscriber_disconnects(self):
+        subscriber = fanout.Subscriber(max_size=1, policy='disconnect')
+        subscriber.put(fanout.encode_frame('ANSWER_RECEIVED', {}))
+        subscriber.put(fanout.encode_frame('ANSWER_RECEIVED', {}))
+        subscriber.put(fanout.encode_frame('ANSWER_RECEIVED', {}))
+
+        self.assertEqual((await subscriber.get()).code, 'SLOW_CONSUMER')
+        self.assertEqual(subscriber.qsize(), 0)
+        self.assertEqual(subscriber.stats.disconnects, 1)
+
+    async def test_broker_backend_relays_frames_between_workers(self):
+        socket_path = os.path.join(tempfile.mkdtemp(), 'broker.sock')
+        server = await broker.serve(socket_path)
+        received = asyncio.Queue()
+
+        async def deliver_remote(lobby_id, frame, audience):
+            await received.put((lobby_id, frame, audience))
+
+        async def deliver_local(lobby_id, frame, audience):
+            pass
+
+        publisher = backend.BrokerBackend(deliver_local, socket_path)
+        subscriber = backend.BrokerBackend(deliver_remote, socket_path)
+        await publisher.start()
+        await subscriber.start()
+        await subscriber.subscribe(7)
+        await asyncio.sleep(0.05)
+
+        frame = fanout.encode_frame('RELEASE_USER', {'user_id': 'foo'})
+        await publisher.publish(7, frame, ('answer_batch', False))
+
+        (lobby_id, relayed_frame, audience) = await asyncio.wait_for(received.get(), 1)
+        self.assertEqual(lobby_id, 7)
+        self.assertEqual(relayed_frame, frame)
+        self.assertEqual(audience, ('answer_batch', False))
+
+        await publisher.stop()
+        await subscriber.stop()
+        server.close()
+
+    async def test_remote_lobby_queues_close_with_their_last_socket(self):
+        self.addCleanup(setattr, settings, 'WORKER_COUNT', settings.WORKER_COUNT)
+        settings.WORKER_COUNT = 2
+
+        # Held by this worker, so not remote
+        with self.assertRaises(KeyError):
+            lobby.open_remote_lobby_queues(1001)
+
+        lobby.open_remote_lobby_queues(1002)
+        self.addCleanup(lobby.all_lobby_queues.pop, 1002, None)
+        lobby.all_lobby_queues[1002]['user'] = fanout.Subscriber([], lobby.all_lobby_queue_stats[1002])
+
+        await lobby.close_remote_lobby_queues(1002)
+        self.assertIn(1002, lobby.all_lobby_queues)
+
+        del lobby.all_lobby_queues[1002]['user']
+        await lobby.close_remote_lobby_queues(1002)
+        self.assertNotIn(1002, lobby.all_lobby_queues)
+        self.assertNotIn(1002, lobby.all_lobby_queue_stats)
+
+    async def test_metrics_list_queue_pressure_per_lobby(self):
+        self.addCleanup(setattr, settings, 'METRICS_LOBBY_LIMIT', settings.METRICS_LOBBY_LIMIT)
+        settings.METRICS_LOBBY_LIMIT = 1
+
+        for lobby_id in [9001, 9002]:
+            lobby.all_lobby_queue_stats[lobby_id] = fanout.QueueStats()
+            lobby.all_lobby_queues[lobby_id] = {
+                'user': fanout.Subscriber([], lobby.all_lobby_queue_stats[lobby_id], max_size = 3, policy = 'coalesce')
+            }
+            self.addCleanup(lobby.all_lobby_queues.pop, lobby_id, None)
+            self.addCleanup(lobby.all_lobby_queue_stats.pop, lobby_id, None)
+
+        queue = lobby.all_lobby_queues[9001]['user']
+        queue.put(fanout.encode_frame('LOBBY_STATE', {}, 'lobby'))
+        queue.put(fanout.encode_frame('LOBBY_STATE', {}, 'lobby'))
+        queue.put(fanout.encode_frame('USER_JOINED', {}))
+        queue.put(fanout.encode_frame('USER_JOINED', {}))
+        queue.put(fanout.encode_frame('USER_JOINED', {}))
+
+        async with app.test_app() as test_app:
+            text = await (await test_app.test_client().get('/metrics')).get_data(as_text = True)
+
+        self.assertIn('lobby_queue_high_water_mark{lobby_id="9001"} 3', text)
+        self.assertIn('lobby_slow_consumer_events_total{lobby_id="9001",kind="coalesced"} 1', text)
+        self.assertIn('lobby_slow_consumer_events_total{lobby_id="9001",kind="dropped"} 3', text)
+        self.assertIn('lobby_slow_consumer_events_total{lobby_id="9001",kind="resyncs"} 1', text)
+        self.assertIn('lobby_slow_consumer_events_total{lobby_id="9001",kind="disconnects"} 0', text)
+        # Only the lobby with the most frames waiting is listed
+        self.assertNotIn('lobby_id="9002"', text)
+
+    async def test_broker_backend_relays_large_frames_and_reconnects(self):
+        self.addCleanup(setattr, settings, 'BROKER_RECONNECT_DELAY', settings.BROKER_RECONNECT_DELAY)
+        settings.BROKER_RECONNECT_DELAY = 0.01
+        socket_path = os.path.join(tempfile.mkdtemp(), 'broker.sock')
+        server = await broker.serve(socket_path)
+        received = asyncio.Queue()
+
+        async def deliver_remote(lobby_id, frame, audience):
+            await received.put(frame)
+
+        async def deliver_local(lobby_id, frame, audience):
+            pass
+
+        publisher = backend.BrokerBackend(deliver_local, socket_path)
+        subscriber = backend.BrokerBackend(deliver_remote, socket_path)
+        await publisher.start()
+        await subscriber.start()
+        await subscriber.subscribe(7)
+        await asyncio.sleep(0.05)
+
+        # Over asyncio's default line limit of 64 KiB
+        frame = fanout.encode_frame('LEADERBOARD_UPDATED', {'leaderboard': 'x' * 100 * 1024})
+        await publisher.publish(7, frame)
+        self.assertEqual((await asyncio.wait_for(received.get(), 1)).text, frame.text)
+
+        # The subscriber subscribes again once it has reconnected
+        subscriber.writer.transport.abort()
+        await asyncio.sleep(0.1)
+
+        frame = fanout.encode_frame('ROUND_ENDED', {})
+        await publisher.publish(7, frame)
+        self.assertEqual((await asyncio.wait_for(received.get(), 1)).text, frame.text)
+
+        await publisher.stop()
+        await subscriber.stop()
+        server.close()
+
+    async def test_journal_restores_snapshot_and_tail(self):
+        journal_dir = tempfile.mkdtemp()
+        dump_compact = lambda o: sorted(o) if isinstance(o, set) else o.to_json()
+        empty_state = {'lobby_index': 0, 'lobbies': {}, 'profiles': {}, 'user_lobby_ids': {}, 'round_manifests': {}}
+        journal.restore(journal_dir)
+
+        try:
+            lobby = model.create_lobby('host')
+            model.add_user_to_lobby('guest', model.edit_lobby(lobby['id']))
+            model.start_round(model.edit_lobby(lobby['id']), [{'correct_answer': '1'}, {'correct_answer': '2'}])
+            await journal.snapshot()
+
+            model.start_question(model.edit_lobby(lobby['id']), 0, 1234.5)
+            model.answer_question(model.edit_lobby(lobby['id']), 'guest', 0, '1')
+            model.end_question(model.edit_lobby(lobby['id']), 0)
+            model.update_profile('guest', 'Guest', 'guest.png')
+            await journal.flush()
+
+            expected = json.dumps(model.dump_state(), default=dump_compact, sort_keys=True)
+            model.load_state(empty_state)
+
+            journal.restore(journal_dir)
+            self.assertEqual(json.dumps(model.dump_state(), default=dump_compact, sort_keys=True), expected)
+            self.assertEqual(model.lobbies[lobby['id']]['round']['leaderboard'].seq, 1)
+        finally:
+            journal.directory = None
+            model.load_state(empty_state)
+
+    async def test_journal_replays_lobby_ids_under_other_worker_settings(self):
+        journal_dir = tempfile.mkdtemp()
+        empty_state = {'lobby_index': 0, 'lobbies': {}, 'profiles': {}, 'user_lobby_ids': {}, 'round_manifests': {}}
+        (worker_index, worker_count) = (settings.WORKER_INDEX, settings.WORKER_COUNT)
+        (settings.WORKER_INDEX, settings.WORKER_COUNT) = (1, 2)
+        model.load_state(empty_state)
+        journal.restore(journal_dir)
+
+        try:
+            first = model.create_lobby('first_host')
+            second = model.create_lobby('second_host')
+            model.add_user_to_lobby('guest', model.edit_lobby(second['id']))
+            await journal.flush()
+            self.assertEqual((first['id'], second['id']), (2, 4))
+
+            model.load_state(empty_state)
+            settings.WORKER_COUNT = 4
+            journal.restore(journal_dir)
+
+            self.assertEqual(sorted(model.lobbies), [2, 4])
+            self.assertEqual(model.lobbies[4]['host_id'], 'second_host')
+            self.assertIn('guest', model.lobbies[4]['users'])
+            self.assertNotIn(model.create_lobby('third_host')['id'], [2, 4])
+        finally:
+            (settings.WORKER_INDEX, settings.WORKER_COUNT) = (worker_index, worker_count)
+            journal.directory = None
+            model.load_state(empty_state)
+
 if __name__ == "__main__":
     unittest.main()